@@ -1,13 +1,46 @@
+import os
+import sys
 from datetime import datetime
 
-import akshare as ak
 import backtrader as bt
 import matplotlib.pyplot as plt  # 由于 Backtrader 的问题，此处要求 pip install matplotlib==3.2.2
-import pandas as pd
 
 plt.rcParams["font.sans-serif"] = ["SimHei"]  # 设置画图时的中文显示
 plt.rcParams["axes.unicode_minus"] = False  # 设置画图时的负号显示
 
+# 设置该环境变量(共享内存名称或面板目录)时, 直接挂载已发布的K线面板, 不再从 AKShare 下载
+PANEL_ENV = 'EASYQUANT_PANEL'
+
+
+def load_panel_data(code):
+    """
+    从已发布的K线面板只读读取单个标的, 见 easyquant.panel
+    :return: 以日期为索引的 DataFrame, 数据与共享内存共用
+    """
+    _add_app_path()
+    from easyquant.panel import open_panel
+
+    # PandasData 按列名取字段, 不重排列以免复制
+    return open_panel(os.environ[PANEL_ENV]).symbol_frame(code)
+
+
+def load_history_data(code, start_date='20000101', end_date='20210617'):
+    """
+    后复权日线, 见 easyquant.history_store
+    :return: 以日期为索引的 DataFrame
+    """
+    _add_app_path()
+    from easyquant.history_store import HistoryStore
+
+    return HistoryStore().frame(code, start_date, end_date, adjust='hfq')
+
+
+def _add_app_path():
+    # app 目录放在最后, 避免本目录名 backtrader 遮蔽 backtrader 包
+    app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if app_dir not in sys.path:
+        sys.path.append(app_dir)
+
 
 class MyStrategy(bt.Strategy):
     """
@@ -108,21 +141,11 @@ class MyStrategy(bt.Strategy):
 def main(code="600070", start_cash=1000000, stake=100, commission_fee=0.001):
     cerebro = bt.Cerebro()  # 创建主控制器
     cerebro.optstrategy(MyStrategy, maperiod=range(3, 31))  # 导入策略参数寻优
-    # 利用 AKShare 获取股票的后复权数据，这里只获取前 7 列
-    stock_hfq_df = ak.stock_zh_a_hist(symbol=code, adjust="hfq", start_date='20000101', end_date='20210617').iloc[:, :7]
-    # 删除 `股票代码` 列
-    del stock_hfq_df['股票代码']
-    # 处理字段命名，以符合 Backtrader 的要求
-    stock_hfq_df.columns = [
-        'date',
-        'open',
-        'close',
-        'high',
-        'low',
-        'volume',
-    ]
-    # 把 date 作为日期索引，以符合 Backtrader 的要求
-    stock_hfq_df.index = pd.to_datetime(stock_hfq_df['date'])
+    if os.environ.get(PANEL_ENV):
+        stock_hfq_df = load_panel_data(code)
+    else:
+        # 利用 AKShare 获取股票的后复权数据, 经本地历史库缓存, 只下载本地缺失的日期
+        stock_hfq_df = load_history_data(code)
     start_date = datetime(1991, 4, 3)  # 回测开始时间
     end_date = datetime(2021, 6, 16)  # 回测结束时间
     data = bt.feeds.PandasData(dataname=stock_hfq_df, fromdate=start_date, todate=end_date)  # 规范化数据格式
@@ -0,0 +1,14 @@
+# coding: utf-8
+import os
+import sys
+
+# 交易热路径的基准测试, 不联网运行, 行情接口的返回取自录制的 payloads 目录, 未录制时按固定种子生成
+# 在项目根目录下执行:
+#   python -m app.benchmarks run -o app/benchmarks/results/base.json
+#   python -m app.benchmarks compare app/benchmarks/results/base.json app/benchmarks/results/new.json
+#   python -m app.benchmarks record    # 联网录制一次真实的行情接口返回
+
+_APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# easyquant 内部以 easyquant. 绝对导入, app 目录需在 sys.path 中
+if _APP_DIR not in sys.path:
+    sys.path.append(_APP_DIR)
@@ -0,0 +1,54 @@
+# coding: utf-8
+import argparse
+import sys
+
+from . import cases, payloads
+from .harness import BENCHMARKS, compare, format_compare, load, run, save
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m app.benchmarks', description='交易热路径基准测试')
+    sub = parser.add_subparsers(dest='command')
+
+    run_parser = sub.add_parser('run', help='运行基准')
+    run_parser.add_argument('names', nargs='*', help='只运行名称包含这些字符串的基准')
+    run_parser.add_argument('-o', '--output', help='结果保存为 JSON')
+    run_parser.add_argument('--repeat', type=int, default=5, help='重复次数')
+    run_parser.add_argument('--min-time', type=float, default=0.2, help='每次重复至少运行的秒数')
+
+    compare_parser = sub.add_parser('compare', help='对比两次结果, 有变慢的基准时退出码为 1')
+    compare_parser.add_argument('base', help='基准结果 JSON')
+    compare_parser.add_argument('new', help='新结果 JSON')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='中位数耗时变化超过该比例才标记')
+
+    record_parser = sub.add_parser('record', help='联网录制行情接口返回到 payloads 目录')
+    record_parser.add_argument('names', nargs='*', default=list(payloads.NAMES), help='要录制的 payload')
+
+    sub.add_parser('list', help='列出基准')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        synthetic = [name for name in payloads.NAMES if not payloads.is_recorded(name)]
+        if synthetic:
+            print('未录制的 payload 使用生成数据: %s' % ', '.join(synthetic))
+        result = run(args.names, repeat=args.repeat, min_time=args.min_time)
+        result['meta']['synthetic_payloads'] = synthetic
+        if args.output:
+            save(result, args.output)
+            print('结果已保存到 %s' % args.output)
+    elif args.command == 'compare':
+        rows = compare(load(args.base), load(args.new), args.threshold)
+        print(format_compare(rows))
+        if any(row[-1] == 'regression' for row in rows):
+            sys.exit(1)
+    elif args.command == 'record':
+        print('已录制: %s' % ', '.join(payloads.record(args.names)))
+    elif args.command == 'list':
+        for name, setup in BENCHMARKS.items():
+            print('%-28s %s' % (name, (setup.__doc__ or '').strip()))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+# coding: utf-8
+import datetime
+import json
+import logging
+import threading
+import types
+
+import numpy as np
+import pandas as pd
+
+from . import payloads
+from .harness import benchmark
+
+# 各热路径的基准, 模块在准备函数内导入, 缺少某个依赖时只有对应的基准失败
+
+# 合成K线面板的规模
+PANEL_SYMBOLS = 50
+PANEL_DAYS = 250
+
+
+def _trade_days(n, end=datetime.date(2025, 3, 31)):
+    days = pd.bdate_range(end=end, periods=n)
+    return [d.date() for d in days]
+
+
+def _panel(symbols, days):
+    from easyquant.panel import BarPanel
+
+    rng = np.random.default_rng(payloads.SEED)
+    close = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, (len(days), len(symbols))), axis=0))
+    open_ = close * (1 + rng.normal(0, 0.005, close.shape))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.01, close.shape)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.01, close.shape)))
+    volume = rng.integers(1e5, 1e7, close.shape).astype(np.float64)
+    values = np.stack([open_, high, low, close, volume], axis=2)
+    times = pd.DatetimeIndex(days).values
+    return BarPanel(times, symbols, ['open', 'high', 'low', 'close', 'volume'], values)
+
+
+def _symbols(n):
+    return ['%06d' % (600000 + i) for i in range(n)]
+
+
+def _frame(name):
+    return pd.DataFrame(json.loads(payloads.load(name))['data']['diff'])
+
+
+@benchmark('eastmoney_decode')
+def eastmoney_decode():
+    """一次 handlebar 中各接口返回的 JSON 解析并转为 DataFrame"""
+    names = ('board_top_ten', 'board_cons', 'sh_rank', 'sz_rank', 'sh_speed_rank', 'sz_speed_rank')
+    raw = [payloads.load(name) for name in names]
+
+    def run():
+        for body in raw:
+            pd.DataFrame(json.loads(body)['data']['diff'])
+    return run, len(raw)
+
+
+@benchmark('first_board_screen')
+def first_board_screen():
+    """首板筛选链: 去重、排除涨跌停 / ST / 科创板、市值和涨幅过滤、与涨幅榜涨速榜取交集"""
+    from app.first_board import screen_stocks
+
+    board_ids = json.loads(payloads.load('board_top_ten'))['data']['diff']
+    cons = []
+    for board in board_ids:
+        df = _frame('board_cons')
+        df['board_id'] = board['f12']
+        cons.append(df)
+    board_concept_stocks_df = pd.concat(cons, ignore_index=True)
+    stock_gain_df = pd.concat([_frame('sh_rank'), _frame('sz_rank')])
+    stock_speed_df = pd.concat([_frame('sh_speed_rank'), _frame('sz_speed_rank')])
+    yesterday = pd.DataFrame({'c': list(stock_gain_df['f12'][::7])})
+    dt = pd.DataFrame({'c': list(stock_gain_df['f12'][3::11])})
+    context = types.SimpleNamespace(get_today_buy_stocks=lambda: list(board_concept_stocks_df['f12'][:2]))
+
+    def run():
+        screen_stocks(context, yesterday, dt, board_concept_stocks_df, stock_gain_df, stock_speed_df)
+    return run, 1
+
+
+@benchmark('stock_cache_membership')
+def stock_cache_membership():
+    """StockCache 中今日已买股票、板块买入数量和交易日的判断, 每只候选股票一次"""
+    from app.core.stock_cache import StockCache
+    from easyquant.easydealutils.time import get_trade_calendar
+
+    # 每次调用都有 info 日志, 基准中不输出到文件和控制台
+    cache_logger = logging.getLogger('app.core.stock_cache')
+    level = cache_logger.level
+    cache_logger.setLevel(logging.WARNING)
+    saved = (StockCache.TODAY_BUY_STOCKS, StockCache.TODAY_BUY_BOARD_IDS)
+
+    calendar = get_trade_calendar()
+    calendar.update(_trade_days(PANEL_DAYS))
+    codes = list(_frame('sh_rank')['f12']) + list(_frame('sz_rank')['f12'])
+    boards = [board['f12'] for board in json.loads(payloads.load('board_top_ten'))['data']['diff']]
+    StockCache.TODAY_BUY_STOCKS = codes[::10]
+    StockCache.TODAY_BUY_BOARD_IDS = {board: 1 for board in boards[::2]}
+    today = datetime.datetime(2025, 3, 31, 9, 45)
+
+    def run():
+        for i, code in enumerate(codes):
+            code in StockCache.get_today_buy_stocks()
+            StockCache.get_today_buy_board_id(boards[i % len(boards)])
+            StockCache.is_trade_date(today)
+
+    def teardown():
+        StockCache.TODAY_BUY_STOCKS, StockCache.TODAY_BUY_BOARD_IDS = saved
+        cache_logger.setLevel(level)
+    return run, len(codes), teardown
+
+
+@benchmark('event_engine_dispatch')
+def event_engine_dispatch():
+    """EventEngine 投递到处理函数执行完成的吞吐, 每批 1000 个事件"""
+    from easyquant.event_engine import Event, EventEngine
+
+    n = 1000
+    engine = EventEngine()
+    lock = threading.Lock()
+    done = threading.Event()
+    state = {'count': 0}
+
+    def handler(event):
+        with lock:
+            state['count'] += 1
+            if state['count'] == n:
+                done.set()
+
+    engine.register('bench', handler)
+    engine.start()
+    events = [Event('bench', i) for i in range(n)]
+
+    def run():
+        state['count'] = 0
+        done.clear()
+        for event in events:
+            engine.put(event)
+        if not done.wait(60):
+            raise RuntimeError('事件未在 60 秒内处理完')
+    return run, n, engine.stop
+
+
+@benchmark('clock_engine_tick')
+def clock_engine_tick():
+    """ClockEngine 一次 tock 的耗时, 在默认的开盘 / 收盘等时刻时钟之外注册 200 个间隔时钟、200 个时刻时钟和 200 个每日任务"""
+    from easyquant.easydealutils.time import get_trade_calendar
+    from easyquant.push_engine.clock_engine import ClockEngine
+
+    # 时刻时钟需要查找之后的交易日, 日历覆盖到今天之后
+    get_trade_calendar().update(_trade_days(PANEL_DAYS, end=datetime.date.today() + datetime.timedelta(days=90)))
+
+    class _NullEventEngine:
+        def put(self, event):
+            pass
+
+    # 每日任务只用到 context.current_dt
+    context = types.SimpleNamespace(current_dt=datetime.datetime.now())
+    engine = ClockEngine(_NullEventEngine(), context)
+    engine.trading_state = True
+    for i in range(200):
+        engine.register_interval(1 + i / 60)
+        engine.register_moment('m%d' % i, datetime.time(9 + i % 6, i % 60), makeup=False)
+        engine.run_daily(lambda ctx: None, '%02d:%02d' % (9 + i % 6, i % 60))
+    return engine.tock, 1
+
+
+@benchmark('jqdata_get_bars_cache')
+def jqdata_get_bars_cache():
+    """JQDataQuotation.get_bars 命中K线内存缓存时的耗时, 50 只股票各取 60 根日线"""
+    from easyquant.bar_cache import BarCache
+    from easyquant.quotation import JQDataQuotation
+
+    # 不登录 jqdata, 只走缓存读取
+    quotation = JQDataQuotation.__new__(JQDataQuotation)
+    quotation.cache = BarCache()
+    quotation.store = None
+    symbols = _symbols(PANEL_SYMBOLS)
+    days = _trade_days(PANEL_DAYS)
+    panel = _panel(symbols, days)
+    end_dt = datetime.datetime.combine(days[-1], datetime.time())
+    query_tag = (end_dt + datetime.timedelta(days=1)).strftime('%Y-%m-%d')
+    for symbol in symbols:
+        df = panel.symbol_frame(symbol)
+        df['date'] = df.index
+        quotation.cache.put(quotation._format_code(symbol), '1d', df, start=df.index[0], end=query_tag)
+
+    def run():
+        for symbol in symbols:
+            quotation.get_bars(symbol, 60, unit='1d', end_dt=end_dt)
+    return run, len(symbols)
+
+
+@benchmark('backtest_bars')
+def backtest_bars():
+    """BackTestEngine 日线回测, 以面板为行情、MatchingTrader 撮合, 统计每秒处理的K线数(标的 × 交易日)"""
+    from easyquant.backtest_engine import BackTestEngine
+    from easyquant.easydealutils.time import get_trade_calendar
+    from easyquant.strategy.strategyTemplate import StrategyTemplate
+
+    symbols = _symbols(PANEL_SYMBOLS)
+    days = _trade_days(60)
+    panel = _panel(symbols, days)
+    get_trade_calendar().update(days)
+
+    class MomentumStrategy(StrategyTemplate):
+        name = 'benchmark'
+
+        def on_bar(self, context, data):
+            # 收盘价高于 5 日均价买入一手, 否则卖出
+            for symbol, df in data.items():
+                close = df['close'].values
+                if len(close) < 5:
+                    continue
+                if close[-1] > close[-5:].mean():
+                    self.user.buy(symbol, price=close[-1], amount=100)
+                else:
+                    self.user.sell(symbol, price=close[-1], amount=100)
+
+    def run():
+        engine = BackTestEngine(MomentumStrategy, days[0].strftime('%Y-%m-%d'), days[-1].strftime('%Y-%m-%d'),
+                                bar_type='1d', panel=panel, broker='matching')
+        # QuotationEngine.stocks 为类属性, 每个引擎使用自己的列表
+        engine.quotation_engine.stocks = list(symbols)
+        engine.start()
+    return run, len(symbols) * len(days)
@@ -0,0 +1,174 @@
+# coding: utf-8
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+# 基准注册、计时、结果保存和两次结果的对比
+
+# 名称 -> 准备函数
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name):
+    """
+    注册基准
+    被装饰的函数完成数据准备, 返回 (无参的被测函数, 每次调用完成的操作数[, 清理函数]), 只有被测函数计入耗时
+    """
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+def _timed(func, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return time.perf_counter() - start
+
+
+def measure(func, ops=1, repeat=5, min_time=0.2):
+    """
+    计时, 与 timeit 相同, 计时期间关闭垃圾回收
+    :param ops: 每次调用完成的操作数
+    :param repeat: 重复次数
+    :param min_time: 每次重复至少运行的秒数, 据此确定每次重复的调用次数
+    :return: dict, 单次操作耗时(秒)的 median / min / max, 以及 ops_per_sec
+    """
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        # 预热, 同时确定调用次数
+        number = 1
+        elapsed = _timed(func, number)
+        while elapsed < min_time:
+            number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)) + 1)
+            elapsed = _timed(func, number)
+        times = [elapsed] + [_timed(func, number) for _ in range(repeat - 1)]
+    finally:
+        if gc_enabled:
+            gc.enable()
+    per_op = sorted(t / (number * ops) for t in times)
+    median = statistics.median(per_op)
+    return {
+        'median': median,
+        'min': per_op[0],
+        'max': per_op[-1],
+        'ops_per_sec': 1 / median if median else None,
+        'ops': ops,
+        'number': number,
+        'repeat': repeat,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(names=None, repeat=5, min_time=0.2, log=print):
+    """
+    运行基准, 准备或运行失败的基准记录错误后继续
+    :param names: 只运行名称包含其中任一字符串的基准, None 为全部
+    :return: 结果 dict, 可直接保存为 JSON
+    """
+    results = OrderedDict()
+    for name, setup in BENCHMARKS.items():
+        if names and not any(n in name for n in names):
+            continue
+        teardown = None
+        try:
+            prepared = setup()
+            func, ops = prepared[:2]
+            teardown = prepared[2] if len(prepared) > 2 else None
+            results[name] = measure(func, ops, repeat=repeat, min_time=min_time)
+        except Exception as e:
+            results[name] = {'error': repr(e)}
+        finally:
+            if teardown is not None:
+                teardown()
+        log(format_result(name, results[name]))
+    return {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+
+
+def _format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return '%.2f %s' % (seconds / scale, unit)
+    return '%.0f ns' % (seconds / 1e-9)
+
+
+def format_result(name, result):
+    if 'error' in result:
+        return '%-28s 失败: %s' % (name, result['error'])
+    return '%-28s %12s/op  %14.0f op/s  (min %s, max %s)' % (
+        name, _format_time(result['median']), result['ops_per_sec'],
+        _format_time(result['min']), _format_time(result['max']))
+
+
+def save(result, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(base, new, threshold=0.1):
+    """
+    按单次操作耗时的中位数对比两次结果
+    :param threshold: 变慢超过该比例记为 regression, 变快超过该比例记为 improvement
+    :return: [(名称, 基准耗时, 新耗时, 比值, 状态)], 状态为 ok / regression / improvement / missing / error
+    """
+    rows = []
+    base_results, new_results = base['results'], new['results']
+    for name in list(base_results) + [n for n in new_results if n not in base_results]:
+        b, n = base_results.get(name), new_results.get(name)
+        if b is None or n is None:
+            rows.append((name, None, None, None, 'missing'))
+            continue
+        if 'error' in b or 'error' in n:
+            rows.append((name, b.get('median'), n.get('median'), None, 'error'))
+            continue
+        ratio = n['median'] / b['median']
+        if ratio > 1 + threshold:
+            status = 'regression'
+        elif ratio < 1 / (1 + threshold):
+            status = 'improvement'
+        else:
+            status = 'ok'
+        rows.append((name, b['median'], n['median'], ratio, status))
+    return rows
+
+
+def format_compare(rows):
+    lines = ['%-28s %12s %12s %8s  %s' % ('benchmark', 'base', 'new', 'ratio', 'status')]
+    for name, b, n, ratio, status in rows:
+        lines.append('%-28s %12s %12s %8s  %s' % (
+            name, _format_time(b) if b is not None else '-', _format_time(n) if n is not None else '-',
+            '%.2fx' % ratio if ratio is not None else '-', status))
+    return '\n'.join(lines)
@@ -0,0 +1,122 @@
+# coding: utf-8
+import json
+import os
+import random
+
+# 东方财富行情接口的返回
+# payloads/<名称>.json 为 record() 录制的原始返回, 不存在时按固定种子生成同样结构的数据, 保证各次运行输入一致
+
+PAYLOAD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'payloads')
+
+SEED = 20250401
+
+# 生成数据使用的股票池, 成分股、涨幅榜和涨速榜从中抽取, 保证筛选时有交集
+_POOL_SIZE = 400
+
+
+def _pool(rng):
+    prefixes = ('600', '601', '603', '000', '002', '300', '688')
+    return ['%s%03d' % (rng.choice(prefixes), i) for i in range(_POOL_SIZE)]
+
+
+def _stock_row(rng, code):
+    limit = 1950 if code.startswith('30') else 950
+    # 约三成接近涨停, 其余为普通涨幅
+    pct = rng.randint(limit, limit + 50) if rng.random() < 0.3 else rng.randint(-500, 900)
+    return {
+        'f1': 2, 'f2': rng.randint(300, 8000), 'f3': pct, 'f4': rng.randint(-300, 300),
+        'f7': rng.randint(100, 2500), 'f8': rng.randint(10, 3000), 'f12': code, 'f13': 1 if code.startswith('6') else 0,
+        'f14': ('ST股%s' if rng.random() < 0.05 else '股票%s') % code,
+        'f21': rng.choice((rng.uniform(1e8, 3e8), rng.uniform(3e8, 2e9), rng.uniform(2e9, 5e10))),
+        'f62': rng.uniform(-1e8, 1e8), 'f152': 2,
+    }
+
+
+def _diff(rows):
+    return {'rc': 0, 'rt': 6, 'svr': 0, 'lt': 1, 'full': 1, 'data': {'total': len(rows), 'diff': rows}}
+
+
+def _synthesize(name):
+    rng = random.Random('%s-%s' % (SEED, name))
+    pool = _pool(random.Random(SEED))
+    if name == 'board_top_ten':
+        return _diff([{'f1': 2, 'f2': rng.randint(50000, 200000), 'f3': rng.randint(300, 800),
+                       'f12': 'BK%04d' % (1000 + i), 'f13': 90, 'f14': '概念板块%d' % i, 'f104': rng.randint(10, 80),
+                       'f105': rng.randint(0, 20), 'f128': '股票', 'f140': pool[i], 'f136': rng.randint(500, 2000)}
+                      for i in range(10)])
+    if name == 'board_cons':
+        return _diff([_stock_row(rng, code) for code in rng.sample(pool, 20)])
+    if name in ('sh_rank', 'sz_rank'):
+        return _diff([_stock_row(rng, code) for code in rng.sample(pool, 50)])
+    if name in ('sh_speed_rank', 'sz_speed_rank'):
+        return _diff([_stock_row(rng, code) for code in rng.sample(pool, 10)])
+    if name == 'bid_ask':
+        price = rng.uniform(5, 50)
+        data = {'f43': round(price, 2), 'f51': round(price * 1.1, 2), 'f52': round(price * 0.9, 2),
+                'f57': pool[0], 'f58': '股票%s' % pool[0]}
+        # f31-f50 五档买卖价格和委托量
+        for i in range(31, 51):
+            data['f%d' % i] = round(price + (i - 40) * 0.01, 2) if i % 2 else rng.randint(100, 100000)
+        return {'rc': 0, 'rt': 4, 'svr': 0, 'lt': 1, 'full': 1, 'data': data}
+    raise KeyError('未知的 payload: %s' % name)
+
+
+NAMES = ('board_top_ten', 'board_cons', 'sh_rank', 'sz_rank', 'sh_speed_rank', 'sz_speed_rank', 'bid_ask')
+
+_loaded = {}
+
+
+def load(name) -> bytes:
+    """
+    :return: 接口返回的原始字节, 录制的优先
+    """
+    if name not in _loaded:
+        path = os.path.join(PAYLOAD_DIR, name + '.json')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                _loaded[name] = f.read()
+        else:
+            _loaded[name] = json.dumps(_synthesize(name), ensure_ascii=False).encode('utf-8')
+    return _loaded[name]
+
+
+def is_recorded(name):
+    return os.path.exists(os.path.join(PAYLOAD_DIR, name + '.json'))
+
+
+def record(names=NAMES):
+    """
+    联网请求行情接口, 把原始返回保存到 payloads 目录
+    请求参数与 StockService 相同
+    """
+    import requests
+
+    from app.core.stock_service import StockService
+
+    api = StockService()
+    requests_by_name = {
+        'board_top_ten': api._get_board_concept_stock_top_ten_request,
+        'sh_rank': api._get_stock_sh_zs_rank_request,
+        'sz_rank': api._get_stock_sz_zs_rank_request,
+        'sh_speed_rank': api._get_stock_sh_zs_speed_rank_request,
+        'sz_speed_rank': api._get_stock_sz_zs_speed_rank_request,
+    }
+    os.makedirs(PAYLOAD_DIR, exist_ok=True)
+    saved = {}
+    for name in names:
+        if name == 'board_cons':
+            # 取板块前十中第一个板块的成分股
+            board = json.loads(saved.get('board_top_ten') or load('board_top_ten'))['data']['diff'][0]['f12']
+            url, params = api._get_board_concept_stock_cons_top_twenty_request(board)
+        elif name == 'bid_ask':
+            code = json.loads(saved.get('sh_rank') or load('sh_rank'))['data']['diff'][0]['f12']
+            url, params = api._stock_bid_ask_em_request(code)
+        else:
+            url, params = requests_by_name[name]()
+        response = requests.get(url, params=params, timeout=15)
+        response.raise_for_status()
+        saved[name] = response.content
+        with open(os.path.join(PAYLOAD_DIR, name + '.json'), 'wb') as f:
+            f.write(response.content)
+        _loaded.pop(name, None)
+    return list(saved)
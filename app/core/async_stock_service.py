@@ -0,0 +1,86 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+import pandas as pd
+
+from app.core.stock_service import StockService, REQUEST_SECONDS, REQUEST_ERRORS
+
+
+class AsyncStockService(StockService):
+    """
+    StockService 的异步版本, 基于 aiohttp, 多个请求在同一个事件循环上并发
+    请求参数与 StockService 共用, 各行情方法的返回值与同名同步方法一致, 需 await 调用
+    """
+
+    def __init__(self, timeout=15, limit=20):
+        """
+        :param timeout: 单个请求的超时秒数
+        :param limit: 连接池最大连接数
+        """
+        super().__init__()
+        self.timeout = timeout
+        self.limit = limit
+        self._session = None
+
+    def _get_session(self):
+        # 会话需在事件循环内创建, 首次请求时创建并复用连接
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                                  connector=aiohttp.TCPConnector(limit=self.limit))
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def _get_json(self, request, desc):
+        url, params = request
+        endpoint = urlsplit(url).path
+        start = time.perf_counter()
+        try:
+            async with self._get_session().get(url, params=params) as response:
+                if response.status >= 400:
+                    REQUEST_ERRORS.labels(endpoint).inc()
+                return await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            REQUEST_ERRORS.labels(endpoint).inc()
+            print(f"请求{desc}时发生异常: {e}")
+            return None
+        finally:
+            REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - start)
+
+    async def _get_data(self, request, desc, key):
+        resp_json = await self._get_json(request, desc)
+        if resp_json is None or resp_json.get('data') is None:
+            return None
+        return resp_json['data'][key]
+
+    async def get_board_concept_stock_top_ten(self):
+        diff = await self._get_data(self._get_board_concept_stock_top_ten_request(), '板块概念股票数据', 'diff')
+        return None if diff is None else pd.DataFrame(diff)
+
+    async def get_board_concept_stock_cons_top_twenty(self, board_concept_code):
+        diff = await self._get_data(self._get_board_concept_stock_cons_top_twenty_request(board_concept_code),
+                                    '板块概念股票数据', 'diff')
+        return None if diff is None else pd.DataFrame(diff)
+
+    async def get_stock_sh_zs_rank(self, date=None):
+        return await self._get_data(self._get_stock_sh_zs_rank_request(), '上证股票涨幅榜数据', 'diff')
+
+    async def get_stock_sz_zs_rank(self, date=None):
+        return await self._get_data(self._get_stock_sz_zs_rank_request(), '深证股票涨幅榜数据', 'diff')
+
+    async def get_stock_sh_zs_speed_rank(self, date=None):
+        return await self._get_data(self._get_stock_sh_zs_speed_rank_request(), '上证股票涨速榜数据', 'diff')
+
+    async def get_stock_sz_zs_speed_rank(self, date=None):
+        return await self._get_data(self._get_stock_sz_zs_speed_rank_request(), '深证股票涨速榜数据', 'diff')
+
+    async def stock_bid_ask_em(self, symbol: str = "000001") -> pd.DataFrame:
+        data_json = await self._get_json(self._stock_bid_ask_em_request(symbol), '行情报价')
+        # f51 是涨停价 f52 是跌停价
+        if data_json is None or data_json.get('data') is None:
+            return pd.DataFrame()
+        return pd.DataFrame([data_json['data']])
@@ -0,0 +1,451 @@
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import pandas as pd
+
+from app.core.log_config import setup_logger
+from app.core.stock_cache import StockCache
+from easyquant.easydealutils.time import get_trade_calendar
+
+logger = setup_logger(__name__)
+
+# 多进程共用的 StockCache, 数据保存在 Redis 中:
+#   今日买入的股票为集合(SADD / SREM / SISMEMBER), 各板块今日买入数量为哈希(HINCRBY), 按日期分键, 次日自动换新;
+#   昨日涨停 / 跌停股票池、持仓、交易日历由一个进程刷新后写入, 其它进程只读取;
+#   余额为单独的数值键, 买入时以 INCRBYFLOAT 在 Redis 中扣减, 不以各进程读到的余额覆盖;
+#   下单前以 Lua 脚本原子地检查并预占股票和板块额度, 下单失败时撤销, 多个进程不会重复买入或超过板块上限;
+#   每个进程保留一份近端缓存, 读取不访问 Redis, 元数据中的版本号变化时才重新加载.
+
+# reserve_buy 的检查和预占, 股票今日已买入返回 -1, 板块已达上限返回 -2, 否则预占并返回板块递增后的数量
+# KEYS: 今日买入股票集合, 今日各板块买入数量, 元数据; ARGV: 股票, 板块id, 板块上限, 过期秒数
+_RESERVE_BUY_LUA = """
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 1 then
+    return -1
+end
+local num = tonumber(redis.call('HGET', KEYS[2], ARGV[2]) or '0')
+if num >= tonumber(ARGV[3]) then
+    return -2
+end
+redis.call('SADD', KEYS[1], ARGV[1])
+num = redis.call('HINCRBY', KEYS[2], ARGV[2], 1)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+redis.call('HINCRBY', KEYS[3], 'buys', 1)
+return num
+"""
+
+
+class RedisStockCache(StockCache):
+    """
+    以 Redis 为后端的 StockCache, 接口与 StockCache 相同
+    """
+
+    # 按日期分的键保留天数
+    DAILY_KEY_DAYS = 3
+    # 刷新锁的过期秒数, 同一时刻触发的 update_cache 只有一个进程请求东方财富和交易网关
+    REFRESH_LOCK_SECONDS = 60
+
+    def __init__(self, redis_io, prefix='stock_cache', near_cache_ttl=1.0):
+        """
+        :param redis_io: easydealutils.RedisIo
+        :param prefix: 键前缀, 同一 Redis 上运行多套程序时区分
+        :param near_cache_ttl: 近端缓存检查版本号的间隔(秒), 其它进程的写入最多延迟这么久可见, 本进程的写入立即可见
+        """
+        self.redis = redis_io
+        self.prefix = prefix
+        self.near_cache_ttl = near_cache_ttl
+        self.owner_id = '%s:%s' % (os.getpid(), uuid.uuid4().hex)
+        self._lock = threading.RLock()
+        # 近端缓存
+        self._limit_up = pd.DataFrame()
+        self._limit_down = pd.DataFrame()
+        self._position = []
+        self._balance = 0
+        self._calendar = pd.DataFrame()
+        self._buy_stocks = []
+        self._buy_stock_set = frozenset()
+        self._board_ids = {}
+        # 已加载的版本号, 以及上次检查的时间
+        self._versions = {}
+        self._checked = 0.0
+        # reserve_buy 的 Lua 脚本, 首次预占时注册
+        self._reserve_script = None
+
+    # ---------- 键 ----------
+
+    def _key(self, name):
+        return '%s:%s' % (self.prefix, name)
+
+    def _daily_key(self, name, date=None):
+        return '%s:%s:%s' % (self.prefix, (date or datetime.now()).strftime('%Y%m%d'), name)
+
+    @property
+    def _meta_key(self):
+        return self._key('meta')
+
+    @property
+    def _balance_key(self):
+        return self._key('balance')
+
+    # ---------- 近端缓存 ----------
+
+    def invalidate(self):
+        """使近端缓存失效, 下次读取时检查版本号"""
+        self._checked = 0.0
+
+    def _sync(self):
+        if time.monotonic() - self._checked < self.near_cache_ttl:
+            return
+        with self._lock:
+            if time.monotonic() - self._checked < self.near_cache_ttl:
+                return
+            try:
+                meta = {k.decode() if isinstance(k, bytes) else k: v
+                        for k, v in self.redis.r.hgetall(self._meta_key).items()}
+                buys_key = '%s:%s' % (datetime.now().strftime('%Y%m%d'), meta.get('buys'))
+                if buys_key != self._versions.get('buys'):
+                    self._load_buys()
+                    self._versions['buys'] = buys_key
+                if meta.get('snapshot') != self._versions.get('snapshot'):
+                    self._load_snapshot()
+                    self._versions['snapshot'] = meta.get('snapshot')
+                if meta.get('balance') != self._versions.get('balance'):
+                    self._load_balance()
+                    self._versions['balance'] = meta.get('balance')
+                self._checked = time.monotonic()
+            except Exception as e:
+                # Redis 不可用时继续使用近端缓存
+                logger.error(f"从 Redis 同步缓存时出错: {e}")
+
+    def _load_buys(self):
+        pipe = self.redis.pipeline()
+        pipe.smembers(self._daily_key('buy_stocks'))
+        pipe.hgetall(self._daily_key('buy_board_ids'))
+        stocks, board_ids = pipe.execute()
+        self._buy_stocks = sorted(s.decode() if isinstance(s, bytes) else s for s in stocks)
+        self._buy_stock_set = frozenset(self._buy_stocks)
+        self._board_ids = {(k.decode() if isinstance(k, bytes) else k): int(v) for k, v in board_ids.items()}
+
+    def _load_snapshot(self):
+        names = ('limit_up', 'limit_down', 'position', 'calendar')
+        values = self.redis.get_objects([self._key(name) for name in names])
+        self._limit_up = values.get(self._key('limit_up'), pd.DataFrame())
+        self._limit_down = values.get(self._key('limit_down'), pd.DataFrame())
+        self._position = values.get(self._key('position'), [])
+        calendar = values.get(self._key('calendar'), pd.DataFrame())
+        if isinstance(calendar, pd.DataFrame) and not calendar.empty and not calendar.equals(self._calendar):
+            # 刷新进程已合并了交易日历, 其它进程在此合并, 不再各自请求
+            dates = pd.to_datetime(calendar['jyrq'])
+            get_trade_calendar().update(calendar['jyrq'], start=dates.min().replace(day=1),
+                                        end=dates.max() + pd.offsets.MonthEnd(0))
+        self._calendar = calendar
+
+    def _load_balance(self):
+        balance = self.redis.r.get(self._balance_key)
+        self._balance = float(balance) if balance is not None else 0
+        if self._balance.is_integer():
+            self._balance = int(self._balance)
+
+    def _write(self, commands, version='buys'):
+        """
+        在一个事务管道中执行写入并增加版本号
+        :param commands: 函数, 参数为管道
+        :return: 管道中各命令的结果, 不含版本号
+        """
+        pipe = self.redis.pipeline(transaction=True)
+        commands(pipe)
+        pipe.hincrby(self._meta_key, version, 1)
+        result = pipe.execute()
+        # 本进程的写入立即可见
+        self.invalidate()
+        return result[:-1]
+
+    def _expire_daily(self, pipe, key):
+        pipe.expire(key, self.DAILY_KEY_DAYS * 24 * 3600)
+
+    # ---------- 今日买入 ----------
+
+    def set_today_buy_board_id(self, board_id, num):
+        """
+        设置今日买入板块中指定板块id的股票数量
+        :param board_id: 板块id
+        :param num: 该板块中股票的数量
+        """
+        try:
+            if isinstance(board_id, (str, int)) and isinstance(num, (int, float)):
+                key = self._daily_key('buy_board_ids')
+
+                def commands(pipe):
+                    pipe.hset(key, board_id, int(num))
+                    self._expire_daily(pipe, key)
+                self._write(commands)
+                logger.info(f"成功设置板块 {board_id} 的今日买入股票数量为 {num}")
+            else:
+                logger.warning("传入的板块id或股票数量类型不正确，无法设置")
+        except Exception as e:
+            logger.error(f"设置板块 {board_id} 的今日买入股票数量时出错: {e}")
+
+    def append_today_buy_board_id(self, board_id):
+        """
+        板块今日买入数量加 1, 在 Redis 中原子递增, 多个进程同时买入时不会丢失计数
+        :param board_id: 板块id
+        :return: 递增后的数量, 出错时返回 None
+        """
+        try:
+            if isinstance(board_id, (str, int)):
+                key = self._daily_key('buy_board_ids')
+
+                def commands(pipe):
+                    pipe.hincrby(key, board_id, 1)
+                    self._expire_daily(pipe, key)
+                num = self._write(commands)[0]
+                logger.info(f"成功更新板块 {board_id} 的今日买入股票数量为 {num}")
+                return num
+            else:
+                logger.warning("传入的板块id类型不正确，无法更新")
+        except Exception as e:
+            logger.error(f"更新板块 {board_id} 的今日买入股票数量时出错: {e}")
+
+    def get_today_buy_board_id(self, board_id):
+        """
+        获取今日买入板块中指定板块id的股票数量
+        :param board_id: 板块id
+        :return: 该板块中股票的数量，如果不存在则返回0
+        """
+        self._sync()
+        return self._board_ids.get(str(board_id), 0)
+
+    def append_today_buy_stock(self, stock):
+        """
+        向今日买成功的股票池中添加单个股票
+        :param stock: 要添加的股票
+        """
+        try:
+            key = self._daily_key('buy_stocks')
+
+            def commands(pipe):
+                pipe.sadd(key, stock)
+                self._expire_daily(pipe, key)
+            self._write(commands)
+            logger.info(f"成功添加股票 {stock} 到今日买成功的股票池")
+        except Exception as e:
+            logger.error(f"向今日买成功的股票池添加股票 {stock} 时出错: {e}")
+
+    def remove_today_buy_stock(self, stock):
+        """
+        从今日买成功的股票池中移除单个股票
+        :param stock: 要移除的股票
+        """
+        try:
+            if self._write(lambda pipe: pipe.srem(self._daily_key('buy_stocks'), stock))[0]:
+                logger.info(f"成功从今日买成功的股票池移除股票 {stock}")
+            else:
+                logger.warning(f"今日买成功的股票池中不存在股票 {stock}，无法移除")
+        except Exception as e:
+            logger.error(f"从今日买成功的股票池移除股票 {stock} 时出错: {e}")
+
+    def set_today_buy_stocks(self, stocks):
+        """
+        设置今日买到的股票池
+        :param stocks: 今日买到的股票列表
+        """
+        try:
+            if isinstance(stocks, list):
+                key = self._daily_key('buy_stocks')
+
+                def commands(pipe):
+                    pipe.delete(key)
+                    if stocks:
+                        pipe.sadd(key, *stocks)
+                        self._expire_daily(pipe, key)
+                self._write(commands)
+                logger.info("成功设置今日买到的股票池")
+            else:
+                logger.warning("传入的今日买到的股票数据不是列表类型，无法设置")
+        except Exception as e:
+            logger.error(f"设置今日买到的股票池时出错: {e}")
+
+    def get_today_buy_stocks(self):
+        """
+        获取今日买到的股票池
+        :return: 今日买到的股票列表
+        """
+        self._sync()
+        return self._buy_stocks
+
+    def is_today_buy_stock(self, stock):
+        """今日是否已买入该股票, 在近端缓存的集合中判断"""
+        self._sync()
+        return stock in self._buy_stock_set
+
+    def reserve_buy(self, stock, board_id, board_limit):
+        """
+        下单前预占: 在一个 Lua 脚本中检查股票今日是否已买入、板块今日买入数量是否已达上限, 都未发生时 SADD 股票并 HINCRBY 板块数量
+        近端缓存可能落后于其它进程, 以 Redis 中的数据判断; 检查和预占在 Redis 中原子执行, 未通过的预占不改动计数
+        :param board_limit: 板块今日买入数量上限
+        :return: 是否预占成功, 出错时返回 False, 不下单
+        """
+        try:
+            if self._reserve_script is None:
+                self._reserve_script = self.redis.r.register_script(_RESERVE_BUY_LUA)
+            num = self._reserve_script(
+                keys=[self._daily_key('buy_stocks'), self._daily_key('buy_board_ids'), self._meta_key],
+                args=[stock, board_id, board_limit, self.DAILY_KEY_DAYS * 24 * 3600])
+            # 本进程的写入立即可见
+            self.invalidate()
+            if num > 0:
+                logger.info(f"已预占买入股票 {stock}, 板块 {board_id} 今日买入数量为 {num}")
+                return True
+            logger.info(f"股票 {stock} 今日已买入或板块 {board_id} 已达上限，不再买入")
+        except Exception as e:
+            logger.error(f"预占买入股票 {stock} 时出错: {e}")
+        return False
+
+    def release_buy(self, stock, board_id):
+        """
+        撤销 reserve_buy 的预占, 下单失败时调用
+        """
+        try:
+            def commands(pipe):
+                pipe.srem(self._daily_key('buy_stocks'), stock)
+                pipe.hincrby(self._daily_key('buy_board_ids'), board_id, -1)
+            self._write(commands)
+            logger.info(f"已撤销股票 {stock} 的买入预占")
+        except Exception as e:
+            logger.error(f"撤销股票 {stock} 的买入预占时出错: {e}")
+
+    # ---------- 刷新进程写入, 所有进程读取 ----------
+
+    def _publish_snapshot(self, refreshed=False, balance=None, **values):
+        """
+        :param refreshed: 是否为 update_cache 的完整刷新, 等待刷新的进程以此判断刷新完成
+        :param balance: 余额, 写入单独的键, 只增加余额的版本号
+        :param values: limit_up / limit_down / position / calendar, 为 None 的不写入
+        """
+        if balance is not None:
+            self._write(lambda pipe: pipe.set(self._balance_key, float(balance)), version='balance')
+        values = {self._key(name): value for name, value in values.items() if value is not None}
+        if not values and not refreshed:
+            return
+        self.redis.set_objects(values)
+
+        def commands(pipe):
+            if refreshed:
+                pipe.hset(self._meta_key, 'refreshed_at', time.time())
+        self._write(commands, version='snapshot')
+
+    def save_stocks_to_cache(self, stocks, position=None, balance=None):
+        """
+        将股票列表、当前仓位和资金保存到缓存中
+        """
+        try:
+            if not isinstance(stocks, pd.DataFrame):
+                logger.warning("传入的昨日涨停数据不是 DataFrame 类型，无法保存")
+                stocks = None
+            self._publish_snapshot(limit_up=stocks, position=position if position is not None else [],
+                                   balance=balance if balance is not None else 0)
+            logger.info("成功保存股票信息到缓存")
+        except Exception as e:
+            logger.error(f"保存股票信息到缓存时出错: {e}")
+
+    def load_stocks_from_cache(self):
+        """
+        从近端缓存中加载股票列表、当前仓位和资金
+        """
+        self._sync()
+        return self._limit_up, self._position, self._balance
+
+    def get_yesterday_limit_down_stocks(self):
+        self._sync()
+        return self._limit_down
+
+    def get_trading_calendar(self):
+        self._sync()
+        return self._calendar
+
+    def set_balance(self, balance):
+        """
+        设置当前余额, 账户余额由各进程共用
+        :param balance: 新的余额值
+        """
+        try:
+            if isinstance(balance, (int, float)):
+                self._publish_snapshot(balance=balance)
+                logger.info("成功设置当前余额")
+            else:
+                logger.warning("传入的余额数据不是数字类型，无法设置")
+        except Exception as e:
+            logger.error(f"设置当前余额时出错: {e}")
+
+    def deduct_balance(self, amount):
+        """
+        余额扣减 amount, 以 INCRBYFLOAT 在 Redis 中扣减, 多个进程同时买入时不会丢失扣减
+        只增加余额的版本号, 其它进程只重新读取余额, 不重新加载涨停池等快照
+        :return: 扣减后的余额, 出错时返回 None
+        """
+        try:
+            balance = float(self._write(lambda pipe: pipe.incrbyfloat(self._balance_key, -amount),
+                                        version='balance')[0])
+            logger.info(f"余额扣减 {amount}, 当前余额 {balance}")
+            return balance
+        except Exception as e:
+            logger.error(f"扣减余额时出错: {e}")
+
+    def get_balance(self):
+        self._sync()
+        return self._balance
+
+    def update_cache(self):
+        """
+        更新缓存. 先取得刷新锁的进程请求东方财富和交易网关并写入 Redis, 其它进程等待写入完成后读取
+        """
+        started = time.time()
+        try:
+            if self.redis.r.set(self._key('refresh_lock'), self.owner_id, nx=True, ex=self.REFRESH_LOCK_SECONDS):
+                self._refresh()
+            else:
+                logger.info("其它进程正在刷新缓存，等待刷新完成")
+                self._wait_refresh(started)
+        except Exception as e:
+            logger.error(f"更新缓存时出错: {e}")
+        self.invalidate()
+        self._sync()
+
+    def _refresh(self):
+        # 沿用 StockCache 的请求和校验, 结果写入 Redis
+        StockCache.update_cache()
+        self._publish_snapshot(refreshed=True, limit_up=StockCache.YESTERDAY_LIMIT_UP_STOCKS,
+                               limit_down=StockCache.YESTERDAY_LIMIT_DOWN_STOCKS,
+                               position=StockCache.POSITION, balance=StockCache.BALANCE,
+                               calendar=StockCache.TRADING_CALENDAR)
+        # 刷新锁不主动释放, 过期前同一时刻触发的其它进程直接使用本次结果
+        logger.info("已刷新缓存并写入 Redis")
+
+    def _wait_refresh(self, started, poll=0.5):
+        """
+        等待持锁进程写入, 锁过期前写入的快照都视为本次刷新的结果
+        :return: 是否等到了刷新结果
+        """
+        deadline = started + self.REFRESH_LOCK_SECONDS
+        while time.time() < deadline:
+            refreshed_at = self.redis.r.hget(self._meta_key, 'refreshed_at')
+            if refreshed_at is not None and float(refreshed_at) >= started - self.REFRESH_LOCK_SECONDS:
+                return True
+            time.sleep(poll)
+        logger.warning("等待其它进程刷新缓存超时，使用 Redis 中已有的缓存")
+        return False
+
+
+def create_stock_cache(redis_conf=None):
+    """
+    :param redis_conf: RedisIo 配置文件路径, 为空时使用进程内的 StockCache
+    :return: StockCache 或 RedisStockCache
+    """
+    if not redis_conf:
+        return StockCache()
+    from easyquant.easydealutils import RedisIo
+
+    return RedisStockCache(RedisIo(redis_conf))
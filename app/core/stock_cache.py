@@ -1,4 +1,5 @@
 import logging
+import threading
 from datetime import datetime
 
 import pandas as pd
@@ -12,6 +13,7 @@ logger = setup_logger(__name__)
 from app.core.trade_service import TradeService
 # 假设导入 StockService 类
 from app.core.stock_service import StockService
+from easyquant.easydealutils.time import get_trade_calendar
 
 # 全局变量用于内存缓存
 class StockCache:
@@ -31,6 +33,9 @@ class StockCache:
     # 今日买入板块id和数量，是个map
     TODAY_BUY_BOARD_IDS = {}
 
+    # 预占今日买入和扣减余额的锁, 同一进程的多个 handlebar 线程之间互斥
+    BUY_LOCK = threading.Lock()
+
     @classmethod
     def get_yesterday_limit_down_stocks(cls):
         """
@@ -145,6 +150,45 @@ class StockCache:
             logger.error(f"从缓存获取今日买到的股票池时出错: {e}")
             return []
 
+    @classmethod
+    def reserve_buy(cls, stock, board_id, board_limit):
+        """
+        下单前预占: 股票加入今日买入股票池, 板块今日买入数量加 1
+        :param board_limit: 板块今日买入数量上限
+        :return: 是否预占成功, 股票今日已买入或板块已达上限时不预占
+        """
+        with cls.BUY_LOCK:
+            if stock in cls.TODAY_BUY_STOCKS or cls.TODAY_BUY_BOARD_IDS.get(board_id, 0) >= board_limit:
+                return False
+            cls.TODAY_BUY_STOCKS.append(stock)
+            cls.TODAY_BUY_BOARD_IDS[board_id] = cls.TODAY_BUY_BOARD_IDS.get(board_id, 0) + 1
+        logger.info(f"已预占买入股票 {stock}, 板块 {board_id} 今日买入数量为 {cls.TODAY_BUY_BOARD_IDS[board_id]}")
+        return True
+
+    @classmethod
+    def release_buy(cls, stock, board_id):
+        """
+        撤销 reserve_buy 的预占, 下单失败时调用
+        """
+        with cls.BUY_LOCK:
+            if stock in cls.TODAY_BUY_STOCKS:
+                cls.TODAY_BUY_STOCKS.remove(stock)
+            if cls.TODAY_BUY_BOARD_IDS.get(board_id, 0) > 0:
+                cls.TODAY_BUY_BOARD_IDS[board_id] -= 1
+        logger.info(f"已撤销股票 {stock} 的买入预占")
+
+    @classmethod
+    def deduct_balance(cls, amount):
+        """
+        余额扣减 amount, 在当前余额上扣减, 不以调用方读到的余额覆盖
+        :return: 扣减后的余额
+        """
+        with cls.BUY_LOCK:
+            cls.BALANCE = cls.BALANCE - amount
+            balance = cls.BALANCE
+        logger.info(f"余额扣减 {amount}, 当前余额 {balance}")
+        return balance
+
     @classmethod
     def save_stocks_to_cache(cls, stocks, position=None, balance=None):
         """
@@ -231,7 +275,7 @@ class StockCache:
     @classmethod
     def update_trading_calendar(cls):
         """
-        仅更新交易日历缓存
+        仅更新交易日历缓存, 同时合并到进程内共用的交易日历
         """
         try:
             stock_service = StockService()
@@ -247,6 +291,19 @@ class StockCache:
         except Exception as e:
             logger.error(f"更新交易日历缓存时出错: {e}")
 
+    @classmethod
+    def is_trade_date(cls, date=None):
+        """
+        判断是否交易日, 使用进程内共用的交易日历, 日历中没有该日期时先更新交易日历
+        :param date: 日期, 默认为今天
+        :return: bool
+        """
+        date = date or datetime.now()
+        calendar = get_trade_calendar()
+        if not calendar.covers(date):
+            cls.update_trading_calendar()
+        return calendar.is_trade_date(date)
+
     @classmethod
     def get_trading_calendar(cls):
         """
@@ -4,6 +4,15 @@ import pandas as pd
 import requests
 import akshare as ak
 import math
+import time
+from urllib.parse import urlsplit
+
+from easyquant.easydealutils.time import get_trade_calendar
+from easyquant.metrics import REGISTRY
+
+REQUEST_SECONDS = REGISTRY.histogram('stock_service_request_seconds', '行情接口请求耗时(秒)', ['endpoint'])
+REQUEST_ERRORS = REGISTRY.counter('stock_service_request_errors_total', '行情接口请求失败次数(异常或 HTTP 错误状态)',
+                                  ['endpoint'])
 
 class StockService:
     # 替换为实际的 API 地址
@@ -23,30 +32,51 @@ class StockService:
         """
         pass
 
+    def _get(self, url, **kwargs):
+        """
+        requests.get, 按接口路径记录请求耗时和失败次数
+        """
+        endpoint = urlsplit(url).path
+        start = time.perf_counter()
+        try:
+            response = requests.get(url, **kwargs)
+        except requests.RequestException:
+            REQUEST_ERRORS.labels(endpoint).inc()
+            raise
+        finally:
+            REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - start)
+        if response.status_code >= 400:
+            REQUEST_ERRORS.labels(endpoint).inc()
+        return response
+
     def is_trade_date(self, date=None):
-        url = "https://www.szse.cn/api/report/exchange/onepersistenthour/monthList"
-        r = requests.get(url)
-        resp_json = r.json()
-        if resp_json is None or resp_json['data'] is None:
-            return False
-        df = pd.DataFrame(resp_json['data'])
-        result = df[(df['jyrq'] == date) & (df['jybz'] == '1')]
-        return not result.empty
+        """
+        判断是否交易日, 共用交易日历中没有该日期时先拉取最近交易日历
+        :param date: 日期, 支持 datetime.date 或 'YYYY-MM-DD' / 'YYYYMMDD' 字符串, 默认为今天
+        :return: bool
+        """
+        date = date or datetime.date.today()
+        calendar = get_trade_calendar()
+        if not calendar.covers(date):
+            self.get_recent_trading_calendar()
+        return calendar.is_trade_date(date)
 
     def get_recent_trading_calendar(self):
         """
-        发送请求获取最近的交易日历
+        发送请求获取最近的交易日历, 并合并到进程内共用的交易日历
         :return: 包含最近交易日历的 DataFrame，如果请求失败则返回 None
         """
         url = "https://www.szse.cn/api/report/exchange/onepersistenthour/monthList"
         try:
-            r = requests.get(url)
+            r = self._get(url)
             resp_json = r.json()
             if resp_json is None or resp_json['data'] is None:
                 return None
             df = pd.DataFrame(resp_json['data'])
             # 筛选出交易标识为 '1' 的记录，即交易日
             trading_days = df[df['jybz'] == '1']
+            # 返回的是整月的日历, 月内不在交易日中的日期即为非交易日
+            get_trade_calendar().update(trading_days['jyrq'], start=df['jyrq'].min(), end=df['jyrq'].max())
             # 删除两列 zrxh jybz
             trading_days = trading_days.drop(columns=['zrxh', 'jybz'])
             return trading_days
@@ -70,7 +100,7 @@ class StockService:
         :return: 包含股票数据的响应内容，如果请求失败则返回 None
         """
         try:
-            response = requests.get(self.api_url)
+            response = self._get(self.api_url)
             if response.status_code == 200:
                 return response.json()
             else:
@@ -95,7 +125,7 @@ class StockService:
             "dpt": "wzchanges"
         }
         try:
-            response = requests.get(url=self.market_movement_url, params=params, timeout=15)
+            response = self._get(url=self.market_movement_url, params=params, timeout=15)
             resp_json = response.json()
             if resp_json is None:
                 return None
@@ -113,8 +143,22 @@ class StockService:
         :return: 包含板块概念股票数据的响应内容，如果请求失败则返回 None
         """
         # curl --location 'https://push2.eastmoney.com/api/qt/clist/get?pn=1&pz=10&po=1&np=1&ut=fa5fd1943c7b386f172d6893dbfba10b&fltt=1&invt=2&fid=f3&fs=m%3A90+t%3A3+f%3A!50&fields=f12%2Cf13%2Cf14%2Cf1%2Cf2%2Cf4%2Cf3%2Cf152%2Cf20%2Cf8%2Cf104%2Cf105%2Cf128%2Cf140%2Cf141%2Cf207%2Cf208%2Cf209%2Cf136%2Cf222'
-        url = "https://push2.eastmoney.com/api/qt/clist/get"
-        params={
+        url, params = self._get_board_concept_stock_top_ten_request()
+        try:
+            response = self._get(url=url, params=params, timeout=15)
+            resp_json = response.json()
+            if resp_json is None:
+                return None
+            if resp_json['data'] is None:
+                return None
+            return pd.DataFrame(resp_json['data']['diff'])
+
+        except requests.RequestException as e:
+            print(f"请求板块概念股票数据时发生异常: {e}")
+            return None
+
+    def _get_board_concept_stock_top_ten_request(self):
+        params = {
             "pn": "1",
             "pz": "10",
             "po": "1",
@@ -126,25 +170,28 @@ class StockService:
             "fs": "m:90+t:3+f:!50",
             "fields": "f12,f13,f14,f1,f2,f4,f3,f152,f20,f8,f104,f105,f128,f140,f141,f207,f208,f209,f136,f222"
         }
+        return "https://push2.eastmoney.com/api/qt/clist/get", params
+
+    def get_board_concept_stock_cons_top_twenty(self, board_concept_code):
+        """
+        发送请求获取板块概念股票数据
+        :return: 包含板块概念股票数据的响应内容，如果请求失败则返回 None
+        """
+        # curl--location'https://push2.eastmoney.com/api/qt/clist/get?pn=1&pz=10&po=1&np=1&ut=fa5fd1943c7b386f172d6893dbfba10b&fltt=1&invt=2&fid=f62&fs=b:BK1098&fields=f14,f12,f13,f1,f2,f4,f3,f152,f128,f140,f141,f62,f184,f66,f69,f72,f75,f78,f81,f84,f87,f109,f160,f164,f165,f166,f167,f168,f169,f170,f171,f172,f173,f174,f175,f176,f177,f178,f179,f180,f181,f182,f183'
+        url, param = self._get_board_concept_stock_cons_top_twenty_request(board_concept_code)
         try:
-            response = requests.get(url=url, params=params, timeout=15)
+            response = self._get(url=url, params=param, timeout=15)
             resp_json = response.json()
             if resp_json is None:
                 return None
             if resp_json['data'] is None:
                 return None
             return pd.DataFrame(resp_json['data']['diff'])
-
         except requests.RequestException as e:
             print(f"请求板块概念股票数据时发生异常: {e}")
             return None
 
-    def get_board_concept_stock_cons_top_twenty(self, board_concept_code):
-        """
-        发送请求获取板块概念股票数据
-        :return: 包含板块概念股票数据的响应内容，如果请求失败则返回 None
-        """
-        # curl--location'https://push2.eastmoney.com/api/qt/clist/get?pn=1&pz=10&po=1&np=1&ut=fa5fd1943c7b386f172d6893dbfba10b&fltt=1&invt=2&fid=f62&fs=b:BK1098&fields=f14,f12,f13,f1,f2,f4,f3,f152,f128,f140,f141,f62,f184,f66,f69,f72,f75,f78,f81,f84,f87,f109,f160,f164,f165,f166,f167,f168,f169,f170,f171,f172,f173,f174,f175,f176,f177,f178,f179,f180,f181,f182,f183'
+    def _get_board_concept_stock_cons_top_twenty_request(self, board_concept_code):
         param = {
             "pn": "1",
             "pz": "20",
@@ -157,18 +204,8 @@ class StockService:
             "fs": f"b:{board_concept_code}",
             "fields": "f14,f12,f13,f1,f2,f4,f3,f21,f152,f128,f140,f141,f62,f184,f66,f69,f72,f75,f78,f81,f84,f87,f109,f160,f164,f165,f166,f167,f168,f169,f170,f171,f172,f173,f174,f175,f176,f177,f178,f179,f180,f181,f182,f183"
         }
-        try:
-            response = requests.get(url=self.api_url, params=param, timeout=15)
-            resp_json = response.json()
-            if resp_json is None:
-                return None
-            if resp_json['data'] is None:
-                return None
-            return pd.DataFrame(resp_json['data']['diff'])
-        except requests.RequestException as e:
-            print(f"请求板块概念股票数据时发生异常: {e}")
-            return None
-    
+        return self.api_url, param
+
     def get_stock_yesterday_zt_pool(self, date=None):
         """
         发送请求获取昨日涨停股票数据
@@ -184,7 +221,7 @@ class StockService:
             "date": date
         }
         try:
-            response = requests.get(url=self.yesterday_zt_pool_url, params=param, timeout=15)
+            response = self._get(url=self.yesterday_zt_pool_url, params=param, timeout=15)
             resp_json = response.json()
             if resp_json is None:
                 return None
@@ -196,7 +233,7 @@ class StockService:
             result.extend(pd.DataFrame(resp_json['data']['pool']))
             for i in range(total_page):
                 param['Pageindex'] = str(i)
-                response = requests.get(url=self.yesterday_zt_pool_url, params=param, timeout=15)
+                response = self._get(url=self.yesterday_zt_pool_url, params=param, timeout=15)
                 resp_json = response.json()
                 result.extend(pd.DataFrame(resp_json['data']['pool']))
             return result
@@ -220,7 +257,7 @@ class StockService:
             "date": date
         }
         try:
-            response = requests.get(url=self.dt_pool_url, params=param, timeout=15)
+            response = self._get(url=self.dt_pool_url, params=param, timeout=15)
             resp_json = response.json()
             if resp_json is None:
                 return None
@@ -238,6 +275,20 @@ class StockService:
         :return: 包含上证股票涨幅榜数据的响应内容，如果请求失败则返回 None
         """
         # curl --location 'https://push2.eastmoney.com/api/qt/clist/get?pn=1&pz=20&po=1&np=1&ut=fa5fd1943c7b386f172d6893dbfba10b&fltt=1&invt=2&fid=f3&fs=m%3A1+t%3A2%2Cm%3A1+t%3A23&fields=f12%2Cf13%2Cf14%2Cf1%2Cf2%2Cf4%2Cf3%2Cf152%2Cf5%2Cf6%2Cf7%2Cf15%2Cf18%2Cf16%2Cf17%2Cf10%2Cf8%2Cf9%2Cf21%2Cf22%2Cf23%2Cf24%2Cf62%2Cf72'
+        url, param = self._get_stock_sh_zs_rank_request()
+        try:
+            response = self._get(url=url, params=param, timeout=15)
+            resp_json = response.json()
+            if resp_json is None:
+                return None
+            if resp_json['data'] is None:
+                return None
+            return resp_json['data']['diff']
+        except requests.RequestException as e:
+            print(f"请求上证股票涨幅榜数据时发生异常: {e}")
+            return None
+
+    def _get_stock_sh_zs_rank_request(self):
         param = {
             "pn": "1",
             "pz": "50",
@@ -250,8 +301,18 @@ class StockService:
             "fs": "m:1+t:2,m:1+t:23",
             "fields": "f12,f13,f14,f1,f2,f4,f3,f152,f5,f6,f7,f15,f18,f16,f17,f10,f8,f9,f21,f22,f23,f24,f62,f72"
         }
+        return self.api_url, param
+
+    #  深证股票涨幅榜
+    def get_stock_sz_zs_rank(self, date=None):
+        """
+        发送请求获取深证股票涨幅榜数据
+        :return: 包含深证股票涨幅榜数据的响应内容，如果请求失败则返回 None
+        """
+        # curl --location 'https://push2.eastmoney.com/api/qt/clist/get?pn=1&pz=20&po=1&np=1&ut=fa5fd1943c7b386f172d6893dbfba10b&fltt=1&invt=2&fid=f3&fs=m%3A0+t%3A6%2Cm%3A0+t%3A80&fields=f12%2Cf13%2Cf14%2Cf1%2Cf2%2Cf4%2Cf3%2Cf152%2Cf5%2Cf6%2Cf7%2Cf15%2Cf18%2Cf16%2Cf17%2Cf10%2Cf8%2Cf9%2Cf21%2Cf22%2Cf23%2Cf24%2Cf62%2Cf72'
+        url, param = self._get_stock_sz_zs_rank_request()
         try:
-            response = requests.get(url=self.api_url, params=param, timeout=15)
+            response = self._get(url=url, params=param, timeout=15)
             resp_json = response.json()
             if resp_json is None:
                 return None
@@ -259,15 +320,10 @@ class StockService:
                 return None
             return resp_json['data']['diff']
         except requests.RequestException as e:
-            print(f"请求上证股票涨幅榜数据时发生异常: {e}")
+            print(f"请求深证股票涨幅榜数据时发生异常: {e}")
             return None
-    #  深证股票涨幅榜
-    def get_stock_sz_zs_rank(self, date=None):
-        """
-        发送请求获取深证股票涨幅榜数据
-        :return: 包含深证股票涨幅榜数据的响应内容，如果请求失败则返回 None
-        """
-        # curl --location 'https://push2.eastmoney.com/api/qt/clist/get?pn=1&pz=20&po=1&np=1&ut=fa5fd1943c7b386f172d6893dbfba10b&fltt=1&invt=2&fid=f3&fs=m%3A0+t%3A6%2Cm%3A0+t%3A80&fields=f12%2Cf13%2Cf14%2Cf1%2Cf2%2Cf4%2Cf3%2Cf152%2Cf5%2Cf6%2Cf7%2Cf15%2Cf18%2Cf16%2Cf17%2Cf10%2Cf8%2Cf9%2Cf21%2Cf22%2Cf23%2Cf24%2Cf62%2Cf72'
+
+    def _get_stock_sz_zs_rank_request(self):
         param = {
             "pn": "1",
             "pz": "50",
@@ -280,8 +336,17 @@ class StockService:
             "fs": "m:0+t:6,m:0+t:80",
             "fields": "f12,f13,f14,f1,f2,f4,f3,f152,f5,f6,f7,f15,f18,f16,f17,f10,f8,f9,f21,f22,f23,f24,f62,f72"
         }
+        return self.api_url, param
+
+    # 上证股票涨速榜
+    def get_stock_sh_zs_speed_rank(self, date=None):
+        """
+        发送请求获取上证股票涨速榜数据
+        :return: 包含上证股票涨速榜数据的响应内容，如果请求失败则返回 None
+        """
+        url, param = self._get_stock_sh_zs_speed_rank_request()
         try:
-            response = requests.get(url=self.api_url, params=param, timeout=15)
+            response = self._get(url=url, params=param, timeout=15)
             resp_json = response.json()
             if resp_json is None:
                 return None
@@ -289,15 +354,10 @@ class StockService:
                 return None
             return resp_json['data']['diff']
         except requests.RequestException as e:
-            print(f"请求深证股票涨幅榜数据时发生异常: {e}")
+            print(f"请求上证股票涨幅榜数据时发生异常: {e}")
             return None
 
-    # 上证股票涨速榜
-    def get_stock_sh_zs_speed_rank(self, date=None):
-        """
-        发送请求获取上证股票涨速榜数据
-        :return: 包含上证股票涨速榜数据的响应内容，如果请求失败则返回 None
-        """
+    def _get_stock_sh_zs_speed_rank_request(self):
         param = {
             "pn": "1",
             "pz": "10",
@@ -310,8 +370,17 @@ class StockService:
             "fs": "m:1+t:2,m:1+t:23",
             "fields": "f12,f13,f14,f1,f2,f4,f3,f152,f5,f6,f7,f15,f18,f16,f17,f10,f8,f9,f21,f22,f23,f24,f62,f72"
         }
+        return self.api_url, param
+
+    # 深证股票涨速榜
+    def get_stock_sz_zs_speed_rank(self, date=None):
+        """
+        发送请求获取深证股票涨速榜数据
+        :return: 包含深证股票涨速榜数据的响应内容，如果请求失败则返回 None
+        """
+        url, param = self._get_stock_sz_zs_speed_rank_request()
         try:
-            response = requests.get(url=self.api_url, params=param, timeout=15)
+            response = self._get(url=url, params=param, timeout=15)
             resp_json = response.json()
             if resp_json is None:
                 return None
@@ -319,15 +388,10 @@ class StockService:
                 return None
             return resp_json['data']['diff']
         except requests.RequestException as e:
-            print(f"请求上证股票涨幅榜数据时发生异常: {e}")
+            print(f"请求深证股票涨幅榜数据时发生异常: {e}")
             return None
 
-    # 深证股票涨速榜
-    def get_stock_sz_zs_speed_rank(self, date=None):
-        """
-        发送请求获取深证股票涨速榜数据
-        :return: 包含深证股票涨速榜数据的响应内容，如果请求失败则返回 None
-        """
+    def _get_stock_sz_zs_speed_rank_request(self):
         param = {
             "pn": "1",
             "pz": "10",
@@ -340,17 +404,7 @@ class StockService:
             "fs": "m:0+t:6,m:0+t:80",
             "fields": "f12,f13,f14,f1,f2,f4,f3,f152,f5,f6,f7,f15,f18,f16,f17,f10,f8,f9,f21,f22,f23,f24,f62,f72"
         }
-        try:
-            response = requests.get(url=self.api_url, params=param, timeout=15)
-            resp_json = response.json()
-            if resp_json is None:
-                return None
-            if resp_json['data'] is None:
-                return None
-            return resp_json['data']['diff']
-        except requests.RequestException as e:
-            print(f"请求深证股票涨幅榜数据时发生异常: {e}")
-            return None
+        return self.api_url, param
 
     # 行情报价
     def stock_bid_ask_em(self, symbol: str = "000001") -> pd.DataFrame:
@@ -362,6 +416,18 @@ class StockService:
         :return: 行情报价
         :rtype: pandas.DataFrame
         """
+        url, params = self._stock_bid_ask_em_request(symbol)
+        r = self._get(url, params=params)
+        data_json = r.json()
+        # f51 是涨停价 f52 是跌停价
+        # f31-f40 依次卖一到卖五的价格和委托量
+        # f41-f50 依次买一到买五的价格和委托量
+
+        data_dict = data_json["data"]
+        data_df = pd.DataFrame([data_dict])
+        return data_df
+
+    def _stock_bid_ask_em_request(self, symbol):
         url = "https://push2.eastmoney.com/api/qt/stock/get"
         market_code = 1 if symbol.startswith("6") else 0
         params = {
@@ -377,15 +443,7 @@ class StockService:
             "f276,f265,f266,f289,f290,f286,f285,f292,f293,f294,f295",
             "secid": f"{market_code}.{symbol}",
         }
-        r = requests.get(url, params=params)
-        data_json = r.json()
-        # f51 是涨停价 f52 是跌停价
-        # f31-f40 依次卖一到卖五的价格和委托量
-        # f41-f50 依次买一到买五的价格和委托量
-
-        data_dict = data_json["data"]
-        data_df = pd.DataFrame([data_dict])
-        return data_df
+        return url, params
 
         
 if __name__ == "__main__":
@@ -0,0 +1,214 @@
+import argparse
+import contextvars
+import itertools
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# 轻量的分段耗时追踪
+# 每次 handlebar 为一条 trace, 其中的日历检查、加载缓存、请求板块、下单等步骤为嵌套的 span, 用单调时钟计时.
+# 最近的 trace 保存在内存的环形缓冲区中, 可导出为 JSON lines, 并按步骤统计 p50/p95/p99.
+# 在项目根目录下执行: python -m app.core.tracing log/trace_20250401.jsonl
+
+# 当前所在的 (trace, span_id), 用 contextvars 保存, 线程和 asyncio 任务各自独立
+_current = contextvars.ContextVar('trace_current', default=None)
+
+PERCENTILES = (50, 95, 99)
+
+
+class Trace:
+    """一次调用的追踪记录"""
+
+    __slots__ = ('trace_id', 'name', 'start', 'duration', 'spans', '_t0', '_ids')
+
+    def __init__(self, trace_id, name):
+        self.trace_id = trace_id
+        self.name = name
+        # 墙上时间只用于标记发生时刻, 耗时均由单调时钟计算
+        self.start = time.time()
+        self.duration = None
+        self.spans = []
+        self._t0 = time.perf_counter()
+        self._ids = itertools.count(1)
+
+    def to_dict(self):
+        return {'trace_id': self.trace_id, 'name': self.name, 'start': self.start,
+                'duration': self.duration, 'spans': self.spans}
+
+
+class Tracer:
+    """
+    分段耗时追踪器
+    用法:
+        with tracer.trace('handlebar'):
+            with tracer.span('board_top_ten'):
+                ...
+    不在 trace 内时 span 不记录, 开销只有一次 contextvar 读取
+    """
+
+    def __init__(self, capacity=2000, enabled=True):
+        """
+        :param capacity: 内存中保留的最近 trace 条数
+        :param enabled: False 时 trace 和 span 均不记录
+        """
+        self.enabled = enabled
+        self._traces = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._prefix = '%d-%d' % (os.getpid(), int(time.time()))
+
+    @contextmanager
+    def trace(self, name):
+        """
+        开始一条新的 trace, 已在 trace 内时作为 span 处理
+        """
+        if not self.enabled:
+            yield None
+            return
+        if _current.get() is not None:
+            with self.span(name) as span:
+                yield span
+            return
+        trace = Trace('%s-%d' % (self._prefix, next(self._ids)), name)
+        token = _current.set((trace, 0))
+        try:
+            yield trace
+        finally:
+            trace.duration = time.perf_counter() - trace._t0
+            _current.reset(token)
+            with self._lock:
+                self._traces.append(trace)
+
+    @contextmanager
+    def span(self, name, **tags):
+        """
+        在当前 trace 中记录一个步骤, 嵌套调用时记录父 span
+        :param tags: 附加信息, 如股票代码、板块id
+        """
+        current = _current.get()
+        if current is None:
+            yield None
+            return
+        trace, parent_id = current
+        span_id = next(trace._ids)
+        span = {'span_id': span_id, 'parent_id': parent_id, 'name': name}
+        if tags:
+            span['tags'] = tags
+        token = _current.set((trace, span_id))
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span['error'] = repr(e)
+            raise
+        finally:
+            end = time.perf_counter()
+            _current.reset(token)
+            span['start'] = start - trace._t0
+            span['duration'] = end - start
+            # list.append 为原子操作, 并发的任务可直接追加
+            trace.spans.append(span)
+
+    def traces(self):
+        """
+        :return: 内存中最近的 trace, 按完成顺序
+        """
+        with self._lock:
+            return list(self._traces)
+
+    def clear(self):
+        with self._lock:
+            self._traces.clear()
+
+    def export_jsonl(self, path, clear=True):
+        """
+        追加写入 JSON lines 文件, 每行一条 trace
+        :param clear: 写入后清空内存中的 trace, 避免重复导出
+        :return: 写入的条数
+        """
+        with self._lock:
+            traces = list(self._traces)
+            if clear:
+                self._traces.clear()
+        if not traces:
+            return 0
+        with open(path, 'a', encoding='utf-8') as f:
+            for trace in traces:
+                f.write(json.dumps(trace.to_dict(), ensure_ascii=False) + '\n')
+        return len(traces)
+
+    def report(self):
+        return report([trace.to_dict() for trace in self.traces()])
+
+
+def percentile(sorted_values, p):
+    """最近秩法求百分位数, sorted_values 需已排序"""
+    if not sorted_values:
+        return None
+    index = max(int(math.ceil(p / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[index]
+
+
+def report(traces):
+    """
+    按步骤统计耗时
+    同一条 trace 中同名 span 出现多次(如每个板块一次请求)时各自计入
+    :param traces: trace 的 dict 列表
+    :return: {步骤名: {'count', 'errors', 'mean', 'max', 'p50', 'p95', 'p99'}}, 耗时单位为秒, 整条 trace 以其名称计入
+    """
+    durations = {}
+    errors = {}
+    for trace in traces:
+        if trace.get('duration') is not None:
+            durations.setdefault(trace['name'], []).append(trace['duration'])
+        for span in trace.get('spans', ()):
+            durations.setdefault(span['name'], []).append(span['duration'])
+            if 'error' in span:
+                errors[span['name']] = errors.get(span['name'], 0) + 1
+    result = {}
+    for name, values in durations.items():
+        values.sort()
+        stats = {'count': len(values), 'errors': errors.get(name, 0),
+                 'mean': sum(values) / len(values), 'max': values[-1]}
+        for p in PERCENTILES:
+            stats['p%d' % p] = percentile(values, p)
+        result[name] = stats
+    return result
+
+
+def format_report(stats):
+    lines = ['%-24s %7s %6s %10s %10s %10s %10s %10s' % ('步骤', '次数', '异常', 'mean(ms)', 'p50(ms)',
+                                                      'p95(ms)', 'p99(ms)', 'max(ms)')]
+    for name, s in sorted(stats.items(), key=lambda item: -item[1]['p95']):
+        lines.append('%-24s %7d %6d %10.1f %10.1f %10.1f %10.1f %10.1f' % (
+            name, s['count'], s['errors'], s['mean'] * 1000, s['p50'] * 1000, s['p95'] * 1000,
+            s['p99'] * 1000, s['max'] * 1000))
+    return '\n'.join(lines)
+
+
+def load_jsonl(paths):
+    traces = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            traces.extend(json.loads(line) for line in f if line.strip())
+    return traces
+
+
+# 进程内共用的追踪器
+tracer = Tracer()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='按步骤统计 trace 耗时')
+    parser.add_argument('paths', nargs='+', help='export_jsonl 导出的文件')
+    parser.add_argument('--name', help='只统计该名称的 trace')
+    args = parser.parse_args()
+    traces = load_jsonl(args.paths)
+    if args.name:
+        traces = [trace for trace in traces if trace['name'] == args.name]
+    print('trace %d 条' % len(traces))
+    print(format_report(report(traces)))
@@ -1,5 +1,11 @@
 # from akshare.stock_feature.stock_board_concept_ths import stock
 import requests
+import time
+
+from easyquant.metrics import REGISTRY
+
+ORDER_ACK_SECONDS = REGISTRY.histogram('trade_order_ack_seconds', '下单请求发出到交易网关应答的耗时(秒), 含重试')
+ORDERS = REGISTRY.counter('trade_orders_total', '下单次数, result 为 ok / rejected / error', ['result'])
 
 class TradeService:
     def __init__(self):
@@ -44,7 +50,14 @@ class TradeService:
             "price": price,
             "amount": amount
         }
-        return self._make_request('get', url, params=params)
+        start = time.perf_counter()
+        resp = self._make_request('get', url, params=params)
+        ORDER_ACK_SECONDS.observe(time.perf_counter() - start)
+        if resp is None:
+            ORDERS.labels('error').inc()
+        else:
+            ORDERS.labels('ok' if resp.get('code') == 0 else 'rejected').inc()
+        return resp
 
     def get_success_orders(self):
         url = f"{self.base_url}/success_orders"
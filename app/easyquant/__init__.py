@@ -1,5 +1,21 @@
-from .strategy.strategyTemplate import StrategyTemplate
-from .push_engine.base_engine import BaseEngine as PushBaseEngine
-from .push_engine.quotation_engine import QuotationEngine
-from .log_handler.default_handler import DefaultLogHandler
-from .main_engine import MainEngine
\ No newline at end of file
+import importlib
+
+# 按需导入: 只使用交易日历等工具模块时, 不加载交易 / 行情相关依赖
+_LAZY_ATTRS = {
+    'StrategyTemplate': ('.strategy.strategyTemplate', 'StrategyTemplate'),
+    'PushBaseEngine': ('.push_engine.base_engine', 'BaseEngine'),
+    'QuotationEngine': ('.push_engine.quotation_engine', 'QuotationEngine'),
+    'DefaultLogHandler': ('.log_handler.default_handler', 'DefaultLogHandler'),
+    'MainEngine': ('.main_engine', 'MainEngine'),
+}
+
+__all__ = list(_LAZY_ATTRS)
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRS:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    module_name, attr = _LAZY_ATTRS[name]
+    value = getattr(importlib.import_module(module_name, __name__), attr)
+    globals()[name] = value
+    return value
@@ -5,18 +5,16 @@ import sys
 from datetime import datetime, timedelta
 from threading import Lock
 
-from logbook import Logger, StreamHandler
-
-from easytrader.mock_trader import MockTrader
 from .context import Context
+from .easydealutils.time import get_trade_calendar
 from .event_engine import EventEngine
-from .log_handler.default_handler import MockLogHandler
+from .log_handler.default_handler import MockLogHandler, push_stdout_handler
+from .matching import MatchingTrader
+from .profiler import NULL_PROFILER, Profiler
 from .push_engine.quotation_engine import QuotationEngine
 from .quotation import use_quotation
 from .strategy.strategyTemplate import StrategyTemplate
 
-StreamHandler(sys.stdout).push_application()
-
 PY_MAJOR_VERSION, PY_MINOR_VERSION = sys.version_info[:2]
 if (PY_MAJOR_VERSION, PY_MINOR_VERSION) < (3, 5):
     raise Exception('Python 版本需要 3.5 或以上, 当前版本为 %s.%s 请升级 Python' % (PY_MAJOR_VERSION, PY_MINOR_VERSION))
@@ -46,17 +44,34 @@ class BackTestEngine:
                  start_date: str,
                  end_date: str,
                  bar_type="5m",
-                 quotation='jqdata'):
+                 quotation='jqdata',
+                 panel=None,
+                 broker='mock',
+                 initial_cash=1000000.0,
+                 profile=None):
         """初始化事件 / 行情 引擎并启动事件引擎
+        :param panel: 预先加载的 BarPanel 或其共享内存名称/目录, 传入时行情只从面板读取
+        :param broker: 'mock' 使用 easytrader MockTrader, 'matching' 使用按A股规则批量撮合的 MatchingTrader
+        :param initial_cash: MatchingTrader 的初始资金
+        :param profile: 剖析结果文件前缀, 如 'data/profile/backtest', 传入时统计各阶段耗时并在回测结束后输出
         """
-        self.broker = 'mock'
+        self.broker = broker
         self.bar_type = bar_type
-        self.quotation = use_quotation(quotation)
-        self.user = MockTrader()
+        if panel is not None:
+            from .panel import PanelQuotation, open_panel
+            self.quotation = PanelQuotation(open_panel(panel) if isinstance(panel, str) else panel)
+        else:
+            self.quotation = use_quotation(quotation)
+        push_stdout_handler()
+        if broker == 'matching':
+            self.user = MatchingTrader(initial_cash=initial_cash)
+        else:
+            from easytrader.mock_trader import MockTrader
+            self.user = MockTrader()
         self.context = Context(self.user, self.quotation)
         self.log = MockLogHandler(context=self.context)
 
-        self.event_engine = EventEngine()
+        self.event_engine = EventEngine(name='backtest')
         self.start_date = start_date
         self.end_date = end_date
 
@@ -79,40 +94,51 @@ class BackTestEngine:
             signal.signal(s, self.shutdown)
 
         self.records = []
+        self.profile = profile
+        self.profiler = NULL_PROFILER
         self.log.info('启动回测引擎')
 
     def start(self):
         """ 启动回测 """
+        if self.profile:
+            self.profiler = Profiler().activate()
+        try:
+            self._run()
+        finally:
+            if self.profile:
+                self.profiler.deactivate()
+                os.makedirs(os.path.dirname(os.path.abspath(self.profile)), exist_ok=True)
+                self.log.info('回测耗时剖析:\n%s' % self.profiler.report(self.profile))
+
+    def _run(self):
+        profiler = self.profiler
         self.user.set_quotation(self.quotation)
         start_date_time = datetime.strptime(self.start_date, '%Y-%m-%d')
         end_date_time = datetime.strptime(self.end_date, '%Y-%m-%d')
 
-        current_dt = start_date_time
-
-        while current_dt <= end_date_time:
-            # 交易日
-            if not self.context.is_trade_date(current_dt.strftime("%Y-%m-%d")):
-                current_dt = current_dt + timedelta(days=1)
-                continue
+        # 只遍历区间内的交易日
+        for trade_date in get_trade_calendar().trade_dates_between(start_date_time, end_date_time):
+            current_dt = datetime.combine(trade_date, datetime.min.time())
 
             # TODO 待优化
             self.context.user.set_time(current_dt)
             # open
             self.context.change_dt(current_dt + timedelta(hours=9, minutes=30))
-            self.strategy.on_open(self.context)
+            with profiler.phase('strategy.on_open'):
+                self.strategy.on_open(self.context)
 
             self.mock_quotation(current_dt, self.strategy)
 
             self.context.change_dt(current_dt + timedelta(hours=15, minutes=30))
-            self.strategy.on_close(self.context)
+            with profiler.phase('strategy.on_close'):
+                self.strategy.on_close(self.context)
 
-            current_dt = current_dt + timedelta(days=1)
             # 记录交易
-
-            self.user.get_balance()
+            with profiler.phase('broker.get_balance'):
+                self.user.get_balance()
 
     def mock_quotation(self, end_date: datetime, strategy: StrategyTemplate):
-
+        profiler = self.profiler
         current_time = end_date + timedelta(hours=9, minutes=30)
         end_date = end_date + timedelta(hours=15)
 
@@ -121,16 +147,32 @@ class BackTestEngine:
             # 9点半开始
             while current_time <= end_date:
                 self.context.change_dt(current_time)
+                profiler.bar(current_time)
+                with profiler.phase('fetch'):
+                    quotation_data = self.quotation_engine.fetch_quotation(end_date=current_time)
+                self.match(quotation_data)
                 # 更新
-                strategy.on_bar(self.context, self.quotation_engine.fetch_quotation(end_date=current_time))
+                with profiler.phase('strategy.on_bar'):
+                    strategy.on_bar(self.context, quotation_data)
                 current_time += timedelta(minutes=minute)
         else:
             # day = int
             self.context.change_dt(end_date)
-            quotation_data = self.quotation_engine.fetch_quotation(end_date=end_date)
-            self.user.update_balance(quotation_data)
+            profiler.bar(end_date)
+            with profiler.phase('fetch'):
+                quotation_data = self.quotation_engine.fetch_quotation(end_date=end_date)
+            self.match(quotation_data)
+            with profiler.phase('broker.update_balance'):
+                self.user.update_balance(quotation_data)
             # 更新持仓
-            strategy.on_bar(self.context, quotation_data)
+            with profiler.phase('strategy.on_bar'):
+                strategy.on_bar(self.context, quotation_data)
+
+    def match(self, quotation_data):
+        """以当根K线撮合上一根K线提交的委托, 仅 MatchingTrader 需要"""
+        if self.broker == 'matching':
+            with self.profiler.phase('broker.match'):
+                self.user.match(quotation_data)
 
     def shutdown(self, sig, frame):
         """
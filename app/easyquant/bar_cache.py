@@ -0,0 +1,221 @@
+# coding: utf-8
+import hashlib
+import os
+import threading
+from collections import OrderedDict, defaultdict
+
+import pandas as pd
+from pandas import DataFrame
+
+
+def _to_ts(dt):
+    return None if dt is None else pd.Timestamp(dt)
+
+
+class _Entry:
+    __slots__ = ('symbol', 'unit', 'start', 'end', 'df', 'nbytes', 'hits')
+
+    def __init__(self, symbol, unit, start, end, df):
+        self.symbol = symbol
+        self.unit = unit
+        self.start = start
+        self.end = end
+        self.df = df
+        self.nbytes = int(df.memory_usage(index=True).sum()) if df is not None else 0
+        self.hits = 0
+
+    @property
+    def key(self):
+        return self.symbol, self.unit, self.start, self.end
+
+    def covers(self, start, end):
+        """该缓存项的时间范围是否包含 [start, end], None 表示不限"""
+        if self.start is not None and (start is None or start < self.start):
+            return False
+        if self.end is not None and (end is None or end > self.end):
+            return False
+        return True
+
+
+class BarCache:
+    """
+    K线内存缓存, 所有 Quotation 子类共用
+
+    缓存项以 (标的, 周期, 起始时间, 截止时间) 为键, 查询时只要某一项的时间范围覆盖查询范围即命中,
+    返回按范围二分切出的视图. 总内存超过预算时按 LRU 或 LFU 淘汰, 可选将淘汰项落盘, 再次命中时读回.
+    """
+
+    def __init__(self, max_bytes=512 * 1024 * 1024, policy='lru', spill_dir=None):
+        """
+        :param max_bytes: 内存预算(字节)
+        :param policy: 淘汰策略, 'lru' 或 'lfu'
+        :param spill_dir: 淘汰项落盘目录, None 表示直接丢弃
+        """
+        if policy not in ('lru', 'lfu'):
+            raise ValueError('不支持的淘汰策略 %s' % policy)
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.spill_dir = spill_dir
+        self.lock = threading.RLock()
+        # key -> _Entry, 顺序即最近使用顺序
+        self._entries = OrderedDict()
+        # (标的, 周期) -> 缓存项键集合
+        self._index = defaultdict(set)
+        # key -> 落盘文件
+        self._spilled = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.spill_hits = 0
+
+    def get(self, symbol, unit, start=None, end=None) -> DataFrame:
+        """
+        :param start: 起始时间(含), None 表示不限
+        :param end: 截止时间(含), None 表示不限
+        :return: 覆盖该范围的缓存数据切片, 未命中返回 None
+        """
+        start, end = _to_ts(start), _to_ts(end)
+        return self._find(symbol, unit, lambda entry: entry.covers(start, end),
+                          lambda df: self._slice(df, start, end))
+
+    def get_last(self, symbol, unit, end, count) -> DataFrame:
+        """
+        按根数查询: 截止时间(含)前最后 count 根K线
+        缓存项的截止时间覆盖 end 时, 切出的K线足够 count 根, 或缓存项的起始时间不限, 即命中
+        :param end: 截止时间(含), None 表示不限
+        :param count: K线根数
+        :return: 缓存数据切片, 未命中返回 None
+        """
+        end = _to_ts(end)
+
+        def last(df):
+            hi = len(df) if end is None else df.index.searchsorted(end, side='right')
+            return df.iloc[max(hi - count, 0):hi]
+
+        def match(entry):
+            if entry.end is not None and (end is None or end > entry.end):
+                return False
+            return entry.start is None or entry.df is None or len(last(entry.df)) >= count
+
+        return self._find(symbol, unit, match, last, check_spilled=lambda df: len(last(df)) >= count)
+
+    def _find(self, symbol, unit, match, select, check_spilled=None):
+        """
+        :param match: 判断缓存项是否命中, 落盘项的 df 为 None
+        :param select: 从命中项的数据中切出结果
+        :param check_spilled: 读回落盘项后再次判断是否命中
+        """
+        with self.lock:
+            for key in self._index.get((symbol, unit), ()):
+                entry = self._entries[key]
+                if match(entry):
+                    entry.hits += 1
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return select(entry.df)
+
+            for key, spill_file in list(self._spilled.items()):
+                entry = _Entry(*key, df=None)
+                # 读回的项可能覆盖并移除了其它落盘项
+                if key not in self._spilled:
+                    continue
+                if entry.symbol == symbol and entry.unit == unit and match(entry):
+                    df = pd.read_pickle(spill_file)
+                    self._drop_spilled(key)
+                    self._put(symbol, unit, df, entry.start, entry.end)
+                    if check_spilled is not None and not check_spilled(df):
+                        continue
+                    self.hits += 1
+                    self.spill_hits += 1
+                    return select(df)
+
+            self.misses += 1
+            return None
+
+    def put(self, symbol, unit, df: DataFrame, start=None, end=None):
+        """
+        放入缓存, 被新数据范围完全覆盖的旧缓存项会被移除
+        :param df: 以时间为索引并已排序的 DataFrame
+        :param start: 数据覆盖的起始时间, None 表示不限
+        :param end: 数据覆盖的截止时间, None 表示不限
+        """
+        with self.lock:
+            self._put(symbol, unit, df, _to_ts(start), _to_ts(end))
+
+    def _put(self, symbol, unit, df, start, end):
+        entry = _Entry(symbol, unit, start, end, df)
+        for key in [k for k in self._index.get((symbol, unit), ()) if entry.covers(k[2], k[3])]:
+            self._remove(key)
+        for key in [k for k in self._spilled
+                    if k[0] == symbol and k[1] == unit and entry.covers(k[2], k[3])]:
+            self._drop_spilled(key)
+
+        self._entries[entry.key] = entry
+        self._index[(symbol, unit)].add(entry.key)
+        self.nbytes += entry.nbytes
+        self._evict()
+
+    def _slice(self, df, start, end):
+        index = df.index
+        lo = 0 if start is None else index.searchsorted(start, side='left')
+        hi = len(index) if end is None else index.searchsorted(end, side='right')
+        return df.iloc[lo:hi]
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        keys = self._index[(entry.symbol, entry.unit)]
+        keys.discard(key)
+        if not keys:
+            self._index.pop((entry.symbol, entry.unit))
+        self.nbytes -= entry.nbytes
+        return entry
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            if self.policy == 'lru':
+                key = next(iter(self._entries))
+            else:
+                # 命中次数最少的项, 相同时淘汰最久未使用的
+                key = min(self._entries, key=lambda k: self._entries[k].hits)
+            entry = self._remove(key)
+            self.evictions += 1
+            if self.spill_dir is not None:
+                self._spill(entry)
+
+    def _spill(self, entry):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        name = hashlib.md5(repr(entry.key).encode('utf-8')).hexdigest()
+        spill_file = os.path.join(self.spill_dir, '%s.pkl' % name)
+        entry.df.to_pickle(spill_file)
+        self._spilled[entry.key] = spill_file
+
+    def _drop_spilled(self, key):
+        spill_file = self._spilled.pop(key)
+        if os.path.exists(spill_file):
+            os.remove(spill_file)
+
+    def clear(self):
+        with self.lock:
+            self._entries.clear()
+            self._index.clear()
+            for key in list(self._spilled):
+                self._drop_spilled(key)
+            self.nbytes = 0
+
+    @property
+    def stats(self):
+        """命中率等统计信息"""
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'spilled': len(self._spilled),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'evictions': self.evictions,
+                'spill_hits': self.spill_hits,
+            }
@@ -0,0 +1,237 @@
+# coding: utf-8
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+DATE_FILE = 'date.npy'
+VALUES_FILE = 'values.npy'
+META_FILE = 'meta.json'
+
+
+class BarStore:
+    """
+    K线列式存储
+
+    按 (标的, 周期) 分目录, 每次写入追加一个只读分区, 分区内为:
+        date.npy    int64 纳秒时间戳, 升序
+        values.npy  float64 数值矩阵, 列优先存放, 每列在文件中连续
+    读取时以 mmap 方式打开, 单分区时直接返回内存映射视图, 不做任何拷贝.
+    写入时按时间去重, 不同查询日期之间重叠的K线只保存一份.
+    meta.json 记录列、已写入的查询和当前有效的分区清单, 以改名方式原子替换;
+    合并分区时先替换清单再删除旧分区, 读方读到被删除的分区时按新清单重读.
+    """
+
+    def __init__(self, root='data/bars', max_partitions=8):
+        """
+        :param root: 存储根目录
+        :param max_partitions: 分区数超过该值时自动合并
+        """
+        self.root = root
+        self.max_partitions = max_partitions
+        self.lock = threading.Lock()
+
+    def _symbol_dir(self, symbol, unit):
+        return os.path.join(self.root, unit, symbol)
+
+    def _read_meta(self, symbol, unit):
+        meta_file = os.path.join(self._symbol_dir(symbol, unit), META_FILE)
+        if not os.path.exists(meta_file):
+            return {'columns': [], 'queries': []}
+        with open(meta_file, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_meta(self, symbol, unit, meta):
+        meta_file = os.path.join(self._symbol_dir(symbol, unit), META_FILE)
+        tmp_file = meta_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_file, meta_file)
+
+    def _partitions(self, symbol, unit, meta=None):
+        symbol_dir = self._symbol_dir(symbol, unit)
+        if not os.path.isdir(symbol_dir):
+            return []
+        meta = meta if meta is not None else self._read_meta(symbol, unit)
+        if 'partitions' in meta:
+            # meta.json 中记录当前有效的分区, 与分区的增删一起原子替换
+            return [os.path.join(symbol_dir, name) for name in meta['partitions']]
+        # 旧版数据没有分区清单, 分区目录名为 part-<起始时间戳>-<序号>, 按名称即按时间排序
+        return sorted(os.path.join(symbol_dir, name) for name in os.listdir(symbol_dir)
+                      if name.startswith('part-'))
+
+    def _write_partition(self, symbol, unit, dates, values, meta):
+        """
+        写入分区, 尚未加入分区清单
+        :return: 分区目录名
+        """
+        symbol_dir = self._symbol_dir(symbol, unit)
+        seq = meta.get('next_seq', len(self._partitions(symbol, unit, meta)))
+        meta['next_seq'] = seq + 1
+        name = 'part-%020d-%06d' % (dates[0], seq)
+        tmp_dir = os.path.join(symbol_dir, '.' + name)
+        os.makedirs(tmp_dir, exist_ok=True)
+        np.save(os.path.join(tmp_dir, DATE_FILE), dates)
+        np.save(os.path.join(tmp_dir, VALUES_FILE), np.asfortranarray(values))
+        # 先写临时目录再改名, 读方不会看到写了一半的分区
+        os.replace(tmp_dir, os.path.join(symbol_dir, name))
+        return name
+
+    def _replace_partitions(self, symbol, unit, meta, names):
+        """
+        以 names 替换分区清单, 先写入新清单再删除不再引用的分区, 读方总能看到完整的数据
+        """
+        old = self._partitions(symbol, unit, meta)
+        meta['partitions'] = sorted(names)
+        self._write_meta(symbol, unit, meta)
+        for path in old:
+            if os.path.basename(path) not in names:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def has_query(self, symbol, unit, tag):
+        """
+        :param tag: 查询标识, 例如查询截止日期
+        :return: 该查询对应的数据是否已写入
+        """
+        return str(tag) in self._read_meta(symbol, unit)['queries']
+
+    def columns(self, symbol, unit):
+        return self._read_meta(symbol, unit)['columns']
+
+    def append(self, symbol, unit, df: DataFrame, tag=None, replace_on_change=False):
+        """
+        追加K线, 已存在的时间点会被忽略
+        :param symbol: 标的代码
+        :param unit: K线周期
+        :param df: 以时间为索引的 DataFrame, 只保存数值列; 首次写入决定列集合
+        :param tag: 查询标识, 记录后可用 has_query 判断是否需要重新拉取
+        :param replace_on_change: 与已存数据重叠的K线数值不一致时(复权基准变化、未收盘K线已更新),
+            以本次数据替换该标的全部已存数据, 并清空已记录的查询; 为 False 时保留已存数据
+        :return: 新写入的行数
+        """
+        with self.lock:
+            os.makedirs(self._symbol_dir(symbol, unit), exist_ok=True)
+            meta = self._read_meta(symbol, unit)
+            if df is None or df.empty:
+                if tag is not None and str(tag) not in meta['queries']:
+                    meta['queries'].append(str(tag))
+                    self._write_meta(symbol, unit, meta)
+                return 0
+            if not meta['columns']:
+                meta['columns'] = list(df.select_dtypes(include='number').columns)
+            if 'partitions' not in meta:
+                meta['partitions'] = [os.path.basename(p) for p in self._partitions(symbol, unit, meta)]
+
+            dates = pd.DatetimeIndex(pd.to_datetime(df.index)).asi8
+            values = df.reindex(columns=meta['columns']).to_numpy(dtype=np.float64)
+            order = np.argsort(dates, kind='stable')
+            dates, values = dates[order], values[order]
+            # 去掉重复时间点
+            keep = np.ones(len(dates), dtype=bool)
+            keep[1:] = dates[1:] != dates[:-1]
+            dates, values = dates[keep], values[keep]
+
+            existing = self.load_arrays(symbol, unit) if meta['partitions'] else None
+            names = list(meta['partitions'])
+            if existing is not None and len(existing[0]):
+                stored_dates, stored_values, _ = existing
+                overlap = np.isin(dates, stored_dates)
+                if replace_on_change and overlap.any():
+                    index = np.searchsorted(stored_dates, dates[overlap])
+                    if not np.allclose(values[overlap], stored_values[index], rtol=1e-6, equal_nan=True):
+                        # 复权基准变化, 本地数据作废
+                        name = self._write_partition(symbol, unit, dates, values, meta)
+                        meta['queries'] = [str(tag)] if tag is not None else []
+                        self._replace_partitions(symbol, unit, meta, [name])
+                        return len(dates)
+                dates, values = dates[~overlap], values[~overlap]
+
+            written = 0
+            if len(dates):
+                names.append(self._write_partition(symbol, unit, dates, values, meta))
+                written = len(dates)
+            if tag is not None and str(tag) not in meta['queries']:
+                meta['queries'].append(str(tag))
+            meta['partitions'] = sorted(names)
+            self._write_meta(symbol, unit, meta)
+
+            if len(names) > self.max_partitions:
+                self._compact(symbol, unit)
+            return written
+
+    def load_arrays(self, symbol, unit, start=None, end=None):
+        """
+        按时间范围读取K线数组
+        :param start: 起始时间(含), None 表示不限
+        :param end: 截止时间(含), None 表示不限
+        :return: (dates int64 ns, values 二维 float64, columns), 无数据返回 None
+        """
+        for attempt in range(3):
+            meta = self._read_meta(symbol, unit)
+            partitions = self._partitions(symbol, unit, meta)
+            if not partitions:
+                return None
+            try:
+                dates = [np.load(os.path.join(p, DATE_FILE), mmap_mode='c') for p in partitions]
+                values = [np.load(os.path.join(p, VALUES_FILE), mmap_mode='c') for p in partitions]
+                break
+            except FileNotFoundError:
+                # 读取期间分区被合并或替换, 按新的分区清单重读
+                if attempt == 2:
+                    raise
+        columns = meta['columns']
+        if len(partitions) == 1:
+            dates, values = dates[0], values[0]
+        else:
+            dates, values = np.concatenate(dates), np.concatenate(values)
+            # 补写的历史分区可能插在中间
+            if len(dates) > 1 and (np.diff(dates) < 0).any():
+                order = np.argsort(dates, kind='stable')
+                dates, values = dates[order], values[order]
+
+        # 有序时间轴上二分定位, 切片为视图
+        lo = 0 if start is None else np.searchsorted(dates, pd.Timestamp(start).value, side='left')
+        hi = len(dates) if end is None else np.searchsorted(dates, pd.Timestamp(end).value, side='right')
+        return dates[lo:hi], values[lo:hi], columns
+
+    def load(self, symbol, unit, start=None, end=None) -> DataFrame:
+        """
+        按时间范围读取K线, 返回以 date 为索引的 DataFrame
+        :return: DataFrame, 无数据返回 None
+        """
+        arrays = self.load_arrays(symbol, unit, start=start, end=end)
+        if arrays is None:
+            return None
+        dates, values, columns = arrays
+        index = pd.DatetimeIndex(dates.view('datetime64[ns]'), name='date')
+        return DataFrame(values, index=index, columns=columns, copy=False)
+
+    def compact(self, symbol, unit):
+        """合并全部分区为一个分区"""
+        with self.lock:
+            self._compact(symbol, unit)
+
+    def _compact(self, symbol, unit):
+        meta = self._read_meta(symbol, unit)
+        partitions = self._partitions(symbol, unit, meta)
+        if len(partitions) <= 1:
+            return
+        dates, values, _ = self.load_arrays(symbol, unit)
+        name = self._write_partition(symbol, unit, np.array(dates), np.array(values), meta)
+        # 新分区加入清单后再删除旧分区, 合并期间读方仍能读到旧分区
+        self._replace_partitions(symbol, unit, meta, [name])
+
+    def drop(self, symbol, unit):
+        """删除该标的该周期的全部数据"""
+        with self.lock:
+            shutil.rmtree(self._symbol_dir(symbol, unit), ignore_errors=True)
+
+    def symbols(self, unit):
+        unit_dir = os.path.join(self.root, unit)
+        if not os.path.isdir(unit_dir):
+            return []
+        return sorted(os.listdir(unit_dir))
@@ -0,0 +1,133 @@
+# coding: utf-8
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# 截面批量指标
+# 输入均为 (时间 × 标的) 矩阵, 如 BarPanel.field('close'), 一次计算全部标的, 输出形状与输入相同.
+# 缺失值(停牌或未上市)为 NaN: 滚动窗口内含 NaN 时结果为 NaN; EMA / RSI 类递推指标跳过 NaN, 按各标的自身的有效K线预热.
+# 算法与 talib 同名函数一致.
+
+
+def _as_matrix(x):
+    x = np.asarray(x, dtype=np.float64)
+    return x[:, None] if x.ndim == 1 else x
+
+
+def _rolling(x, period, func):
+    """对时间轴上长度为 period 的窗口做归约, 前 period-1 行为 NaN"""
+    x = _as_matrix(x)
+    out = np.full(x.shape, np.nan)
+    if len(x) >= period:
+        windows = sliding_window_view(x, period, axis=0)
+        out[period - 1:] = func(windows, axis=-1)
+    return out
+
+
+def MA(x, period=5):
+    """简单移动平均, 前缀和实现, O(时间 × 标的)"""
+    x = _as_matrix(x)
+    out = np.full(x.shape, np.nan)
+    if len(x) < period:
+        return out
+    valid = ~np.isnan(x)
+    csum = np.concatenate([np.zeros((1, x.shape[1])), np.cumsum(np.where(valid, x, 0.0), axis=0)])
+    cnt = np.concatenate([np.zeros((1, x.shape[1])), np.cumsum(valid, axis=0)])
+    total = csum[period:] - csum[:-period]
+    full = (cnt[period:] - cnt[:-period]) == period
+    out[period - 1:] = np.where(full, total / period, np.nan)
+    return out
+
+
+def HIGHEST(x, period=20):
+    """滚动最高值, 含当根K线"""
+    return _rolling(x, period, np.max)
+
+
+def LOWEST(x, period=20):
+    """滚动最低值, 含当根K线"""
+    return _rolling(x, period, np.min)
+
+
+def EMA(x, period=12):
+    """指数移动平均, 各标的以前 period 个有效值的简单平均作为初始值"""
+    x = _as_matrix(x)
+    k = 2.0 / (period + 1)
+    out = np.full(x.shape, np.nan)
+    count = np.zeros(x.shape[1])
+    seed = np.zeros(x.shape[1])
+    ema = np.full(x.shape[1], np.nan)
+    for t in range(len(x)):
+        row = x[t]
+        valid = ~np.isnan(row)
+        count += valid
+        warming = valid & (count <= period)
+        seed[warming] += row[warming]
+        ready = valid & (count == period)
+        ema[ready] = seed[ready] / period
+        step = valid & (count > period)
+        ema[step] += k * (row[step] - ema[step])
+        out[t] = np.where(valid & (count >= period), ema, np.nan)
+    return out
+
+
+def RSI(x, period=6):
+    """相对强弱指标, Wilder 平滑"""
+    x = _as_matrix(x)
+    out = np.full(x.shape, np.nan)
+    n_symbols = x.shape[1]
+    prev = np.full(n_symbols, np.nan)
+    count = np.zeros(n_symbols)
+    gain = np.zeros(n_symbols)
+    loss = np.zeros(n_symbols)
+    for t in range(len(x)):
+        row = x[t]
+        valid = ~np.isnan(row) & ~np.isnan(prev)
+        change = np.where(valid, row - prev, 0.0)
+        up, down = np.maximum(change, 0.0), np.maximum(-change, 0.0)
+        count += valid
+        warming = valid & (count <= period)
+        gain[warming] += up[warming]
+        loss[warming] += down[warming]
+        ready = valid & (count == period)
+        gain[ready] /= period
+        loss[ready] /= period
+        step = valid & (count > period)
+        gain[step] = (gain[step] * (period - 1) + up[step]) / period
+        loss[step] = (loss[step] * (period - 1) + down[step]) / period
+        total = gain + loss
+        with np.errstate(invalid='ignore', divide='ignore'):
+            value = np.where(total > 0, 100.0 * gain / total, 0.0)
+        out[t] = np.where(valid & (count >= period), value, np.nan)
+        prev = np.where(np.isnan(row), prev, row)
+    return out
+
+
+def MACD(x, fast=12, slow=26, signal=9):
+    """
+    :return: (DIF, DEA, 柱) 三个矩阵
+    """
+    dif = EMA(x, fast) - EMA(x, slow)
+    dea = EMA(dif, signal)
+    return dif, dea, dif - dea
+
+
+def CCI(high, low, close, period=14):
+    """顺势指标"""
+    tp = (_as_matrix(high) + _as_matrix(low) + _as_matrix(close)) / 3.0
+    out = np.full(tp.shape, np.nan)
+    if len(tp) < period:
+        return out
+    windows = sliding_window_view(tp, period, axis=0)
+    mean = windows.mean(axis=-1)
+    deviation = np.abs(windows - mean[..., None]).mean(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out[period - 1:] = np.where(deviation > 0, (tp[period - 1:] - mean) / (0.015 * deviation), 0.0)
+    out[period - 1:][np.isnan(mean)] = np.nan
+    return out
+
+
+def VOLUME_RATIO(volume, period=30):
+    """成交量与含当根K线的 period 根均量之比"""
+    volume = _as_matrix(volume)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return volume / MA(volume, period)
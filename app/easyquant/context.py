@@ -1,13 +1,16 @@
 # coding: utf-8
 import datetime
-from typing import List
+from typing import List, TYPE_CHECKING
 
+from easyquant.easydealutils.time import get_trade_calendar
+from easyquant.indicators import IndicatorEngine
+from easyquant.profiler import get_profiler
 from easyquant.quotation import Quotation
-from easytrader.webtrader import WebTrader
-from easytrader.model import *
 
-from talib._ta_lib import *
-import talib
+# easytrader 只用于类型标注, talib 在第一次计算指标时导入
+if TYPE_CHECKING:
+    from easytrader.webtrader import WebTrader
+    from easytrader.model import Balance, Deal, Entrust, Position
 
 
 class Context:
@@ -15,15 +18,19 @@ class Context:
     上下文
     """
 
-    def __init__(self, user: WebTrader, quotation: Quotation, current_dt=datetime.datetime.now(), trade_mode=True):
+    def __init__(self, user: 'WebTrader', quotation: Quotation, current_dt=datetime.datetime.now(), trade_mode=True):
         self.change_dt(current_dt)
+        self.indicators = IndicatorEngine(self)
         self.user = user
         self.quotation = quotation
         self.trade_days = self.quotation.get_all_trade_days()
         self.is_trade_mode = trade_mode
 
-    def is_trade_date(self, date: str):
-        return date in self.trade_days
+    def is_trade_date(self, date):
+        """
+        :param date: datetime.date / datetime.datetime / 'YYYYMMDD' / 'YYYY-MM-DD'
+        """
+        return get_trade_calendar().is_trade_date(date)
 
     def change_dt(self, current_dt:datetime.datetime):
         self.current_dt = current_dt
@@ -59,18 +66,20 @@ class Context:
 
     def calculate_minute_cci(self, stock_code: str, minute=5, max_num=80, time_period=14):
         """
-        分钟级cci
+        分钟级cci, 由 indicators 增量计算, 同一时刻重复调用直接返回缓存
         :param stock_code:
         :param minute:
-        :param max_num:
+        :param max_num: 返回最近 max_num 个值
         :param time_period:
-        :return:
+        :return: 以K线时间为索引的 Series
         """
-        df = self.fetch_minute_bars(stock_code, max_num=max_num, minute=minute)
-        return self.calculate_cci(df, time_period=time_period)
+        return self.indicators.series(stock_code, str(minute) + "m", 'CCI', max_num, period=time_period)
 
     def calculate_cci(self, df, time_period=14):
-        return CCI(df.high, df.low, df.close, timeperiod=time_period)
+        import talib
+
+        with get_profiler().phase('talib.CCI'):
+            return talib.CCI(df.high, df.low, df.close, timeperiod=time_period)
 
     # def fetch_minute_bar_df(self, stock_code: str, minute=5, max_num=80):
     #     """
@@ -92,34 +101,36 @@ class Context:
 
     def calculate_minute_rsi(self, stock_code: str, minute=5, max_num=80, time_period=6):
         """
-        计算RSI
+        计算RSI, 由 indicators 增量计算, 同一时刻重复调用直接返回缓存
         :param stock_code:
         :param minute:
-        :param max_num:
+        :param max_num: 返回最近 max_num 个值
         :param time_period:
-        :return:
+        :return: 以K线时间为索引的 Series
         """
-        df = self.fetch_minute_bars(stock_code, minute=minute, max_num=max_num)
-        return self.calculate_rsi(df, time_period=time_period)
+        return self.indicators.series(stock_code, str(minute) + "m", 'RSI', max_num, period=time_period)
 
     def calculate_rsi(self, df, time_period=6):
-        return RSI(df.close, timeperiod=time_period)
+        import talib
+
+        with get_profiler().phase('talib.RSI'):
+            return talib.RSI(df.close, timeperiod=time_period)
 
     @property
-    def balance(self) -> List[Balance]:
+    def balance(self) -> List['Balance']:
         return self.user.get_balance()
 
     @property
-    def position(self) -> List[Position]:
+    def position(self) -> List['Position']:
         return self.user.get_position()
 
     @property
-    def entrust(self) -> List[Entrust]:
+    def entrust(self) -> List['Entrust']:
         """获取当日委托列表"""
         return self.user.get_entrust()
 
     @property
-    def current_deal(self) -> List[Deal]:
+    def current_deal(self) -> List['Deal']:
         """获取当日成交列表"""
         return self.user.get_current_deal()
 
@@ -144,8 +155,33 @@ class Context:
         return self.user.sell(security, price=price, amount=amount, volume=volume, entrust_prop=entrust_prop)
 
     def __getattr__(self, func_name):
-        def talib_func(*args, **kwargs):
+        func = _talib_func(func_name)
+        # 放入实例字典, 之后不再经过 __getattr__
+        self.__dict__[func_name] = func
+        return func
+
+
+_talib_funcs = {}
+
+
+def _talib_func(func_name):
+    """按名称取 talib 函数的包装, 每个名称只查找一次"""
+    wrapper = _talib_funcs.get(func_name)
+    if wrapper is None:
+        if func_name.startswith('__'):
+            raise AttributeError(func_name)
+        try:
+            import talib
+
             func = getattr(talib, func_name)
-            return func(*args, **kwargs)
+        except ImportError:
+            # 未安装 talib 时与原先一样表现为属性不存在, hasattr / getattr 默认值可正常使用
+            raise AttributeError(func_name)
+        phase_name = 'talib.' + func_name
+
+        def wrapper(*args, **kwargs):
+            with get_profiler().phase(phase_name):
+                return func(*args, **kwargs)
 
-        return talib_func
+        _talib_funcs[func_name] = wrapper
+    return wrapper
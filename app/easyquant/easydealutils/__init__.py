@@ -1 +1,6 @@
-from .easyredis import RedisIo
+def __getattr__(name):
+    # RedisIo 依赖 redis, 按需导入
+    if name == 'RedisIo':
+        from .easyredis import RedisIo
+        return RedisIo
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -1,31 +1,214 @@
 # coding: utf-8
-import os
-import sys
-import redis
+import datetime
+import io
 import json
+import struct
+import sys
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+# 批量操作每批的键数, 避免单个命令过大阻塞 Redis
+BATCH_SIZE = 1000
+
+# 二进制序列化的格式头
+# Redis 由多个进程、主机共用, 能写入键的人不应能借反序列化执行代码, 因此不使用 pickle:
+# numpy 数组为 npy(allow_pickle=False); DataFrame 为 JSON 头 + 各列数据, 数值 / 时间列为 npy, 其它列为 JSON,
+# 时区和扩展类型记录在列描述中, 读回时还原;
+# 列表、字典、数值等为 JSON.
+_ARRAY_MAGIC = b'EQN1'
+_FRAME_MAGIC = b'EQF1'
+_JSON_MAGIC = b'EQJ1'
+# 旧版本写入的 pickle 格式, 不再读取
+_PICKLE_MAGIC = b'EQP1'
+_LENGTH = struct.Struct('<I')
+
+
+def _json_default(obj):
+    # numpy 标量转为 Python 数值, 其它类型不支持
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError('无法序列化的类型: %s' % type(obj).__name__)
+
+
+def _json_item(value):
+    """对象列中的单个值转为可 JSON 序列化的值, 缺失值为 null, 时间记为 {'$ts': ISO 格式}"""
+    if value is None or value is pd.NA or value is pd.NaT or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, datetime.datetime):
+        return {'$ts': pd.Timestamp(value).isoformat()}
+    if isinstance(value, datetime.date):
+        return {'$date': value.isoformat()}
+    return value
+
+
+def _json_object(obj):
+    if len(obj) == 1:
+        if '$ts' in obj:
+            return pd.Timestamp(obj['$ts'])
+        if '$date' in obj:
+            return datetime.date.fromisoformat(obj['$date'])
+    return obj
+
+
+def _save_array(values):
+    buf = io.BytesIO()
+    np.save(buf, values, allow_pickle=False)
+    return buf.getvalue()
+
+
+def _dump_column(column: pd.Series):
+    """
+    数值 / 时间列为 npy, 带时区的时间列按 UTC 保存并记录时区; 其它列为 JSON, 扩展类型(Int64 / string / category 等)记录类型名
+    :return: (列描述, 列数据 bytes)
+    """
+    dtype = column.dtype
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        values = column.dt.tz_convert('UTC').dt.tz_localize(None).values
+        return {'format': 'npy', 'tz': str(dtype.tz)}, _save_array(values)
+    if isinstance(dtype, np.dtype) and dtype.kind in 'biufcmM':
+        return {'format': 'npy'}, _save_array(column.values)
+    desc = {'format': 'json'}
+    if not isinstance(dtype, np.dtype):
+        desc['dtype'] = str(dtype)
+    items = [_json_item(v) for v in column.astype(object).tolist()]
+    return desc, json.dumps(items, default=_json_default, ensure_ascii=False).encode('utf-8')
+
+
+def _load_column(desc, body):
+    if desc['format'] == 'npy':
+        values = np.load(io.BytesIO(body), allow_pickle=False)
+        if 'tz' in desc:
+            values = pd.DatetimeIndex(values).tz_localize('UTC').tz_convert(desc['tz'])
+        return values
+    items = json.loads(body.decode('utf-8'), object_hook=_json_object)
+    # 逐个赋值, 避免元素为等长列表时 numpy 生成二维数组
+    values = np.empty(len(items), dtype=object)
+    for i, item in enumerate(items):
+        values[i] = item
+    if 'dtype' in desc:
+        return pd.array(values, dtype=desc['dtype'])
+    return values
+
+
+def _dump_frame(df: DataFrame):
+    if isinstance(df.columns, pd.MultiIndex) or isinstance(df.index, pd.MultiIndex):
+        raise TypeError('不支持多级索引的 DataFrame')
+    if not df.columns.is_unique:
+        raise ValueError('DataFrame 列名重复: %s' % list(df.columns[df.columns.duplicated()]))
+    header = {'columns': [], 'blocks': []}
+    blocks = []
+    if isinstance(df.index, pd.RangeIndex):
+        header['index'] = {'range': [df.index.start, df.index.stop, df.index.step], 'name': df.index.name}
+    else:
+        desc, body = _dump_column(df.index.to_series())
+        desc['name'] = df.index.name
+        header['index'] = desc
+        header['blocks'].append(len(body))
+        blocks.append(body)
+    for i, name in enumerate(df.columns):
+        desc, body = _dump_column(df.iloc[:, i])
+        desc['name'] = name
+        header['columns'].append(desc)
+        header['blocks'].append(len(body))
+        blocks.append(body)
+    head = json.dumps(header, default=_json_default, ensure_ascii=False).encode('utf-8')
+    return b''.join([_FRAME_MAGIC, _LENGTH.pack(len(head)), head] + blocks)
+
+
+def _load_frame(body):
+    (length,) = _LENGTH.unpack_from(body)
+    header = json.loads(bytes(body[_LENGTH.size:_LENGTH.size + length]).decode('utf-8'))
+    offset = _LENGTH.size + length
+    blocks = []
+    for size in header['blocks']:
+        blocks.append(bytes(body[offset:offset + size]))
+        offset += size
+    index_desc = header['index']
+    if 'range' in index_desc:
+        index = pd.RangeIndex(*index_desc['range'], name=index_desc['name'])
+    else:
+        index = pd.Index(_load_column(index_desc, blocks.pop(0)), name=index_desc['name'])
+    data = {desc['name']: _load_column(desc, block) for desc, block in zip(header['columns'], blocks)}
+    return DataFrame(data, index=index, columns=[desc['name'] for desc in header['columns']])
+
+
+def dumps(obj):
+    """
+    序列化为二进制, numpy 数组为 npy, DataFrame 为 JSON 头 + 各列数据, 其它对象为 JSON
+    :param obj: numpy 数组(非 object 类型)、DataFrame, 或可 JSON 序列化的列表、字典、数值、字符串
+    :return: bytes
+    """
+    if isinstance(obj, np.ndarray):
+        if obj.dtype == object:
+            raise TypeError('不支持 object 类型的 numpy 数组')
+        return _ARRAY_MAGIC + _save_array(obj)
+    if isinstance(obj, DataFrame):
+        return _dump_frame(obj)
+    return _JSON_MAGIC + json.dumps(obj, default=_json_default, ensure_ascii=False).encode('utf-8')
+
+
+def loads(data):
+    """
+    dumps 的逆操作, 只解析数据, 不会执行 Redis 中写入的代码
+    :param data: bytes, 为 None 时返回 None
+    """
+    if data is None:
+        return None
+    magic, body = data[:4], memoryview(data)[4:]
+    if magic == _ARRAY_MAGIC:
+        return np.load(io.BytesIO(body), allow_pickle=False)
+    if magic == _FRAME_MAGIC:
+        return _load_frame(body)
+    if magic == _JSON_MAGIC:
+        return json.loads(bytes(body).decode('utf-8'))
+    if magic == _PICKLE_MAGIC:
+        raise ValueError('旧版本的 pickle 格式不再读取, 需重新写入')
+    raise ValueError('未知的序列化格式: %r' % bytes(magic))
+
+
+def _chunks(items, size=BATCH_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
 
 class RedisIo(object):
     """Redis操作类"""
-    
-    def __init__(self, conf):
-        self.config = self.file2dict(conf)
-        if self.config['passwd'] is None:
-            self.r = redis.Redis(host=self.config['redisip'], port=self.config['redisport'], db=self.config['db'])
+
+    def __init__(self, conf=None, client=None, max_connections=None):
+        """
+        :param conf: 配置文件路径, json 格式, 包含 redisip / redisport / db / passwd, 可选 max_connections
+        :param client: 已创建的 redis 客户端, 传入时不读取配置, 可传入 fakeredis.FakeRedis 等兼容对象
+        :param max_connections: 连接池最大连接数, 默认取配置文件中的值, 都没有时不限制
+        """
+        if client is not None:
+            self.config = {}
+            self.r = client
         else:
-            self.r = redis.Redis(host=self.config['redisip'], port=self.config['redisport'], db=self.config['db'], password = self.config['passwd'])
-    
+            import redis
+
+            self.config = self.file2dict(conf)
+            pool = redis.ConnectionPool(host=self.config['redisip'], port=self.config['redisport'],
+                                        db=self.config['db'], password=self.config.get('passwd'),
+                                        max_connections=max_connections or self.config.get('max_connections'))
+            self.r = redis.Redis(connection_pool=pool)
+        # 同一连接池由多个线程共用, 各线程按需取连接
+        self.pool = getattr(self.r, 'connection_pool', None)
+
     def file2dict(self, path):
         #读取配置文件
         with open(path) as f:
             return json.load(f)
-        
+
     def cleanup(self):
         #清理Redis当前数据库
         self.r.flushdb()
 
     def lookup_redist_info(self):
         #查询Redis配置
-        info = self.r.info()
+        return self.r.info()
 
     def set_key_value(self, key, value):
         #设置键值对key<-->value
@@ -39,14 +222,33 @@ class RedisIo(object):
         #强行保存数据到硬盘
         return self.r.save()
 
-    def get_keys(self):
+    def scan_keys(self, match=None, count=BATCH_SIZE):
+        """
+        以 SCAN 逐批遍历键, 不会像 KEYS 一样长时间阻塞 Redis
+        :param match: 键的匹配模式, 如 'bars:*'
+        :param count: 每次 SCAN 建议返回的键数
+        :return: 键的迭代器, 遍历期间新增或删除的键可能返回也可能不返回
+        """
+        return self.r.scan_iter(match=match, count=count)
+
+    def get_keys(self, match=None):
         #获取当前数据库里面所有键值
-        return self.r.keys()
+        return list(self.scan_keys(match))
 
     def delete_key(self, key):
         #删除某个键
         return self.r.delete(key)
 
+    def delete_keys(self, match):
+        """
+        删除匹配的全部键
+        :return: 删除的键数
+        """
+        deleted = 0
+        for keys in _chunks(self.scan_keys(match)):
+            deleted += self.r.delete(*keys)
+        return deleted
+
     def push_list_value(self, listname, value):
         #推入到队列
         return self.r.lpush(listname, value)
@@ -58,9 +260,151 @@ class RedisIo(object):
     def get_list_len(self, listname):
         #获取队列长度
         return self.r.llen(listname)
-   
+
+    # ---------- 批量操作, 一个管道一次往返 ----------
+
+    def pipeline(self, transaction=False):
+        """
+        :param transaction: True 时以 MULTI / EXEC 包裹, 管道内命令原子执行
+        """
+        return self.r.pipeline(transaction=transaction)
+
+    def set_many(self, mapping, ex=None):
+        """
+        批量设置键值对
+        :param mapping: {键: 值}
+        :param ex: 过期秒数, None 不过期
+        """
+        for items in _chunks(mapping.items()):
+            pipe = self.pipeline()
+            for key, value in items:
+                pipe.set(key, value, ex=ex)
+            pipe.execute()
+
+    def get_many(self, keys):
+        """
+        批量查询
+        :return: 与 keys 顺序一致的值列表, 不存在的键为 None
+        """
+        values = []
+        for chunk in _chunks(keys):
+            values.extend(self.r.mget(chunk))
+        return values
+
+    def push_many(self, listname, values):
+        """
+        批量推入队列, 与逐个 push_list_value 的顺序相同
+        :return: 推入后队列长度
+        """
+        length = None
+        for chunk in _chunks(values):
+            length = self.r.lpush(listname, *chunk)
+        return self.get_list_len(listname) if length is None else length
+
+    def push_lists(self, mapping):
+        """
+        批量推入多个队列
+        :param mapping: {队列名: 值列表}
+        :return: {队列名: 推入后队列长度}
+        """
+        pipe = self.pipeline()
+        names = []
+        for listname, values in mapping.items():
+            for chunk in _chunks(values):
+                pipe.lpush(listname, *chunk)
+                names.append(listname)
+        return dict(zip(names, pipe.execute()))
+
+    # ---------- DataFrame / numpy 数组等对象的二进制存取 ----------
+
+    def set_object(self, key, obj, ex=None):
+        """
+        以二进制保存 DataFrame / numpy 数组 / 可 JSON 序列化的对象, 用作多进程共用的K线、快照缓存, 格式见 dumps
+        :param ex: 过期秒数, None 不过期
+        """
+        self.r.set(key, dumps(obj), ex=ex)
+
+    def get_object(self, key):
+        """
+        :return: set_object 保存的对象, 不存在时返回 None
+        """
+        return loads(self.r.get(key))
+
+    def set_objects(self, mapping, ex=None):
+        """
+        批量保存对象, 如 {标的: K线 DataFrame}
+        """
+        self.set_many({key: dumps(obj) for key, obj in mapping.items()}, ex=ex)
+
+    def get_objects(self, keys):
+        """
+        :return: {键: 对象}, 不存在的键不返回
+        """
+        keys = list(keys)
+        return {key: loads(data) for key, data in zip(keys, self.get_many(keys)) if data is not None}
+
+    def set_frame(self, key, df: DataFrame, ex=None):
+        self.set_object(key, df, ex=ex)
+
+    def get_frame(self, key) -> DataFrame:
+        return self.get_object(key)
+
+
+def check(ri=None):
+    """
+    读写自检, 各类对象序列化后读回应与原对象一致
+    :param ri: RedisIo, 传入时经 Redis 写入再读回(可以 fakeredis 创建), 为 None 时只检查 dumps / loads
+    """
+    frame = DataFrame({'code': ['600000', '000001', None], 'close': [10.5, np.nan, 3.0], 'volume': [100, 200, 300],
+                       'date': pd.to_datetime(['2025-05-06', '2025-05-07', '2025-05-08']),
+                       'time': pd.to_datetime(['2025-05-06 09:30', '2025-05-06 09:35', None]).tz_localize('Asia/Shanghai'),
+                       'amount': pd.array([1, None, 3], dtype='Int64'),
+                       'name': pd.array(['浦发银行', pd.NA, '平安银行'], dtype='string'),
+                       'board': pd.Categorical(['BK1', 'BK2', 'BK1']),
+                       'listed': [pd.Timestamp('1999-11-10'), None, datetime.date(1991, 4, 3)]})
+    objects = {
+        'check:frame': frame,
+        'check:indexed': frame.set_index('time'),
+        'check:array': np.arange(12, dtype=np.float32).reshape(3, 4),
+        'check:list': [{'code': '600000', 'amount': 100}],
+        'check:number': 12345.6,
+    }
+    if ri is None:
+        loaded = {key: loads(dumps(obj)) for key, obj in objects.items()}
+    else:
+        ri.set_objects(objects)
+        loaded = ri.get_objects(objects)
+    for key, obj in objects.items():
+        value = loaded[key]
+        if isinstance(obj, DataFrame):
+            pd.testing.assert_frame_equal(value, obj)
+        elif isinstance(obj, np.ndarray):
+            np.testing.assert_array_equal(value, obj)
+            assert value.dtype == obj.dtype
+        else:
+            assert value == obj, key
+    try:
+        dumps(DataFrame([[1, 2]], columns=['a', 'a']))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('列名重复的 DataFrame 应拒绝序列化')
+    if ri is not None:
+        ri.delete_keys('check:*')
+    return True
+
 
 def main():
+    if '--check' in sys.argv or '--fake' in sys.argv:
+        # 在 app 目录下执行 python -m easyquant.easydealutils.easyredis --check 自检序列化, 不需要 Redis;
+        # --fake 时另以 fakeredis 经 RedisIo 读写
+        check()
+        if '--fake' in sys.argv:
+            import fakeredis
+
+            check(RedisIo(client=fakeredis.FakeRedis()))
+        print('自检通过')
+        return
     ri = RedisIo('redis.conf')
     ri.lookup_redist_info()
     ri.set_key_value('test1', 1)
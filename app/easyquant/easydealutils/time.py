@@ -1,21 +1,177 @@
+import bisect
 import datetime
-import doctest
 import json
-from functools import lru_cache
+import os
+import threading
 
-import requests
+# 交易日历文件, 可通过环境变量指定; 未指定时依次查找当前目录和 app 目录
+TRADE_DAYS_ENV = 'EASYQUANT_TRADE_DAYS'
+TRADE_DAYS_FILE = 'trade_days.json'
 
 
-f = open("trade_days.json", mode='r', encoding='utf-8')
-days = list(json.loads(f.read()).values())
-f.close()
+def _to_date(value):
+    """
+    统一转换为 datetime.date
+    :param value: datetime.date / datetime.datetime / 'YYYYMMDD' / 'YYYY-MM-DD'
+    """
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    value = str(value).strip()
+    if '-' in value:
+        return datetime.datetime.strptime(value[:10], '%Y-%m-%d').date()
+    return datetime.datetime.strptime(value[:8], '%Y%m%d').date()
+
+
+class TradeCalendar:
+    """
+    交易日历
+
+    交易日以日期序数(date.toordinal)保存: 哈希集合用于 O(1) 判断是否交易日,
+    有序数组用于二分查找前后第 n 个交易日. 首次使用时才读取交易日历文件.
+    """
+
+    def __init__(self, days=None, path=None):
+        """
+        :param days: 交易日列表, 为 None 时首次使用时从 path 加载
+        :param path: 交易日历文件, 为 None 时按默认规则查找
+        """
+        self.path = path
+        self.lock = threading.RLock()
+        self._ordinals = []
+        self._ordinal_set = set()
+        self._array = None
+        # 已知交易日信息覆盖的日期范围(序数), 范围内不在集合中的日期即非交易日
+        self._covered = None
+        self._loaded = days is not None
+        if days is not None:
+            self.update(days)
+
+    def _find_file(self):
+        candidates = [self.path, os.environ.get(TRADE_DAYS_ENV), TRADE_DAYS_FILE,
+                      os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                   TRADE_DAYS_FILE)]
+        for candidate in candidates:
+            if candidate and os.path.exists(candidate):
+                return candidate
+        return None
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self.lock:
+            if self._loaded:
+                return
+            trade_days_file = self._find_file()
+            if trade_days_file is not None:
+                with open(trade_days_file, mode='r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.update(data.values() if isinstance(data, dict) else data)
+            self._loaded = True
+
+    def update(self, days, start=None, end=None):
+        """
+        合并交易日
+        :param days: 交易日列表
+        :param start: 本批数据覆盖的起始日期, 默认为最早的交易日
+        :param end: 本批数据覆盖的截止日期, 默认为最晚的交易日
+        """
+        ordinals = {_to_date(d).toordinal() for d in days}
+        with self.lock:
+            self._ordinal_set |= ordinals
+            self._ordinals = sorted(self._ordinal_set)
+            self._array = None
+            if not self._ordinals:
+                return
+            lo = _to_date(start).toordinal() if start is not None else min(ordinals, default=self._ordinals[0])
+            hi = _to_date(end).toordinal() if end is not None else max(ordinals, default=self._ordinals[-1])
+            if self._covered is None:
+                self._covered = (lo, hi)
+            else:
+                self._covered = (min(self._covered[0], lo), max(self._covered[1], hi))
+
+    def covers(self, value):
+        """日历是否包含该日期的交易日信息"""
+        self._ensure_loaded()
+        if self._covered is None:
+            return False
+        return self._covered[0] <= _to_date(value).toordinal() <= self._covered[1]
+
+    @property
+    def days(self):
+        """所有交易日, 'YYYYMMDD' 格式"""
+        self._ensure_loaded()
+        return [datetime.date.fromordinal(o).strftime('%Y%m%d') for o in self._ordinals]
+
+    def is_trade_date(self, value):
+        self._ensure_loaded()
+        return _to_date(value).toordinal() in self._ordinal_set
+
+    def is_trade_dates(self, values):
+        """
+        批量判断是否交易日
+        :param values: 可转换为 numpy datetime64 的日期数组
+        :return: numpy bool 数组
+        """
+        import numpy as np
+
+        self._ensure_loaded()
+        if self._array is None:
+            with self.lock:
+                self._array = np.array([datetime.date.fromordinal(o) for o in self._ordinals],
+                                       dtype='datetime64[D]')
+        return np.isin(np.asarray(values, dtype='datetime64[D]'), self._array)
+
+    def next_trade_date(self, value, n=1):
+        """
+        之后第 n 个交易日(不含当天)
+        :return: datetime.date
+        """
+        self._ensure_loaded()
+        i = bisect.bisect_right(self._ordinals, _to_date(value).toordinal()) + n - 1
+        if n < 1 or i >= len(self._ordinals):
+            raise ValueError('无法确定 %s 之后第 %s 个交易日' % (value, n))
+        return datetime.date.fromordinal(self._ordinals[i])
+
+    def previous_trade_date(self, value, n=1):
+        """
+        之前第 n 个交易日(不含当天)
+        :return: datetime.date
+        """
+        self._ensure_loaded()
+        i = bisect.bisect_left(self._ordinals, _to_date(value).toordinal()) - n
+        if n < 1 or i < 0:
+            raise ValueError('无法确定 %s 之前第 %s 个交易日' % (value, n))
+        return datetime.date.fromordinal(self._ordinals[i])
+
+    def trade_dates_between(self, start, end):
+        """
+        [start, end] 之间的交易日
+        :return: datetime.date 列表
+        """
+        self._ensure_loaded()
+        lo = bisect.bisect_left(self._ordinals, _to_date(start).toordinal())
+        hi = bisect.bisect_right(self._ordinals, _to_date(end).toordinal())
+        return [datetime.date.fromordinal(o) for o in self._ordinals[lo:hi]]
+
+
+_calendar = None
+_calendar_lock = threading.Lock()
 
-def get_all_trade_days():
-    return days
 
-def _is_trade_day(now_time):
-    today = now_time.strftime('%Y%m%d')
-    return today in days
+def get_trade_calendar():
+    """进程内共用的交易日历"""
+    global _calendar
+    if _calendar is None:
+        with _calendar_lock:
+            if _calendar is None:
+                _calendar = TradeCalendar()
+    return _calendar
+
+
+def get_all_trade_days():
+    return get_trade_calendar().days
 
 
 def is_weekend(now_time):
@@ -23,7 +179,8 @@ def is_weekend(now_time):
 
 
 def is_trade_date(now_time):
-    return _is_trade_day(now_time)
+    return get_trade_calendar().is_trade_date(now_time)
+
 
 def get_next_trade_date(now_time):
     """
@@ -33,19 +190,7 @@ def get_next_trade_date(now_time):
     >>> get_next_trade_date(datetime.date(2016, 5, 5))
     datetime.date(2016, 5, 6)
     """
-    now = now_time
-    max_days = 365
-    days = 0
-    while 1:
-        days += 1
-        now += datetime.timedelta(days=1)
-        if is_trade_date(now):
-            if isinstance(now, datetime.date):
-                return now
-            else:
-                return now.date()
-        if days > max_days:
-            raise ValueError('无法确定 %s 下一个交易日' % now_time)
+    return get_trade_calendar().next_trade_date(now_time)
 
 
 OPEN_TIME = (
@@ -108,5 +253,67 @@ def is_closing(now_time, start=datetime.time(14, 54, 30)):
             return True
     return False
 
+
+# 连续竞价时段, K线以此为边界切分
+BAR_TIME = (
+    (datetime.time(9, 30, 0), datetime.time(11, 30, 0)),
+    (datetime.time(13, 0, 0), datetime.time(15, 0, 0)),
+)
+
+
+def get_bar_minutes(bar_type):
+    """
+    :param bar_type: K线类型, 例如 '1m', '5m', '60m', '1d'
+    :return: 分钟K线返回分钟数, 其余返回 None
+    >>> get_bar_minutes('5m')
+    5
+    >>> get_bar_minutes('1d')
+    """
+    if bar_type.endswith('m'):
+        return int(bar_type[:-1])
+    return None
+
+
+def get_next_bar_close(now_time, bar_type='5m'):
+    """
+    下一根K线的收盘时间, 跳过午间休市和非交易日
+    :param now_time: datetime.datetime
+    :param bar_type: K线类型
+    :return: datetime.datetime, 严格晚于 now_time
+    >>> import datetime
+    >>> get_next_bar_close(datetime.datetime(2016, 5, 5, 9, 31), '5m')
+    datetime.datetime(2016, 5, 5, 9, 35)
+    >>> get_next_bar_close(datetime.datetime(2016, 5, 5, 11, 30), '5m')
+    datetime.datetime(2016, 5, 5, 13, 5)
+    >>> get_next_bar_close(datetime.datetime(2016, 5, 5, 15, 0), '1d')
+    datetime.datetime(2016, 5, 6, 15, 0)
+    """
+    minutes = get_bar_minutes(bar_type)
+    step = datetime.timedelta(minutes=minutes) if minutes else None
+    day = now_time.date()
+    max_days = 365
+    for _ in range(max_days):
+        if is_trade_date(day):
+            for begin, end in BAR_TIME:
+                session_begin = datetime.datetime.combine(day, begin)
+                session_end = datetime.datetime.combine(day, end)
+                if step is None:
+                    # 日线及以上只在收盘时推送
+                    if end == CLOSE_TIME[0] and session_end > now_time:
+                        return session_end
+                    continue
+                if session_end <= now_time:
+                    continue
+                if now_time < session_begin:
+                    return min(session_begin + step, session_end)
+                # 向上取整到下一个K线边界
+                elapsed = now_time - session_begin
+                n = elapsed // step + 1
+                return min(session_begin + n * step, session_end)
+        day = get_next_trade_date(day)
+    raise ValueError('无法确定 %s 之后的K线收盘时间' % now_time)
+
 if __name__ == "__main__":
+    import doctest
+
     doctest.testmod()
\ No newline at end of file
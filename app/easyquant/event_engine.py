@@ -1,6 +1,25 @@
 from collections import defaultdict
 from queue import Queue, Empty
 from threading import Thread
+from time import perf_counter
+from weakref import WeakSet
+
+from .metrics import REGISTRY
+
+EVENT_HANDLER_SECONDS = REGISTRY.histogram('easyquant_event_handler_seconds', '事件处理函数耗时(秒)', ['event_type'])
+EVENT_HANDLER_ERRORS = REGISTRY.counter('easyquant_event_handler_errors_total', '事件处理函数抛出异常的次数',
+                                        ['event_type'])
+EVENT_QUEUE_SIZE = REGISTRY.gauge('easyquant_event_queue_size', '事件队列中待处理的事件数', ['engine'])
+
+# 存活的事件引擎, 同名引擎的队列长度合并为一个序列, 引擎释放后自动移除
+_ENGINES = WeakSet()
+
+
+def _queue_size_of(name):
+    def collect():
+        return sum(engine.queue_size for engine in list(_ENGINES) if engine.name == name)
+
+    return collect
 
 
 class Event:
@@ -11,11 +30,34 @@ class Event:
         self.data = data
 
 
+class BarEvent(Event):
+    """K线事件, 附带K线收盘时间与行情获取的起止时间"""
+
+    def __init__(self, event_type, data=None, bar_dt=None, fetch_start=None, fetch_end=None):
+        super().__init__(event_type, data)
+        # 对应K线的收盘时间
+        self.bar_dt = bar_dt
+        # 行情获取开始 / 结束时间
+        self.fetch_start = fetch_start
+        self.fetch_end = fetch_end
+
+    @property
+    def latency(self):
+        """K线收盘到行情获取完成的延迟(秒)"""
+        if self.bar_dt is None or self.fetch_end is None:
+            return None
+        return (self.fetch_end - self.bar_dt).total_seconds()
+
+
 class EventEngine:
     """事件驱动引擎"""
 
-    def __init__(self):
-        """初始化事件引擎"""
+    def __init__(self, name='main'):
+        """
+        初始化事件引擎
+        :param name: 引擎名称, 作为队列长度指标的 engine 标签
+        """
+        self.name = name
         # 事件队列
         self.__queue = Queue()
 
@@ -28,6 +70,10 @@ class EventEngine:
         # 事件字典，key 为时间， value 为对应监听事件函数的列表
         self.__handlers = defaultdict(list)
 
+        # 队列长度在采集时读取
+        _ENGINES.add(self)
+        EVENT_QUEUE_SIZE.labels(name).set_function(_queue_size_of(name))
+
     def __run(self):
         """启动引擎"""
         while self.__active:
@@ -43,8 +89,16 @@ class EventEngine:
         # 检查该事件是否有对应的处理函数
         if event.event_type in self.__handlers:
             # 若存在,则按顺序将时间传递给处理函数执行
+            latency = EVENT_HANDLER_SECONDS.labels(event.event_type)
             for handler in self.__handlers[event.event_type]:
-                handler(event)
+                start = perf_counter()
+                try:
+                    handler(event)
+                except Exception:
+                    EVENT_HANDLER_ERRORS.labels(event.event_type).inc()
+                    raise
+                finally:
+                    latency.observe(perf_counter() - start)
 
     def start(self):
         """引擎启动"""
@@ -0,0 +1,197 @@
+# coding: utf-8
+import datetime
+import os
+import re
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from .bar_store import BarStore
+from .easydealutils.time import get_trade_calendar
+
+# 日线周期名称
+UNIT = '1d'
+# 复权方式: '' 不复权, 'qfq' 前复权, 'hfq' 后复权
+ADJUSTS = ('', 'qfq', 'hfq')
+
+_A_SHARE_RE = re.compile(r'^\d{6}$')
+
+# akshare A股日线列名
+A_SHARE_COLUMNS = {
+    '日期': 'date',
+    '开盘': 'open',
+    '收盘': 'close',
+    '最高': 'high',
+    '最低': 'low',
+    '成交量': 'volume',
+    '成交额': 'amount',
+}
+
+
+def is_a_share(symbol):
+    return bool(_A_SHARE_RE.match(symbol))
+
+
+def _date_str(value):
+    return pd.Timestamp(value).strftime('%Y%m%d')
+
+
+def _standardize(df, columns=None):
+    """统一为以 date 为索引、英文列名、数值类型的 DataFrame"""
+    if df is None or len(df) == 0:
+        return None
+    if columns:
+        df = df.rename(columns=columns)
+    df = df.copy()
+    df.index = pd.DatetimeIndex(pd.to_datetime(df.pop('date')), name='date')
+    fields = [c for c in ('open', 'high', 'low', 'close', 'volume', 'amount') if c in df.columns]
+    return df[fields].apply(pd.to_numeric, errors='coerce').sort_index()
+
+
+class AkshareProvider:
+    """akshare 日线数据源, 6 位数字代码为 A 股, 其余按美股处理"""
+
+    def fetch(self, symbol, start, end, adjust='') -> DataFrame:
+        """
+        :param start: 起始日期(含)
+        :param end: 截止日期(含)
+        :param adjust: 复权方式, 见 ADJUSTS
+        :return: 以 date 为索引的 DataFrame, 列为 open / high / low / close / volume [/ amount]
+        """
+        import akshare as ak
+
+        if is_a_share(symbol):
+            df = ak.stock_zh_a_hist(symbol=symbol, period='daily', start_date=_date_str(start),
+                                    end_date=_date_str(end), adjust=adjust)
+            df = _standardize(df, A_SHARE_COLUMNS)
+        else:
+            # 美股接口不支持按日期查询, 取回全部再截取
+            df = _standardize(ak.stock_us_daily(symbol=symbol, adjust=adjust))
+        if df is None:
+            return None
+        return df.loc[pd.Timestamp(start):pd.Timestamp(end)]
+
+
+class FrameProvider:
+    """以内存中的 DataFrame 作为数据源, 用于离线研究或替代 akshare 做验证"""
+
+    def __init__(self, frames):
+        """
+        :param frames: {(标的, 复权方式): 以日期为索引的 DataFrame}
+        """
+        self.frames = frames
+        self.calls = []
+
+    def fetch(self, symbol, start, end, adjust=''):
+        self.calls.append((symbol, pd.Timestamp(start), pd.Timestamp(end), adjust))
+        df = self.frames.get((symbol, adjust))
+        if df is None:
+            return None
+        return df.loc[pd.Timestamp(start):pd.Timestamp(end)]
+
+
+class HistoryStore:
+    """
+    日线历史数据本地存储
+
+    每种复权方式一个 BarStore(列式, 内存映射读取). sync 只拉取本地缺失的日期:
+    早于本地首日的部分和晚于本地末日的部分, 后者与本地末日重叠一天用于校验 ——
+    前复权数据在除权除息后整段都会变化, 重叠日价格不一致时丢弃本地数据重新全量拉取.
+    同一截止日期只同步一次, A 股在本地末日之后没有新交易日时不访问数据源.
+    """
+
+    def __init__(self, root=os.path.join('data', 'history'), provider=None):
+        """
+        :param root: 存储根目录
+        :param provider: 数据源, 需实现 fetch(symbol, start, end, adjust), 默认 AkshareProvider
+        """
+        self.root = root
+        self.provider = provider or AkshareProvider()
+        self._stores = {}
+
+    def store(self, adjust='') -> BarStore:
+        if adjust not in ADJUSTS:
+            raise ValueError('不支持的复权方式 %s' % adjust)
+        if adjust not in self._stores:
+            self._stores[adjust] = BarStore(os.path.join(self.root, adjust or 'none'))
+        return self._stores[adjust]
+
+    def _has_new_trade_date(self, symbol, last, end):
+        if not is_a_share(symbol):
+            return True
+        calendar = get_trade_calendar()
+        if not calendar.covers(end):
+            return True
+        return bool(calendar.trade_dates_between(last + datetime.timedelta(days=1), end))
+
+    def sync(self, symbols, start, end=None, adjust=''):
+        """
+        同步 [start, end] 的日线到本地
+        :param symbols: 标的代码或列表
+        :param end: 截止日期, 默认今天
+        :return: {标的: 新写入的行数}
+        """
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        start = pd.Timestamp(start).normalize()
+        end = pd.Timestamp(end or datetime.date.today()).normalize()
+        store = self.store(adjust)
+        tag = 'sync:%s:%s' % (_date_str(start), _date_str(end))
+        written = {}
+        for symbol in symbols:
+            if store.has_query(symbol, UNIT, tag):
+                written[symbol] = 0
+                continue
+            written[symbol] = self._sync_one(store, symbol, start, end, adjust)
+            store.append(symbol, UNIT, DataFrame(), tag=tag)
+        return written
+
+    def _sync_one(self, store, symbol, start, end, adjust):
+        arrays = store.load_arrays(symbol, UNIT)
+        if arrays is None or len(arrays[0]) == 0:
+            df = self.provider.fetch(symbol, start, end, adjust)
+            return store.append(symbol, UNIT, df) if df is not None else 0
+
+        dates, values, columns = arrays
+        first, last = pd.Timestamp(dates[0]), pd.Timestamp(dates[-1])
+        written = 0
+        if last < end and self._has_new_trade_date(symbol, last.date(), end.date()):
+            df = self.provider.fetch(symbol, last, end, adjust)
+            if df is not None and len(df):
+                if last in df.index and 'close' in columns:
+                    stored = float(values[-1, columns.index('close')])
+                    fetched = float(df.loc[last, 'close'])
+                    if not np.isclose(stored, fetched, rtol=1e-6, equal_nan=True):
+                        # 复权基准变化, 本地数据作废
+                        store.drop(symbol, UNIT)
+                        df = self.provider.fetch(symbol, min(start, first), end, adjust)
+                        return store.append(symbol, UNIT, df) if df is not None else 0
+                written += store.append(symbol, UNIT, df)
+        if start < first:
+            df = self.provider.fetch(symbol, start, first - datetime.timedelta(days=1), adjust)
+            if df is not None and len(df):
+                written += store.append(symbol, UNIT, df)
+        return written
+
+    def frame(self, symbol, start, end=None, adjust='', sync=True) -> DataFrame:
+        """
+        单个标的的日线, 以 date 为索引
+        :param sync: 是否先同步缺失日期
+        """
+        if sync:
+            self.sync(symbol, start, end, adjust)
+        return self.store(adjust).load(symbol, UNIT, start=start, end=end)
+
+    def load(self, symbols, start, end=None, adjust='', fields=('open', 'high', 'low', 'close', 'volume'),
+             sync=True):
+        """
+        多个标的按日期对齐
+        :return: BarPanel, values 为 (日期 × 标的 × 字段) 数组, 缺失处为 NaN
+        """
+        from .panel import build_panel_from_store
+
+        if sync:
+            self.sync(symbols, start, end, adjust)
+        return build_panel_from_store(self.store(adjust), list(symbols), start=start, end=end, unit=UNIT,
+                                      fields=fields)
@@ -0,0 +1,93 @@
+# coding: utf-8
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# 冷启动导入耗时基准
+# 每个模块在新的解释器中导入, 用 python -X importtime 统计各模块的导入耗时, 并列出被带入的重量级依赖.
+# python -m easyquant.import_benchmark
+# python -m easyquant.import_benchmark easyquant.main_engine --top 20
+
+# 默认测量的模块
+TARGETS = (
+    'easyquant',
+    'easyquant.easydealutils.time',
+    'easyquant.quotation',
+    'easyquant.context',
+    'easyquant.backtest_engine',
+    'easyquant.main_engine',
+)
+
+# 重量级依赖, 应只在使用时才导入
+HEAVY_MODULES = ('easytrader', 'talib', 'jqdatasdk', 'tushare', 'easyquotation', 'akshare', 'logbook')
+
+_APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_importtime(stderr):
+    """
+    解析 -X importtime 的输出
+    :return: [(模块, 自身耗时微秒, 累计耗时微秒)]
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        rows.append((parts[2].strip(), int(parts[0]), int(parts[1])))
+    return rows
+
+
+def measure(target, python=sys.executable):
+    """
+    在新的解释器中导入 target
+    :return: dict, wall 为解释器启动到导入完成的总耗时(秒), cumulative 为 target 的累计导入耗时(秒),
+        modules 为各模块导入耗时, heavy 为被带入的重量级依赖
+    """
+    code = 'import sys, %s; print(",".join(m for m in %r if m in sys.modules))' % (target, HEAVY_MODULES)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in (_APP_DIR, env.get('PYTHONPATH')) if p)
+    start = time.perf_counter()
+    proc = subprocess.run([python, '-X', 'importtime', '-c', code], cwd=_APP_DIR, env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    wall = time.perf_counter() - start
+    rows = parse_importtime(proc.stderr)
+    if proc.returncode != 0:
+        error = [line for line in proc.stderr.splitlines() if not line.startswith('import time:')]
+        return {'target': target, 'ok': False, 'wall': wall, 'error': error[-1] if error else ''}
+    cumulative = next((cum for name, _, cum in rows if name == target), 0)
+    heavy = proc.stdout.strip().splitlines()[-1] if proc.stdout.strip() else ''
+    return {'target': target, 'ok': True, 'wall': wall, 'cumulative': cumulative / 1e6, 'modules': rows,
+            'heavy': [m for m in heavy.split(',') if m]}
+
+
+def format_result(result, top=10):
+    if not result['ok']:
+        return '%-32s 导入失败: %s' % (result['target'], result['error'])
+    lines = ['%-32s 总耗时 %7.1f ms  导入 %7.1f ms  重量级依赖: %s' % (
+        result['target'], result['wall'] * 1000, result['cumulative'] * 1000, ', '.join(result['heavy']) or '无')]
+    if top:
+        for name, self_us, cum_us in sorted(result['modules'], key=lambda r: -r[1])[:top]:
+            lines.append('    %-40s 自身 %7.1f ms  累计 %7.1f ms' % (name, self_us / 1000, cum_us / 1000))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='easyquant 冷启动导入耗时')
+    parser.add_argument('targets', nargs='*', default=list(TARGETS), help='要测量的模块')
+    parser.add_argument('--top', type=int, default=5, help='每个模块列出自身耗时最多的前 N 个子模块')
+    parser.add_argument('--repeat', type=int, default=3, help='重复次数, 取总耗时最少的一次')
+    args = parser.parse_args()
+
+    for target in args.targets:
+        results = [measure(target) for _ in range(max(args.repeat, 1))]
+        ok = [r for r in results if r['ok']]
+        print(format_result(min(ok, key=lambda r: r['wall']) if ok else results[-1], args.top))
+
+
+if __name__ == '__main__':
+    main()
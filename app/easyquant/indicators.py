@@ -0,0 +1,307 @@
+# coding: utf-8
+import copy
+import threading
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+
+class Indicator:
+    """
+    增量指标
+
+    每来一根K线调用一次 update, 以常数时间更新内部状态; value 为最新值, 预热期内为 NaN.
+    history 保留最近 maxlen 个值, 便于返回与 talib 相同形状的序列.
+    """
+
+    def __init__(self, maxlen=240):
+        self.history = deque(maxlen=maxlen)
+        self.count = 0
+
+    @property
+    def value(self):
+        return self.history[-1] if self.history else np.nan
+
+    def update(self, close, high=None, low=None):
+        self.count += 1
+        value = self._update(close, high, low)
+        self.history.append(value)
+        return value
+
+    def _update(self, close, high, low):
+        raise NotImplementedError
+
+    def series(self, n):
+        """最近 n 个值, 不足时前面补 NaN"""
+        values = list(self.history)[-n:]
+        return np.array([np.nan] * (n - len(values)) + values, dtype=np.float64)
+
+
+class EMA(Indicator):
+    """指数移动平均, 与 talib.EMA 一致以前 period 个值的简单平均作为初始值"""
+
+    def __init__(self, period=12, maxlen=240):
+        super().__init__(maxlen)
+        self.period = period
+        self.k = 2.0 / (period + 1)
+        self._seed = 0.0
+        self._ema = np.nan
+
+    def _update(self, close, high=None, low=None):
+        if self.count <= self.period:
+            self._seed += close
+            if self.count == self.period:
+                self._ema = self._seed / self.period
+            return self._ema
+        self._ema += self.k * (close - self._ema)
+        return self._ema
+
+
+class RSI(Indicator):
+    """相对强弱指标, Wilder 平滑, 与 talib.RSI 一致"""
+
+    def __init__(self, period=6, maxlen=240):
+        super().__init__(maxlen)
+        self.period = period
+        self._prev = None
+        self._gain = 0.0
+        self._loss = 0.0
+
+    def _update(self, close, high=None, low=None):
+        prev, self._prev = self._prev, close
+        if prev is None:
+            return np.nan
+        change = close - prev
+        gain, loss = max(change, 0.0), max(-change, 0.0)
+        n = self.count - 1
+        if n <= self.period:
+            self._gain += gain
+            self._loss += loss
+            if n < self.period:
+                return np.nan
+            self._gain /= self.period
+            self._loss /= self.period
+        else:
+            self._gain = (self._gain * (self.period - 1) + gain) / self.period
+            self._loss = (self._loss * (self.period - 1) + loss) / self.period
+        total = self._gain + self._loss
+        return 100.0 * self._gain / total if total else 0.0
+
+
+class MACD(Indicator):
+    """
+    MACD, value 为 DIF, 另有 signal(DEA) 和 hist 属性
+    与 talib.MACD 一致: 快线和慢线在第 slow 根K线同时以简单平均作为初始值, 快线只取其中最后 fast 根;
+    DEA 以前 signal 个 DIF 的简单平均作为初始值, DEA 算出之前三个值都为 NaN
+    """
+
+    def __init__(self, fast=12, slow=26, signal=9, maxlen=240):
+        super().__init__(maxlen)
+        if slow < fast:
+            fast, slow = slow, fast
+        self._fast = EMA(fast, maxlen=1)
+        self._slow = EMA(slow, maxlen=1)
+        self._signal = EMA(signal, maxlen=1)
+        self.signal = np.nan
+        self.hist = np.nan
+
+    def _update(self, close, high=None, low=None):
+        slow = self._slow.update(close)
+        # 快线从第 slow - fast + 1 根K线开始计算, 与慢线同时得到初始值
+        if self.count <= self._slow.period - self._fast.period:
+            return np.nan
+        dif = self._fast.update(close) - slow
+        if np.isnan(dif):
+            return np.nan
+        self.signal = self._signal.update(dif)
+        if np.isnan(self.signal):
+            return np.nan
+        self.hist = dif - self.signal
+        return dif
+
+
+class RollingMax(Indicator):
+    """滚动最高价, 单调队列, 均摊 O(1)"""
+
+    sign = 1
+
+    def __init__(self, period=20, maxlen=240):
+        super().__init__(maxlen)
+        self.period = period
+        # (序号, 值), 值单调不增
+        self._window = deque()
+
+    def _update(self, close, high=None, low=None):
+        x = self._pick(close, high, low) * self.sign
+        window = self._window
+        while window and window[-1][1] <= x:
+            window.pop()
+        window.append((self.count, x))
+        if window[0][0] <= self.count - self.period:
+            window.popleft()
+        return window[0][1] * self.sign if self.count >= self.period else np.nan
+
+    def _pick(self, close, high, low):
+        return close if high is None else high
+
+
+class RollingMin(RollingMax):
+    """滚动最低价"""
+
+    sign = -1
+
+    def _pick(self, close, high, low):
+        return close if low is None else low
+
+
+class CCI(Indicator):
+    """
+    顺势指标, 与 talib.CCI 一致
+    典型价之和随窗口 O(1) 更新; 平均绝对偏差需遍历窗口, 每根K线为 O(period)
+    """
+
+    def __init__(self, period=14, maxlen=240):
+        super().__init__(maxlen)
+        self.period = period
+        self._window = deque(maxlen=period)
+        self._sum = 0.0
+
+    def _update(self, close, high=None, low=None):
+        tp = (high + low + close) / 3.0
+        if len(self._window) == self.period:
+            self._sum -= self._window[0]
+        self._window.append(tp)
+        self._sum += tp
+        if len(self._window) < self.period:
+            return np.nan
+        mean = self._sum / self.period
+        deviation = sum(abs(x - mean) for x in self._window) / self.period
+        return (tp - mean) / (0.015 * deviation) if deviation else 0.0
+
+
+INDICATORS = {
+    'EMA': EMA,
+    'RSI': RSI,
+    'MACD': MACD,
+    'CCI': CCI,
+    'MAX': RollingMax,
+    'MIN': RollingMin,
+}
+
+
+class IndicatorEngine:
+    """
+    指标引擎, 挂在 Context 上, 所有策略共用
+
+    按 (标的, 周期, 指标, 参数) 保存增量状态: 首次使用时用历史K线预热, 之后每次只把上次之后的新K线喂给指标.
+    实盘取到的最后一根K线可能尚未收盘(include_now), 增量状态只包含已收盘的K线,
+    最后一根K线在状态的副本上计算, 收盘价变化后下次查询重新计算, 不会写入状态.
+    同一时刻(context.current_dt)内的重复查询直接返回缓存结果.
+    """
+
+    # 预热所用K线数
+    WARMUP_BARS = 240
+    # 增量更新时每次取的K线数, 不足以衔接上次的K线时重新预热
+    UPDATE_BARS = 16
+
+    def __init__(self, context):
+        self.context = context
+        self.lock = threading.RLock()
+        # key -> [指标, 最后一根已收盘K线的时间, 各值对应的K线时间]
+        self._states = {}
+        # key -> (含最后一根K线的指标, 各值对应的K线时间)
+        self._memo = {}
+        self._memo_dt = None
+
+    def _key(self, symbol, unit, name, params):
+        return symbol, unit, name, tuple(sorted(params.items()))
+
+    def _fetch(self, symbol, unit, count):
+        df = self.context.fetch_bars(symbol, max_num=count, unit=unit,
+                                     fields=['date', 'open', 'high', 'low', 'close'])
+        if df is None or len(df) == 0:
+            return None, None
+        times = df['date'].values if 'date' in df.columns else df.index.values
+        return np.asarray(pd.to_datetime(times).values), df
+
+    def _new_state(self, name, params):
+        indicator = INDICATORS[name](**params)
+        return [indicator, None, deque(maxlen=indicator.history.maxlen)]
+
+    def _compute(self, key, symbol, unit, name, params):
+        state = self._states.get(key)
+        count = self.UPDATE_BARS if state is not None else self.WARMUP_BARS
+        times, df = self._fetch(symbol, unit, count)
+        if times is None:
+            if state is None:
+                return INDICATORS[name](**params), []
+            return state[0], list(state[2])
+
+        # 最后一根K线可能尚未收盘, 不计入增量状态
+        closed = np.ones(len(times), dtype=bool)
+        closed[-1] = False
+        if state is not None and state[1] is not None:
+            new = closed & (times > state[1])
+            if new[:-1].all() and len(times) >= count:
+                # 距上次更新的K线超过本次所取范围, 重新预热
+                state = None
+                times, df = self._fetch(symbol, unit, self.WARMUP_BARS)
+                closed = np.ones(len(times), dtype=bool)
+                closed[-1] = False
+                new = closed
+        else:
+            new = closed
+        if state is None:
+            state = self._states[key] = self._new_state(name, params)
+
+        indicator, last, state_times = state
+        close, high, low = df['close'].values, df['high'].values, df['low'].values
+        for i in np.flatnonzero(new):
+            indicator.update(float(close[i]), float(high[i]), float(low[i]))
+            state_times.append(times[i])
+        if new.any():
+            state[1] = last = times[new][-1]
+
+        if last is not None and times[-1] <= last:
+            return indicator, list(state_times)
+        provisional = copy.deepcopy(indicator)
+        provisional.update(float(close[-1]), float(high[-1]), float(low[-1]))
+        return provisional, list(state_times) + [times[-1]]
+
+    def _get(self, symbol, unit, name, params):
+        key = self._key(symbol, unit, name, params)
+        with self.lock:
+            if self._memo_dt != self.context.current_dt:
+                self._memo = {}
+                self._memo_dt = self.context.current_dt
+            result = self._memo.get(key)
+            if result is None:
+                result = self._memo[key] = self._compute(key, symbol, unit, name, params)
+            return result
+
+    def indicator(self, symbol, unit, name, **params) -> Indicator:
+        """
+        更新到当前时刻并返回指标对象, 包含最后一根可能尚未收盘的K线, 调用方不应修改
+        :param name: 指标名称, 见 INDICATORS
+        :param params: 指标参数, 如 period=14
+        """
+        return self._get(symbol, unit, name, params)[0]
+
+    def value(self, symbol, unit, name, **params):
+        """指标最新值"""
+        return self.indicator(symbol, unit, name, **params).value
+
+    def series(self, symbol, unit, name, n, **params) -> pd.Series:
+        """
+        指标最近 n 个值, 与对最近 n 根K线调用 talib 一样返回以K线时间为索引的 Series, K线不足 n 根时只返回已有的部分
+        """
+        indicator, times = self._get(symbol, unit, name, params)
+        values = list(indicator.history)[-n:] if n else []
+        index = pd.DatetimeIndex(times[len(times) - len(values):], name='date')
+        return pd.Series(values, index=index, dtype=np.float64)
+
+    def clear(self):
+        with self.lock:
+            self._states.clear()
+            self._memo = {}
@@ -1,12 +1,20 @@
 import os
 import sys
 
-import logbook
-from logbook import Logger, StreamHandler, FileHandler
-
 from easyquant.context import Context
 
-logbook.set_datetime_format('local')
+_stdout_pushed = False
+
+
+def push_stdout_handler():
+    """logbook 输出到标准输出, 进程内只设置一次; logbook 在此时才导入"""
+    global _stdout_pushed
+    import logbook
+
+    if not _stdout_pushed:
+        _stdout_pushed = True
+        logbook.set_datetime_format('local')
+        logbook.StreamHandler(sys.stdout).push_application()
 
 
 class DefaultLogHandler(object):
@@ -20,6 +28,10 @@ class DefaultLogHandler(object):
         :param :loglevel: 设定log等级 ['CRITICAL', 'ERROR', 'WARNING', 'NOTICE', 'INFO', 'DEBUG', 'TRACE', 'NOTSET']
         :return log handler object
         """
+        import logbook
+        from logbook import Logger, StreamHandler, FileHandler
+
+        logbook.set_datetime_format('local')
         self.log = Logger(name)
         if log_type == 'stdout':
             StreamHandler(sys.stdout, level=loglevel).push_application()
@@ -7,21 +7,20 @@ import threading
 import time
 from collections import OrderedDict
 from datetime import datetime, timedelta
-from threading import Thread, Lock
-
-import easytrader
-from logbook import Logger, StreamHandler
+from threading import Thread, RLock
 
 from .context import Context
 from .event_engine import EventEngine, Event
-from .log_handler.default_handler import DefaultLogHandler
+from .log_handler.default_handler import DefaultLogHandler, push_stdout_handler
+from .market_bus import MarketBus, SnapshotStore
+from .metrics import REGISTRY, start_http_server
+from .multiprocess.ring_buffer import RingBuffer
+from .multiprocess.strategy_wrapper import ProcessWrapper
 from .push_engine.clock_engine import ClockEngine
 from .push_engine.quotation_engine import QuotationEngine
 from .quotation import use_quotation
 from .strategy.strategyTemplate import StrategyTemplate
-
-log = Logger(os.path.basename(__file__))
-StreamHandler(sys.stdout).push_application()
+from .strategy_watcher import create_watcher
 
 PY_MAJOR_VERSION, PY_MINOR_VERSION = sys.version_info[:2]
 if (PY_MAJOR_VERSION, PY_MINOR_VERSION) < (3, 5):
@@ -29,23 +28,65 @@ if (PY_MAJOR_VERSION, PY_MINOR_VERSION) < (3, 5):
 
 ACCOUNT_OBJECT_FILE = 'account.session'
 
+STRATEGY_PENDING = REGISTRY.gauge('easyquant_strategy_pending', '策略进程尚未处理的事件和时钟数', ['strategy'])
+STRATEGY_LAG = REGISTRY.gauge('easyquant_strategy_lag_seconds', '策略进程最近一次从推送到处理完成的耗时(秒)',
+                              ['strategy'])
+STRATEGY_RESTARTS = REGISTRY.gauge('easyquant_strategy_restarts', '策略进程的重启次数', ['strategy'])
+
+
+class StrategySlot:
+    """
+    策略在事件引擎中的固定入口
+    重载时只原子地替换背后的处理函数, 事件引擎中的注册不变, 替换期间不会漏掉或重复处理事件
+    """
+
+    def __init__(self, run, clock):
+        self._handlers = (run, clock)
+
+    def swap(self, run, clock):
+        """
+        :return: 被替换的 (run, clock)
+        """
+        old, self._handlers = self._handlers, (run, clock)
+        return old
+
+    def run(self, event):
+        self._handlers[0](event)
+
+    def clock(self, event):
+        self._handlers[1](event)
+
 
 class MainEngine:
     """主引擎，负责行情 / 事件驱动引擎 / 交易"""
 
+    # 策略进程的检查间隔(秒)
+    SUPERVISE_INTERVAL = 1
+    # 策略进程健康统计的日志间隔(秒)
+    METRICS_LOG_INTERVAL = 60
+    # 关闭时等待策略进程排空的最长秒数
+    DRAIN_TIMEOUT = 30
+
     def __init__(self, broker=None, need_data=None,
                  bar_type="5m",
                  quotation='default',
-                 log_handler=DefaultLogHandler(), tzinfo=None):
+                 log_handler=None, tzinfo=None, metrics_port=None):
         """初始化事件 / 行情 引擎并启动事件引擎
+        :param log_handler: 日志句柄, 默认 DefaultLogHandler
+        :param metrics_port: 传入时在本机该端口提供 /metrics 运行指标
         """
+        push_stdout_handler()
+        log_handler = log_handler or DefaultLogHandler()
         self.log = log_handler
         self.bar_type = bar_type
         self.broker = broker
+        self.metrics_port = metrics_port
         self.quotation = use_quotation(quotation)
 
         # 登录账户
         if (broker is not None) and (need_data is not None):
+            import easytrader
+
             self.user = easytrader.use(broker)
             need_data_file = pathlib.Path(need_data)
             if need_data_file.exists():
@@ -61,7 +102,10 @@ class MainEngine:
         self.event_engine = EventEngine()
         self.clock_engine = ClockEngine(self.event_engine, self.context, tzinfo)
 
-        self.quotation_engine = QuotationEngine(self.quotation, self.event_engine, bar_type=bar_type)
+        # 行情总线, 各上游行情只拉取一次, 由订阅者共用
+        self.market_bus = MarketBus(log=self.log)
+        self.quotation_engine = QuotationEngine(self.quotation, self.event_engine, bar_type=bar_type,
+                                                bus=self.market_bus, log=self.log)
 
         # 保存读取的策略类
         self.strategies = OrderedDict()
@@ -76,11 +120,25 @@ class MainEngine:
         # 文件模块映射
         self._modules = {}
         self._names = None
+        # 文件 -> 当前生效的策略实例
+        self._file_strategies = {}
+        # 策略名 -> 注册在事件引擎中的 StrategySlot
+        self._slots = {}
         # 加载锁
-        self.lock = Lock()
+        self.lock = RLock()
+        self._watch_active = False
         # 加载线程
         self._watch_thread = Thread(target=self._load_strategy, name="MainEngine.watch_reload_strategy")
 
+        # 是否每个策略运行在独立进程中
+        self.process_mode = False
+        # 策略名 -> ProcessWrapper
+        self.process_wrappers = OrderedDict()
+        # 策略进程共用的K线环形缓冲区
+        self.ring_buffer = None
+        self._supervise_active = False
+        self._supervise_thread = Thread(target=self._supervise, name="MainEngine.supervise_strategy_process")
+
         # shutdown 函数
         self.before_shutdown = []  # 关闭引擎前的 shutdown
         self.main_shutdown = []  # 引擎自身要执行的 shutdown
@@ -109,48 +167,106 @@ class MainEngine:
         self.clock_engine.start()
         self._add_main_shutdown(self.clock_engine.stop)
 
-    def load(self, names, strategy_file):
-        with self.lock:
-            mtime = os.path.getmtime(os.path.join('strategies', strategy_file))
+        # 通过 market_bus.add_source 注册的定时行情
+        self.market_bus.start()
+        self._add_main_shutdown(self.market_bus.stop)
 
-            # 是否需要重新加载
-            reload = False
-
-            strategy_module_name = os.path.basename(strategy_file)[:-3]
-            new_module = lambda strategy_module_name: importlib.import_module('.' + strategy_module_name, 'strategies')
-            strategy_module = self._modules.get(
-                strategy_file,  # 从缓存中获取 module 实例
-                new_module(strategy_module_name)  # 创建新的 module 实例
-            )
+        if self.metrics_port is not None:
+            server = start_http_server(self.metrics_port)
+            self.log.info('运行指标: http://%s:%s/metrics' % server.server_address[:2])
+            self._add_main_shutdown(server.shutdown)
 
+    def load(self, names, strategy_file):
+        """
+        加载或重新加载一个策略文件, 只导入该文件
+        新实例创建并预热完成后才替换旧实例, 替换期间事件处理函数保持注册, 旧实例处理中的事件正常完成
+        """
+        with self.lock:
+            path = os.path.join('strategies', strategy_file)
+            if not os.path.exists(path):
+                self.unload(strategy_file)
+                return
+            mtime = os.path.getmtime(path)
             if self._cache.get(strategy_file, None) == mtime:
                 # 检查最后改动时间
                 return
-            elif self._cache.get(strategy_file, None) is not None:
-                # 注销策略的监听
-                old_strategy = self.get_strategy(strategy_module.Strategy.name)
-                if old_strategy is None:
-                    for s in self.strategy_list:
-                        print(s.name)
-                self.log.warn(u'卸载策略: %s' % old_strategy.name)
-                self.strategy_listen_event(old_strategy, "unlisten")
-                time.sleep(2)
-                reload = True
-            # 重新加载
-            if reload:
-                strategy_module = importlib.reload(strategy_module)
 
+            strategy_module_name = os.path.basename(strategy_file)[:-3]
+            strategy_module = self._modules.get(strategy_file)
+            if strategy_module is None:
+                strategy_module = importlib.import_module('.' + strategy_module_name, 'strategies')
+            else:
+                # 重新加载
+                strategy_module = importlib.reload(strategy_module)
             self._modules[strategy_file] = strategy_module
+            self._cache[strategy_file] = mtime
 
             strategy_class = getattr(strategy_module, 'Strategy')
-            if names is None or strategy_class.name in names:
-                self.strategies[strategy_module_name] = strategy_class
-                # 缓存加载信息
-                new_strategy = strategy_class(user=self.user, log_handler=self.log, main_engine=self)
-                self.strategy_list.append(new_strategy)
-                self._cache[strategy_file] = mtime
-                self.strategy_listen_event(new_strategy, "listen")
+            old_strategy = self._file_strategies.get(strategy_file)
+            if names is not None and strategy_class.name not in names:
+                if old_strategy is not None:
+                    self.unload(strategy_file)
+                return
+
+            self.strategies[strategy_module_name] = strategy_class
+            new_strategy = strategy_class(user=self.user, log_handler=self.log, main_engine=self)
+            # 定时行情由主进程拉取, 在 fork 策略进程之前注册
+            for topic, fetch, interval in new_strategy.market_sources():
+                self.market_bus.add_source(topic, fetch, interval)
+            new_strategy.warm_up()
+            self._replace_strategy(old_strategy, new_strategy)
+            self._file_strategies[strategy_file] = new_strategy
+            if old_strategy is None:
                 self.log.info(u'加载策略: %s' % strategy_module_name)
+            else:
+                self.log.warn(u'重新加载策略: %s' % strategy_module_name)
+
+    def _replace_strategy(self, old_strategy, new_strategy):
+        """以新策略实例替换旧实例, old_strategy 为 None 时只注册新实例"""
+        old_wrapper = self.process_wrappers.pop(old_strategy.name, None) if old_strategy is not None else None
+        if self.process_mode:
+            # 预热后再 fork, 策略进程直接继承预热的状态
+            self.process_wrappers[new_strategy.name] = ProcessWrapper(
+                new_strategy, self.ring_buffer, snapshot_store=self.market_bus.store)
+
+        slot = self._slots.get(new_strategy.name)
+        if old_strategy is not None and old_strategy.name == new_strategy.name and slot is not None:
+            slot.swap(*self._handlers(new_strategy))
+        else:
+            if old_strategy is not None:
+                self.strategy_listen_event(old_strategy, "unlisten")
+            self.strategy_listen_event(new_strategy, "listen")
+
+        if old_strategy is not None and old_strategy in self.strategy_list:
+            self.strategy_list[self.strategy_list.index(old_strategy)] = new_strategy
+        else:
+            self.strategy_list.append(new_strategy)
+        if old_wrapper is not None:
+            # 旧策略进程在后台处理完已推送的事件后退出
+            Thread(target=old_wrapper.stop, args=(self.DRAIN_TIMEOUT,), daemon=True,
+                   name="MainEngine.drain_%s" % old_wrapper.name).start()
+
+    def unload(self, strategy_file):
+        """卸载策略文件对应的策略"""
+        with self.lock:
+            old_strategy = self._file_strategies.pop(strategy_file, None)
+            self._cache.pop(strategy_file, None)
+            if old_strategy is None:
+                return
+            self.log.warn(u'卸载策略: %s' % old_strategy.name)
+            self.strategy_listen_event(old_strategy, "unlisten")
+            if old_strategy in self.strategy_list:
+                self.strategy_list.remove(old_strategy)
+            wrapper = self.process_wrappers.pop(old_strategy.name, None)
+            if wrapper is not None:
+                wrapper.stop(self.DRAIN_TIMEOUT)
+
+    def _handlers(self, strategy):
+        # 独立进程运行的策略, 事件转发给策略进程
+        wrapper = self.process_wrappers.get(strategy.name)
+        if wrapper is not None:
+            return wrapper.on_event, wrapper.on_clock
+        return strategy.run, strategy.clock
 
     def strategy_listen_event(self, strategy, _type="listen"):
         """
@@ -164,17 +280,38 @@ class MainEngine:
             "unlisten": self.event_engine.unregister,
         }.get(_type)
 
+        # 事件引擎中注册的是策略的固定入口, 重载时只替换入口背后的策略
+        if _type == "listen":
+            slot = self._slots.get(strategy.name)
+            if slot is None:
+                slot = self._slots[strategy.name] = StrategySlot(*self._handlers(strategy))
+            else:
+                slot.swap(*self._handlers(strategy))
+        else:
+            slot = self._slots.pop(strategy.name, None)
+            if slot is None:
+                return
+
         # 行情引擎的事件
-        func(self.quotation_engine.EventType, strategy.run)
+        func(self.quotation_engine.EventType, slot.run)
 
         # 时钟事件
-        func(ClockEngine.EventType, strategy.clock)
+        func(ClockEngine.EventType, slot.clock)
 
-    def load_strategy(self, names=None):
+    def load_strategy(self, names=None, process=False):
         """动态加载策略
-        :param names: 策略名列表，元素为策略的 name 属性"""
+        :param names: 策略名列表，元素为策略的 name 属性
+        :param process: 是否每个策略运行在独立进程中, 计算密集的策略可分别占用 CPU 核;
+            策略进程意外退出时自动重启, 关闭时先处理完已推送的事件"""
         s_folder = 'strategies'
         self._names = names
+        if process and not self.process_mode:
+            self.process_mode = True
+            self.ring_buffer = RingBuffer()
+            # 行情快照同时写入共享内存, 策略进程直接读取
+            self.market_bus.store = SnapshotStore()
+            self._supervise_active = True
+            self._supervise_thread.start()
         strategies = os.listdir(s_folder)
         strategies = filter(lambda file: file.endswith('.py') and file != '__init__.py', strategies)
         importlib.import_module(s_folder)
@@ -183,15 +320,73 @@ class MainEngine:
         # 如果线程没有启动，就启动策略监视线程
         if self.is_watch_strategy and not self._watch_thread.is_alive():
             self.log.warn("启用了动态加载策略功能")
+            self._watch_active = True
+            self._add_main_shutdown(self._stop_watch)
             self._watch_thread.start()
 
     def _load_strategy(self):
-        while True:
-            try:
-                self.load_strategy(self._names)
-                time.sleep(2)
-            except Exception as e:
-                print(e)
+        """监视策略目录, 只重新加载有变动的文件"""
+        watcher = create_watcher('strategies')
+        self.log.info('策略目录监视方式: %s' % type(watcher).__name__)
+        try:
+            while self._watch_active:
+                for strategy_file in sorted(watcher.changes(timeout=1)):
+                    if strategy_file == '__init__.py':
+                        continue
+                    try:
+                        self.load(self._names, strategy_file)
+                    except Exception as e:
+                        self.log.error('加载策略文件 %s 失败: %s' % (strategy_file, e))
+        finally:
+            watcher.close()
+
+    def _stop_watch(self):
+        self._watch_active = False
+        if self._watch_thread.is_alive():
+            self._watch_thread.join()
+
+    def _supervise(self):
+        """监控策略进程, 意外退出的重启, 并定期输出健康统计"""
+        last_log = time.time()
+        while self._supervise_active:
+            for wrapper in list(self.process_wrappers.values()):
+                try:
+                    wrapper.check()
+                except Exception as e:
+                    self.log.error('重启策略进程 %s 失败: %s' % (wrapper.name, e))
+                m = wrapper.metrics()
+                STRATEGY_PENDING.labels(wrapper.name).set(m['pending'])
+                STRATEGY_LAG.labels(wrapper.name).set(m['last_lag'])
+                STRATEGY_RESTARTS.labels(wrapper.name).set(m['restarts'])
+            if time.time() - last_log >= self.METRICS_LOG_INTERVAL:
+                last_log = time.time()
+                for name, m in self.strategy_metrics().items():
+                    self.log.info('策略进程 %s: alive=%s 事件 %d/%d 时钟 %d/%d 积压 %d 异常 %d 延迟 %.3fs(最大 %.3fs) 重启 %d'
+                                  % (name, m['alive'], m['events_processed'], m['events_sent'],
+                                     m['clocks_processed'], m['clocks_sent'], m['pending'], m['errors'],
+                                     m['last_lag'], m['max_lag'], m['restarts']))
+            time.sleep(self.SUPERVISE_INTERVAL)
+
+    def strategy_metrics(self):
+        """
+        策略进程的健康与延迟统计
+        :return: {策略名: ProcessWrapper.metrics()}
+        """
+        return {name: wrapper.metrics() for name, wrapper in list(self.process_wrappers.items())}
+
+    def _stop_strategy_process(self):
+        """停止监控, 各策略进程排空事件后退出"""
+        self._supervise_active = False
+        if self._supervise_thread.is_alive():
+            self._supervise_thread.join()
+        for wrapper in list(self.process_wrappers.values()):
+            wrapper.stop(self.DRAIN_TIMEOUT)
+        if self.ring_buffer is not None:
+            self.ring_buffer.close()
+            self.ring_buffer = None
+        if self.market_bus.store is not None:
+            self.market_bus.store.close()
+            self.market_bus.store = None
 
     def get_strategy(self, name):
         for strategy in self.strategy_list:
@@ -242,8 +437,11 @@ class MainEngine:
 
         # 调用策略的 shutdown
         self.log.debug("开始关闭策略...")
+        # 独立进程运行的策略在各自进程内调用 shutdown
+        self._stop_strategy_process()
         for s in self.strategy_list:
-            s.shutdown()
+            if s.name not in self.process_wrappers:
+                s.shutdown()
 
         # 所有 shutdown 后的触发点
         for st in self.after_shutdown:
@@ -0,0 +1,447 @@
+# coding: utf-8
+import asyncio
+import heapq
+import pickle
+import threading
+import time
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+from pandas import DataFrame
+
+# 统一的行情总线
+# 每个上游数据源只拉取一次, 结果整理为 Snapshot 后按主题分发给所有订阅者:
+#   进程内订阅者拿到同一个快照对象, 不复制数据;
+#   其它进程通过共享内存中的 SnapshotStore 读取最新快照, 不再各自请求上游.
+# 主题以 '.' 分级, 订阅 'quotes' 会收到 'quotes.600000' 等所有下级主题.
+
+TOPIC_BOARDS = 'boards'
+TOPIC_BOARD_CONS = 'board_cons'
+TOPIC_RANKS = 'ranks'
+TOPIC_SPEED_RANKS = 'speed_ranks'
+TOPIC_QUOTES = 'quotes'
+TOPIC_BARS = 'bars'
+
+
+def topic_of(*parts):
+    """
+    >>> topic_of(TOPIC_QUOTES, '600000')
+    'quotes.600000'
+    """
+    return '.'.join(str(p) for p in parts)
+
+
+def normalize(data):
+    """
+    把上游返回整理为快照数据: 记录列表 / 字典转为 DataFrame, DataFrame 和 {标的: DataFrame} 原样保留
+    :return: 整理后的数据, 上游请求失败(None)时返回 None
+    """
+    if data is None or isinstance(data, DataFrame):
+        return data
+    if isinstance(data, list):
+        return DataFrame(data)
+    if isinstance(data, dict) and data and all(isinstance(v, DataFrame) for v in data.values()):
+        return data
+    if isinstance(data, dict):
+        return DataFrame([data])
+    return data
+
+
+class Snapshot:
+    """
+    某一主题在某一时刻的行情
+    同一快照发给所有订阅者, 订阅者不应修改 data, 需要修改时先 copy
+    """
+
+    __slots__ = ('topic', 'data', 'ts', 'seq', 'fetch_seconds', 'attrs')
+
+    def __init__(self, topic, data, ts=None, seq=0, fetch_seconds=None, attrs=None):
+        """
+        :param data: DataFrame 或 {标的: DataFrame}
+        :param ts: 拉取完成的时间戳(秒)
+        :param seq: 该主题的快照序号, 从 1 开始
+        :param fetch_seconds: 拉取上游的耗时
+        :param attrs: 其它属性, 如K线的 bar_dt
+        """
+        self.topic = topic
+        self.data = data
+        self.ts = time.time() if ts is None else ts
+        self.seq = seq
+        self.fetch_seconds = fetch_seconds
+        self.attrs = attrs or {}
+
+    @property
+    def age(self):
+        """距拉取完成的秒数"""
+        return time.time() - self.ts
+
+    def __repr__(self):
+        return 'Snapshot(%s, seq=%d, age=%.1fs)' % (self.topic, self.seq, self.age)
+
+
+class _Source:
+    __slots__ = ('topic', 'fetch', 'interval', 'next_due')
+
+    def __init__(self, topic, fetch, interval):
+        self.topic = topic
+        self.fetch = fetch
+        self.interval = interval
+        self.next_due = 0.0
+
+    def __lt__(self, other):
+        return self.next_due < other.next_due
+
+
+class MarketBus:
+    """
+    行情总线
+
+    数据来源有两种:
+        add_source 注册定时拉取的数据源, start 后由总线的拉取线程按间隔拉取并发布;
+        get / aget 按需拉取, 最新快照未过期时直接返回, 过期时同一主题只有一个调用方请求上游, 其它调用方等待并共用结果.
+    """
+
+    def __init__(self, log=None, store=None, local_topics=(TOPIC_BARS,)):
+        """
+        :param log: 日志句柄, 订阅者或数据源出错时调用 log.error, 默认输出到标准错误
+        :param store: SnapshotStore, 传入时快照同时写入共享内存, 或在本进程没有快照时从共享内存读取
+        :param local_topics: 只在本进程发布、不写入共享内存的主题(含下级主题);
+                             K线已经由环形缓冲区分发给策略进程, 默认不再写入
+        """
+        self.log = log
+        self.store = store
+        self.local_topics = tuple(local_topics)
+        self._latest = {}
+        self._seq = {}
+        self._subscribers = {}
+        self._lock = threading.RLock()
+        # 主题 -> 按需拉取锁
+        self._fetch_locks = {}
+        # 主题 -> 异步拉取中的 Future
+        self._pending = {}
+        self._sources = []
+        self._active = False
+        self._wakeup = threading.Event()
+        self._thread = None
+        # 统计: 上游请求次数, 直接使用已有快照的次数
+        self.fetches = 0
+        self.hits = 0
+
+    def _error(self, message):
+        if self.log is not None:
+            self.log.error('%s\n%s' % (message, traceback.format_exc()))
+        else:
+            traceback.print_exc()
+
+    # ---------- 订阅 ----------
+
+    def subscribe(self, topic, callback):
+        """
+        :param topic: 主题, 也会收到其下级主题的快照
+        :param callback: callback(snapshot), 在发布快照的线程中调用, 应尽快返回
+        """
+        with self._lock:
+            callbacks = self._subscribers.setdefault(topic, [])
+            if callback not in callbacks:
+                # 复制后替换, 发布时无需加锁遍历
+                self._subscribers[topic] = callbacks + [callback]
+        return callback
+
+    def unsubscribe(self, topic, callback):
+        with self._lock:
+            callbacks = [c for c in self._subscribers.get(topic, ()) if c != callback]
+            if callbacks:
+                self._subscribers[topic] = callbacks
+            else:
+                self._subscribers.pop(topic, None)
+
+    def _callbacks(self, topic):
+        subscribers = self._subscribers
+        callbacks = list(subscribers.get(topic, ()))
+        parts = topic.split('.')
+        for i in range(len(parts) - 1, 0, -1):
+            callbacks.extend(subscribers.get('.'.join(parts[:i]), ()))
+        return callbacks
+
+    # ---------- 发布 ----------
+
+    def publish(self, topic, data, fetch_seconds=None, **attrs):
+        """
+        发布快照
+        :param data: 上游返回, 经 normalize 整理, 为 None 时不发布
+        :param attrs: 随快照传递的其它属性
+        :return: Snapshot, data 为 None 时返回 None
+        """
+        data = normalize(data)
+        if data is None:
+            return None
+        with self._lock:
+            seq = self._seq.get(topic, 0) + 1
+            self._seq[topic] = seq
+            snapshot = Snapshot(topic, data, seq=seq, fetch_seconds=fetch_seconds, attrs=attrs)
+            self._latest[topic] = snapshot
+        if self.store is not None and self.store.owner and not self._is_local(topic):
+            try:
+                self.store.write(snapshot)
+            except Exception:
+                self._error('快照 %s 写入共享内存失败' % topic)
+        for callback in self._callbacks(topic):
+            try:
+                callback(snapshot)
+            except Exception:
+                self._error('订阅者处理快照 %s 出错' % topic)
+        return snapshot
+
+    def _is_local(self, topic):
+        return any(topic == t or topic.startswith(t + '.') for t in self.local_topics)
+
+    def latest(self, topic):
+        """
+        :return: 该主题最新的快照, 本进程没有时从共享内存读取, 都没有时返回 None
+        """
+        snapshot = self._latest.get(topic)
+        if self.store is not None and not self.store.owner:
+            shared = self.store.read(topic)
+            if shared is not None and (snapshot is None or shared.ts > snapshot.ts):
+                snapshot = shared
+        return snapshot
+
+    def get(self, topic, fetch, max_age):
+        """
+        取该主题的行情, 最新快照未超过 max_age 秒时直接使用, 否则调用 fetch 拉取并发布
+        :param fetch: 无参函数, 返回上游数据
+        :return: 快照数据, 拉取失败时为 None
+        """
+        snapshot = self.latest(topic)
+        if snapshot is not None and snapshot.age <= max_age:
+            self.hits += 1
+            return snapshot.data
+        with self._lock:
+            fetch_lock = self._fetch_locks.setdefault(topic, threading.Lock())
+        with fetch_lock:
+            # 等待期间其它调用方可能已拉取
+            snapshot = self.latest(topic)
+            if snapshot is not None and snapshot.age <= max_age:
+                self.hits += 1
+                return snapshot.data
+            snapshot = self._fetch(topic, fetch)
+        return None if snapshot is None else snapshot.data
+
+    async def aget(self, topic, fetch, max_age):
+        """
+        get 的异步版本, 同一事件循环中同一主题只有一个协程请求上游
+        :param fetch: 无参函数, 返回上游数据的 awaitable
+        :return: 快照数据, 拉取失败时为 None
+        """
+        snapshot = self.latest(topic)
+        if snapshot is not None and snapshot.age <= max_age:
+            self.hits += 1
+            return snapshot.data
+        pending = self._pending.get(topic)
+        if pending is None:
+            pending = self._pending[topic] = asyncio.ensure_future(self._afetch(topic, fetch))
+            pending.add_done_callback(lambda _: self._pending.pop(topic, None))
+        else:
+            self.hits += 1
+        # 某个等待方被取消时不影响其它等待方
+        snapshot = await asyncio.shield(pending)
+        return None if snapshot is None else snapshot.data
+
+    async def _afetch(self, topic, fetch):
+        self.fetches += 1
+        start = time.perf_counter()
+        data = await fetch()
+        return self.publish(topic, data, fetch_seconds=time.perf_counter() - start)
+
+    def _fetch(self, topic, fetch):
+        self.fetches += 1
+        start = time.perf_counter()
+        data = fetch()
+        return self.publish(topic, data, fetch_seconds=time.perf_counter() - start)
+
+    # ---------- 定时拉取 ----------
+
+    def add_source(self, topic, fetch, interval):
+        """
+        注册定时拉取的数据源, 同一主题只保留最后注册的一个
+        :param fetch: 无参函数, 返回上游数据, 返回 None 时本次不发布
+        :param interval: 拉取间隔(秒)
+        """
+        with self._lock:
+            for source in self._sources:
+                if source.topic == topic:
+                    source.fetch = fetch
+                    source.interval = interval
+                    break
+            else:
+                heapq.heappush(self._sources, _Source(topic, fetch, interval))
+        self._wakeup.set()
+
+    def start(self):
+        if self._active:
+            return
+        self._active = True
+        self._thread = threading.Thread(target=self._poll, name='MarketBus.poll', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._active = False
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _poll(self):
+        while self._active:
+            with self._lock:
+                source = heapq.heappop(self._sources) if self._sources else None
+            if source is None:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            delay = source.next_due - time.time()
+            if delay > 0:
+                with self._lock:
+                    heapq.heappush(self._sources, source)
+                # 新增数据源或停止时提前唤醒
+                self._wakeup.wait(delay)
+                self._wakeup.clear()
+                continue
+            try:
+                self._fetch(source.topic, source.fetch)
+            except Exception:
+                self._error('拉取 %s 出错' % source.topic)
+            source.next_due = max(source.next_due + source.interval, time.time())
+            with self._lock:
+                heapq.heappush(self._sources, source)
+
+    def stats(self):
+        return {'topics': len(self._latest), 'fetches': self.fetches, 'hits': self.hits,
+                'sources': len(self._sources)}
+
+
+# 共享内存快照区
+# 控制区: [槽位数, 槽位字节数]; 每个槽位: [版本号, 时间戳, 序号, 数据长度] + 主题(64 字节) + 数据
+_STORE_HEADER = 64
+_SLOT_HEADER = 4 * 8
+_TOPIC_BYTES = 64
+_SLOT_DATA = _SLOT_HEADER + _TOPIC_BYTES
+
+
+class SnapshotStore:
+    """
+    共享内存中各主题的最新快照
+
+    一个写进程、多个读进程. 每个主题占一个固定槽位, 写入时版本号先加一(奇数表示写入中), 写完再加一;
+    读进程在版本号前后一致且为偶数时才采用读到的数据, 无需加锁. 同一版本只反序列化一次.
+    读进程应为写进程的子进程(如 ProcessWrapper 启动的策略进程), 与写进程共用 resource_tracker.
+    """
+
+    def __init__(self, name=None, slots=256, slot_size=1024 * 1024, create=True):
+        """
+        :param name: 共享内存名称, 创建时为 None 则自动生成
+        :param slots: 主题数上限
+        :param slot_size: 每个槽位的字节数, 序列化后的快照需小于该值
+        :param create: True 创建(写进程), False 挂载已有的快照区(读进程)
+        """
+        if create:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=_STORE_HEADER + slots * slot_size)
+            header = np.ndarray((2,), dtype=np.int64, buffer=self.shm.buf)
+            header[:] = (slots, slot_size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name, create=False)
+            header = np.ndarray((2,), dtype=np.int64, buffer=self.shm.buf)
+        self.owner = create
+        self.slots, self.slot_size = (int(x) for x in header)
+        self._lock = threading.Lock()
+        # 主题 -> 槽位
+        self._index = {}
+        # 读进程: 主题 -> (版本号, Snapshot)
+        self._decoded = {}
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def _slot(self, i):
+        base = _STORE_HEADER + i * self.slot_size
+        header = np.ndarray((4,), dtype=np.int64, buffer=self.shm.buf, offset=base)
+        return base, header
+
+    def _read_topic(self, i):
+        base, _ = self._slot(i)
+        raw = bytes(self.shm.buf[base + _SLOT_HEADER:base + _SLOT_DATA])
+        return raw.rstrip(b'\0').decode('utf-8')
+
+    def _find(self, topic):
+        i = self._index.get(topic)
+        if i is not None:
+            return i
+        # 重新扫描写进程新增的槽位
+        for i in range(self.slots):
+            name = self._read_topic(i)
+            if not name:
+                break
+            self._index.setdefault(name, i)
+        return self._index.get(topic)
+
+    def write(self, snapshot: Snapshot):
+        payload = pickle.dumps((snapshot.data, snapshot.fetch_seconds, snapshot.attrs), protocol=pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self.slot_size - _SLOT_DATA:
+            raise ValueError('快照 %s 序列化后 %d 字节, 超过槽位大小 %d' % (snapshot.topic, len(payload), self.slot_size))
+        topic = snapshot.topic.encode('utf-8')
+        if len(topic) > _TOPIC_BYTES:
+            raise ValueError('主题过长: %s' % snapshot.topic)
+        with self._lock:
+            i = self._index.get(snapshot.topic)
+            if i is None:
+                i = len(self._index)
+                if i >= self.slots:
+                    raise ValueError('主题数超过 %d' % self.slots)
+                base, _ = self._slot(i)
+                self.shm.buf[base + _SLOT_HEADER:base + _SLOT_HEADER + len(topic)] = topic
+                self._index[snapshot.topic] = i
+            base, header = self._slot(i)
+            header[0] += 1
+            header[1:] = (np.float64(snapshot.ts).view(np.int64), snapshot.seq, len(payload))
+            self.shm.buf[base + _SLOT_DATA:base + _SLOT_DATA + len(payload)] = payload
+            header[0] += 1
+
+    def read(self, topic, retries=100):
+        """
+        :return: 该主题最新的 Snapshot, 没有时返回 None
+        """
+        i = self._find(topic)
+        if i is None:
+            return None
+        base, header = self._slot(i)
+        for _ in range(retries):
+            version = int(header[0])
+            if version == 0:
+                return None
+            cached = self._decoded.get(topic)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+            if version % 2:
+                time.sleep(0)
+                continue
+            ts, seq, length = header[1:].copy()
+            payload = bytes(self.shm.buf[base + _SLOT_DATA:base + _SLOT_DATA + int(length)])
+            if int(header[0]) != version:
+                continue
+            data, fetch_seconds, attrs = pickle.loads(payload)
+            snapshot = Snapshot(topic, data, ts=float(np.int64(ts).view(np.float64)), seq=int(seq),
+                                fetch_seconds=fetch_seconds, attrs=attrs)
+            self._decoded[topic] = (version, snapshot)
+            return snapshot
+        return None
+
+    def topics(self):
+        self._find('')
+        return list(self._index)
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
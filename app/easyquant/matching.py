@@ -0,0 +1,472 @@
+# coding: utf-8
+import datetime
+import re
+
+import numpy as np
+
+# 撮合状态
+STATUS_NONE = 0  # 无委托
+STATUS_FILLED = 1  # 全部成交
+STATUS_PARTIAL = 2  # 部分成交(可卖不足或资金不足)
+STATUS_LIMIT = 3  # 封涨停无法买入 / 封跌停无法卖出
+STATUS_PRICE = 4  # 委托价未触及
+STATUS_LOT = 5  # 不足一手
+STATUS_T1 = 6  # 无可卖数量(当日买入 T+1 才能卖出)
+STATUS_CASH = 7  # 资金不足
+STATUS_SUSPENDED = 8  # 停牌或无行情
+
+# 每手股数
+LOT_SIZE = 100
+
+_CODE_RE = re.compile(r'\d{6}')
+
+
+def limit_ratio(symbol):
+    """
+    涨跌幅限制比例
+    :param symbol: 股票代码, 如 '600000', '300750.XSHE', 'sz000001'
+    >>> limit_ratio('600000.XSHG')
+    0.1
+    >>> limit_ratio('sz300750')
+    0.2
+    >>> limit_ratio('830799')
+    0.3
+    """
+    match = _CODE_RE.search(symbol)
+    code = match.group() if match else symbol
+    if code.startswith(('300', '301', '688', '689')):
+        return 0.2
+    if code.startswith(('4', '8', '92')):
+        return 0.3
+    return 0.1
+
+
+def limit_prices(pre_close, ratio):
+    """
+    涨跌停价, 按交易所规则四舍五入到分
+    :param pre_close: 昨收价数组, NaN 表示不限制
+    :param ratio: 涨跌幅比例, 标量或与 pre_close 同形状的数组
+    :return: (涨停价, 跌停价)
+    >>> limit_prices(np.array([10.05]), 0.1)
+    (array([11.06]), array([9.05]))
+    """
+    pre_close = np.asarray(pre_close, dtype=np.float64)
+    # 加一个极小量抵消浮点误差, 例如 10.05 * 1.1 = 11.055000000000001 或 11.054999999999999
+    upper = np.floor(pre_close * (1 + ratio) * 100 + 0.5 + 1e-6) / 100
+    lower = np.floor(pre_close * (1 - ratio) * 100 + 0.5 + 1e-6) / 100
+    return upper, lower
+
+
+class FeeSchedule:
+    """A股交易费用: 佣金(双边, 有最低收费)、印花税(卖出)、过户费(双边)"""
+
+    def __init__(self, commission=0.0003, min_commission=5.0, stamp_duty=0.0005, transfer_fee=0.00001):
+        """
+        :param commission: 佣金费率
+        :param min_commission: 单笔最低佣金
+        :param stamp_duty: 卖出印花税率
+        :param transfer_fee: 过户费率
+        """
+        self.commission = commission
+        self.min_commission = min_commission
+        self.stamp_duty = stamp_duty
+        self.transfer_fee = transfer_fee
+
+    def calculate(self, value, is_sell):
+        """
+        :param value: 成交金额数组, 0 表示未成交
+        :param is_sell: 是否卖出的 bool 数组
+        :return: 费用数组
+        """
+        value = np.abs(value)
+        traded = value > 0
+        fee = np.maximum(value * self.commission, self.min_commission) + value * self.transfer_fee
+        fee = fee + np.where(is_sell, value * self.stamp_duty, 0.0)
+        return np.where(traded, fee, 0.0)
+
+
+class MatchResult:
+    """单根K线的撮合结果, 各字段均为按标的对齐的数组"""
+
+    def __init__(self, filled, price, fees, status):
+        """
+        :param filled: 成交股数, 正数买入负数卖出
+        :param price: 成交价, 未成交为 NaN
+        :param fees: 交易费用
+        :param status: 撮合状态, 见 STATUS_*
+        """
+        self.filled = filled
+        self.price = price
+        self.fees = fees
+        self.status = status
+
+    @property
+    def value(self):
+        """成交金额, 买入为正卖出为负"""
+        return np.where(self.filled != 0, self.filled * self.price, 0.0)
+
+
+class MatchingEngine:
+    """
+    A股撮合引擎
+
+    每根K线的全部委托以数组一次性撮合: 先卖后买(卖出所得当日可用), 整手买入, 卖出可卖数量(T+1),
+    整根K线封涨停时买单无法成交、封跌停时卖单无法成交, 资金不足时按比例缩减买单.
+    持仓、可卖数量、持仓成本均以数组保存, 标的可随委托动态加入.
+    """
+
+    def __init__(self, symbols=(), initial_cash=1000000.0, fees: FeeSchedule = None, lot_size=LOT_SIZE):
+        """
+        :param symbols: 初始标的列表
+        :param initial_cash: 初始资金
+        :param fees: 费用规则, 默认 FeeSchedule()
+        :param lot_size: 每手股数
+        """
+        self.fees = fees or FeeSchedule()
+        self.lot_size = lot_size
+        self.cash = float(initial_cash)
+        self.symbols = []
+        self._symbol_index = {}
+        self.positions = np.zeros(0)
+        self.sellable = np.zeros(0)
+        # 持仓总成本(含费用), 用于计算已实现盈亏
+        self.cost = np.zeros(0)
+        self.ratios = np.zeros(0)
+        self.realized_pnl = 0.0
+        self.index(symbols)
+
+    def index(self, symbols):
+        """
+        标的在内部数组中的下标, 未出现过的标的会被加入
+        :return: numpy int 数组
+        """
+        new = [s for s in dict.fromkeys(symbols) if s not in self._symbol_index]
+        if new:
+            for s in new:
+                self._symbol_index[s] = len(self.symbols)
+                self.symbols.append(s)
+            pad = np.zeros(len(new))
+            self.positions = np.concatenate([self.positions, pad])
+            self.sellable = np.concatenate([self.sellable, pad])
+            self.cost = np.concatenate([self.cost, pad])
+            self.ratios = np.concatenate([self.ratios, [limit_ratio(s) for s in new]])
+        return np.array([self._symbol_index[s] for s in symbols], dtype=np.int64)
+
+    def next_day(self):
+        """进入新交易日, 昨日买入的股票变为可卖"""
+        self.sellable = self.positions.copy()
+
+    def market_value(self, price):
+        """
+        :param price: 按 symbols 对齐的估值价, NaN 的标的不计市值
+        """
+        return float(np.nansum(self.positions * price))
+
+    def match(self, amounts, open_, high, low, pre_close, limit_price=None, volume=None) -> MatchResult:
+        """
+        撮合一根K线上的全部委托, 所有参数均为按 symbols 对齐的数组
+        :param amounts: 委托股数, 正数买入负数卖出, 0 或 NaN 表示无委托
+        :param open_: 开盘价, 市价单以此成交
+        :param high: 最高价
+        :param low: 最低价
+        :param pre_close: 昨收价, 用于计算涨跌停价, NaN 表示不限制
+        :param limit_price: 限价, None 或 NaN 表示市价单
+        :param volume: 成交量, 为 0 视为停牌
+        :return: MatchResult
+        """
+        n = len(self.symbols)
+        amounts = np.nan_to_num(np.asarray(amounts, dtype=np.float64))
+        limit_price = np.full(n, np.nan) if limit_price is None else np.asarray(limit_price, dtype=np.float64)
+        status = np.zeros(n, dtype=np.int8)
+        filled = np.zeros(n)
+        price = np.full(n, np.nan)
+
+        order = amounts != 0
+        halted = np.isnan(open_) | np.isnan(high) | np.isnan(low)
+        if volume is not None:
+            halted |= ~(np.asarray(volume) > 0)
+        status[order & halted] = STATUS_SUSPENDED
+        active = order & ~halted
+        buy = active & (amounts > 0)
+        sell = active & (amounts < 0)
+
+        upper, lower = limit_prices(pre_close, self.ratios)
+        eps = 1e-6
+        with np.errstate(invalid='ignore'):
+            # 整根K线都在涨停价(一字板或开盘即封死)时排队买不到, 跌停同理
+            sealed_up = buy & (low >= upper - eps)
+            sealed_down = sell & (high <= lower + eps)
+            has_limit = ~np.isnan(limit_price)
+            miss = (buy & has_limit & (limit_price < low)) | (sell & has_limit & (limit_price > high))
+        status[sealed_up | sealed_down] = STATUS_LIMIT
+        status[miss & (status == STATUS_NONE)] = STATUS_PRICE
+        buy &= status == STATUS_NONE
+        sell &= status == STATUS_NONE
+
+        # 限价单按 开盘价 与 限价 中对自己不利者成交, 且不超出涨跌停价
+        fill_price = np.where(has_limit, np.where(buy, np.fmin(limit_price, open_), np.fmax(limit_price, open_)), open_)
+        fill_price = np.where(np.isnan(upper), fill_price, np.clip(fill_price, lower, upper))
+
+        # 卖出: 不超过可卖数量, 非清仓时按整手
+        want = -amounts
+        qty = np.where(sell, np.minimum(want, self.sellable), 0.0)
+        odd = qty < self.positions
+        qty = np.where(odd, np.floor(qty / self.lot_size) * self.lot_size, qty)
+        status[sell & (self.sellable <= 0)] = STATUS_T1
+        status[sell & (self.sellable > 0) & (qty <= 0)] = STATUS_LOT
+        sold = sell & (qty > 0)
+        status[sold] = np.where(qty[sold] < want[sold], STATUS_PARTIAL, STATUS_FILLED)
+        sell_value = np.where(sold, qty * fill_price, 0.0)
+        sell_fees = self.fees.calculate(sell_value, True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sold_cost = np.where(sold, self.cost * qty / self.positions, 0.0)
+        self.realized_pnl += float(np.sum(sell_value - sell_fees - sold_cost))
+        self.cash += float(np.sum(sell_value - sell_fees))
+        self.positions -= np.where(sold, qty, 0.0)
+        self.sellable -= np.where(sold, qty, 0.0)
+        self.cost -= sold_cost
+        filled -= np.where(sold, qty, 0.0)
+
+        # 买入: 整手, 资金不足时按比例缩减
+        lots = np.where(buy, np.floor(amounts / self.lot_size), 0.0)
+        status[buy & (lots <= 0)] = STATUS_LOT
+        buy &= lots > 0
+        lots = self._fit_cash(np.where(buy, lots, 0.0), fill_price)
+        bought = buy & (lots > 0)
+        status[buy & ~bought] = STATUS_CASH
+        qty = lots * self.lot_size
+        status[bought] = np.where(qty[bought] < np.floor(amounts[bought] / self.lot_size) * self.lot_size,
+                                  STATUS_PARTIAL, STATUS_FILLED)
+        buy_value = np.where(bought, qty * fill_price, 0.0)
+        buy_fees = self.fees.calculate(buy_value, False)
+        self.cash -= float(np.sum(buy_value + buy_fees))
+        self.positions += np.where(bought, qty, 0.0)
+        self.cost += buy_value + buy_fees
+        filled += np.where(bought, qty, 0.0)
+
+        traded = sold | bought
+        price[traded] = fill_price[traded]
+        return MatchResult(filled, price, sell_fees + buy_fees, status)
+
+    def _fit_cash(self, lots, price):
+        """资金不足时缩减买单手数, 使 成交金额 + 费用 不超过可用资金"""
+        lot_value = np.where(lots > 0, price * self.lot_size, 0.0)
+
+        def total(l):
+            value = l * lot_value
+            return float(np.sum(value + self.fees.calculate(value, False)))
+
+        need = total(lots)
+        if need <= self.cash:
+            return lots
+        lots = np.floor(lots * max(self.cash, 0.0) / need)
+        # 按比例缩减后费用的最低收费仍可能超支, 逐手去掉金额最大的买单
+        while lots.any() and total(lots) > self.cash:
+            lots[np.argmax(lots * lot_value)] -= 1
+        return lots
+
+
+class MatchingLedger:
+    """
+    以 MatchingEngine 撮合的向量化账本, 接口与 VectorLedger.run_panel 一致
+
+    第 t 根K线给出的目标权重, 在第 t+1 根K线以开盘价按A股规则撮合, 以收盘价计算持仓市值.
+    """
+
+    def __init__(self, initial_cash=1000000.0, fees: FeeSchedule = None, lot_size=LOT_SIZE):
+        self.initial_cash = initial_cash
+        self.fees = fees or FeeSchedule()
+        self.lot_size = lot_size
+
+    @staticmethod
+    def pre_close(times, close):
+        """
+        每根K线对应的昨收价: 上一交易日最后一根K线的收盘价
+        :param times: datetime64 时间轴
+        :param close: (时间 × 标的) 收盘价
+        """
+        from .vector_backtest import forward_fill
+
+        close = forward_fill(close)
+        days = np.asarray(times, dtype='datetime64[D]')
+        prev_last = np.searchsorted(days, days, side='left') - 1
+        pre = close[np.maximum(prev_last, 0)]
+        pre[prev_last < 0] = np.nan
+        return pre
+
+    def run_panel(self, weights, panel):
+        """
+        :param weights: (时间 × 标的) 目标权重, NaN 表示保持原仓位
+        :param panel: BarPanel, 需包含 open / high / low / close
+        :return: dict, positions / trades / cash / equity / fees / status / realized_pnl 数组
+        """
+        from .vector_backtest import forward_fill
+
+        n_times, n_symbols = weights.shape
+        open_, high, low, close = (panel.field(f) for f in ('open', 'high', 'low', 'close'))
+        volume = panel.field('volume') if panel.has_field('volume') else None
+        pre_close = self.pre_close(panel.times, close)
+        mark = forward_fill(close)
+        days = np.asarray(panel.times, dtype='datetime64[D]')
+
+        engine = MatchingEngine(panel.symbols, initial_cash=self.initial_cash, fees=self.fees, lot_size=self.lot_size)
+        out = {
+            'positions': np.zeros((n_times, n_symbols)),
+            'trades': np.zeros((n_times, n_symbols)),
+            'cash': np.zeros(n_times),
+            'equity': np.zeros(n_times),
+            'fees': np.zeros(n_times),
+            'status': np.zeros((n_times, n_symbols), dtype=np.int8),
+            'realized_pnl': np.zeros(n_times),
+        }
+        for t in range(n_times):
+            if t > 0 and days[t] != days[t - 1]:
+                engine.next_day()
+            if t > 0:
+                target_w = weights[t - 1]
+                ref = np.where(np.isnan(open_[t]), mark[t - 1], open_[t])
+                value = engine.cash + np.nansum(engine.positions * ref)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    target = target_w * value / ref
+                amounts = np.where(np.isnan(target_w) | np.isnan(target), 0.0, target - engine.positions)
+                result = engine.match(amounts, open_[t], high[t], low[t], pre_close[t],
+                                      volume=None if volume is None else volume[t])
+                out['trades'][t] = result.filled
+                out['fees'][t] = result.fees.sum()
+                out['status'][t] = result.status
+            out['positions'][t] = engine.positions
+            out['cash'][t] = engine.cash
+            out['equity'][t] = engine.cash + engine.market_value(mark[t])
+            out['realized_pnl'][t] = engine.realized_pnl
+        return out
+
+
+class MatchingTrader:
+    """
+    事件驱动回测用的模拟券商, 可替代 MockTrader
+
+    buy / sell 只登记委托, 回测引擎在下一根K线到来时调用 match, 当根全部委托由 MatchingEngine 一次撮合.
+    """
+
+    def __init__(self, initial_cash=1000000.0, fees: FeeSchedule = None, lot_size=LOT_SIZE):
+        self.engine = MatchingEngine(initial_cash=initial_cash, fees=fees, lot_size=lot_size)
+        self.initial_cash = initial_cash
+        self.quotation = None
+        self.current_dt = None
+        self.last_price = {}
+        # 待撮合委托: 标的 -> [股数, 限价]
+        self.pending = {}
+        self.entrusts = []
+        self.deals = []
+        self._entrust_no = 0
+
+    def set_quotation(self, quotation):
+        self.quotation = quotation
+
+    def set_time(self, dt: datetime.datetime):
+        if self.current_dt is not None and dt.date() != self.current_dt.date():
+            self.engine.next_day()
+            self.entrusts = []
+            self.deals = []
+        self.current_dt = dt
+
+    def _order(self, security, price, amount, volume, sign, entrust_prop):
+        if not amount and volume:
+            ref = price or self.last_price.get(security)
+            amount = int(volume / ref) if ref else 0
+        self._entrust_no += 1
+        pending = self.pending.setdefault(security, [0.0, np.nan])
+        pending[0] += sign * amount
+        if price:
+            pending[1] = price
+        entrust = {'entrust_no': self._entrust_no, 'stock_code': security, 'entrust_amount': amount,
+                   'entrust_price': price, 'entrust_bs': '买入' if sign > 0 else '卖出',
+                   'entrust_status': '已报', 'entrust_prop': entrust_prop, 'report_time': self.current_dt}
+        self.entrusts.append(entrust)
+        return entrust
+
+    def buy(self, security, price=0, amount=0, volume=0, entrust_prop=0):
+        return self._order(security, price, amount, volume, 1, entrust_prop)
+
+    def sell(self, security, price=0, amount=0, volume=0, entrust_prop=0):
+        return self._order(security, price, amount, volume, -1, entrust_prop)
+
+    def match(self, bars):
+        """
+        以当根K线撮合此前登记的全部委托
+        :param bars: {标的: DataFrame}, 最后一行为当根K线, 需包含 open / high / low / close
+        :return: MatchResult, 无委托时为 None
+        """
+        symbols = list(bars)
+        idx = self.engine.index(symbols)
+        n = len(self.engine.symbols)
+        fields = {f: np.full(n, np.nan) for f in ('open', 'high', 'low', 'close', 'pre_close', 'volume')}
+        for i, symbol in zip(idx, symbols):
+            df = bars[symbol]
+            if df is None or len(df) == 0:
+                continue
+            last = df.iloc[-1]
+            for f in ('open', 'high', 'low', 'close'):
+                fields[f][i] = last[f]
+            fields['volume'][i] = last['volume'] if 'volume' in df.columns else 1.0
+            fields['pre_close'][i] = self._pre_close(df)
+            self.last_price[symbol] = last['close']
+
+        if not self.pending:
+            return None
+        order_idx = self.engine.index(list(self.pending))
+        amounts = np.zeros(n)
+        limit_price = np.full(n, np.nan)
+        for i, (amount, price) in zip(order_idx, self.pending.values()):
+            amounts[i] = amount
+            limit_price[i] = price
+        self.pending = {}
+
+        result = self.engine.match(amounts, fields['open'], fields['high'], fields['low'], fields['pre_close'],
+                                   limit_price=limit_price, volume=fields['volume'])
+        for i in np.flatnonzero(result.filled):
+            self.deals.append({'stock_code': self.engine.symbols[i], 'business_amount': abs(result.filled[i]),
+                               'business_price': result.price[i], 'fee': result.fees[i],
+                               'entrust_bs': '买入' if result.filled[i] > 0 else '卖出',
+                               'business_time': self.current_dt})
+        return result
+
+    @staticmethod
+    def _pre_close(df):
+        """上一交易日收盘价: 日内K线取前一交易日最后一根, 日线取前一根"""
+        index = df.index if 'date' not in df.columns else df['date']
+        days = np.asarray(index, dtype='datetime64[D]')
+        i = np.searchsorted(days, days[-1], side='left') - 1
+        return df['close'].iloc[i] if i >= 0 else np.nan
+
+    def _price(self):
+        return np.array([self.last_price.get(s, np.nan) for s in self.engine.symbols])
+
+    def update_balance(self, quotation_data=None):
+        if quotation_data:
+            for symbol, df in quotation_data.items():
+                if df is not None and len(df):
+                    self.last_price[symbol] = df['close'].iloc[-1]
+
+    def get_balance(self):
+        market_value = self.engine.market_value(self._price())
+        return [{'money_type': '人民币', 'current_balance': self.engine.cash, 'enable_balance': self.engine.cash,
+                 'market_value': market_value, 'asset_balance': self.engine.cash + market_value}]
+
+    def get_position(self):
+        positions = []
+        price = self._price()
+        for i in np.flatnonzero(self.engine.positions):
+            amount = self.engine.positions[i]
+            positions.append({'stock_code': self.engine.symbols[i], 'current_amount': amount,
+                              'enable_amount': self.engine.sellable[i],
+                              'cost_price': self.engine.cost[i] / amount, 'last_price': price[i],
+                              'market_value': amount * price[i],
+                              'income_balance': amount * price[i] - self.engine.cost[i]})
+        return positions
+
+    def get_entrust(self):
+        return self.entrusts
+
+    def get_current_deal(self):
+        return self.deals
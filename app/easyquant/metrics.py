@@ -0,0 +1,305 @@
+# coding: utf-8
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 进程内运行指标, 不依赖第三方库
+# Counter / Gauge / Histogram 注册到 Registry, 由 start_http_server 以 Prometheus 文本格式在本地提供:
+#   curl http://127.0.0.1:9108/metrics
+# 指标按名称取已有实例, 策略重载或重复创建服务对象时不会重复注册.
+
+# 默认的耗时分桶(秒), 覆盖本地处理到行情 / 交易接口请求的范围
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in pairs)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Child:
+    """一组标签值对应的单个序列"""
+
+    __slots__ = ('_lock', '_value', '_function')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0.0
+        self._function = None
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def set_function(self, func):
+        """
+        采集时调用 func 取值, 用于队列长度、已有统计等由别处维护的数值
+        """
+        self._function = func
+
+    def get(self):
+        if self._function is not None:
+            return float(self._function())
+        with self._lock:
+            return self._value
+
+
+class _CounterChild(_Child):
+    __slots__ = ()
+
+    def inc(self, amount=1):
+        if amount < 0:
+            raise ValueError('Counter 只能增加')
+        super().inc(amount)
+
+
+class _GaugeChild(_Child):
+    __slots__ = ()
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self._lock:
+            self._value = float(value)
+
+
+class _HistogramChild:
+    __slots__ = ('_lock', '_upper_bounds', '_counts', '_sum', '_count')
+
+    def __init__(self, upper_bounds):
+        self._lock = threading.Lock()
+        self._upper_bounds = upper_bounds
+        # 各桶单独计数, 输出时再累加
+        self._counts = [0] * (len(upper_bounds) + 1)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._upper_bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    @contextmanager
+    def time(self):
+        """记录 with 块的耗时(秒)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def get(self):
+        """
+        :return: ([(上界, 累计个数)], 总和, 总个数)
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        buckets = []
+        cumulative = 0
+        for bound, n in zip(list(self._upper_bounds) + [float('inf')], counts):
+            cumulative += n
+            buckets.append((bound, cumulative))
+        return buckets, total, count
+
+
+class _Metric:
+    """指标基类, 带标签时通过 labels() 取得对应序列, 不带标签时可直接在指标上操作"""
+
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        if len(values) != len(self.labelnames):
+            raise ValueError('%s 需要标签 %s' % (self.name, self.labelnames))
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def remove(self, *values):
+        with self._lock:
+            self._children.pop(tuple(str(v) for v in values), None)
+
+    def __getattr__(self, item):
+        # 不带标签的指标直接转发到唯一的序列, 如 counter.inc()
+        if item.startswith('_'):
+            raise AttributeError(item)
+        if self.labelnames:
+            raise AttributeError('%s 带有标签 %s, 需先调用 labels()' % (self.name, self.labelnames))
+        return getattr(self._default, item)
+
+    def _items(self):
+        with self._lock:
+            return list(self._children.items())
+
+    def samples(self):
+        """
+        :return: [(名称后缀, 标签字符串, 值)]
+        """
+        result = []
+        for values, child in self._items():
+            try:
+                value = child.get()
+            except Exception:
+                # 取值函数出错时跳过该序列, 不影响其他指标
+                continue
+            result.append(('', _format_labels(self.labelnames, values), value))
+        return result
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class Gauge(_Metric):
+    type_name = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.upper_bounds = tuple(sorted(float(b) for b in buckets if b != float('inf')))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.upper_bounds)
+
+    def samples(self):
+        result = []
+        for values, child in self._items():
+            buckets, total, count = child.get()
+            for bound, cumulative in buckets:
+                result.append(('_bucket', _format_labels(self.labelnames, values, [('le', _format_value(bound))]),
+                               cumulative))
+            labels = _format_labels(self.labelnames, values)
+            result.append(('_sum', labels, total))
+            result.append(('_count', labels, count))
+        return result
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, documentation, labelnames, **kwargs)
+                self._metrics[name] = metric
+            elif type(metric) is not cls or metric.labelnames != tuple(labelnames):
+                raise ValueError('指标 %s 已注册为不同的类型或标签' % name)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def unregister(self, name):
+        with self._lock:
+            self._metrics.pop(name, None)
+
+    def expose(self):
+        """
+        :return: Prometheus 文本格式
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation.replace('\n', ' ')))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type_name))
+            for suffix, labels, value in metric.samples():
+                lines.append('%s%s%s %s' % (metric.name, suffix, labels, _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+# 进程内共用的注册表
+REGISTRY = Registry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.expose().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 抓取请求频繁, 不输出访问日志
+        pass
+
+
+def start_http_server(port=9108, addr='127.0.0.1', registry=REGISTRY):
+    """
+    在后台线程中提供 /metrics
+    :param port: 端口, 0 为随机端口
+    :param addr: 监听地址, 默认只允许本机访问
+    :return: HTTPServer, server_address 为实际监听的地址, shutdown() 停止
+    """
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True)
+    thread.start()
+    return server
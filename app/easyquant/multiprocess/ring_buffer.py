@@ -0,0 +1,255 @@
+# coding: utf-8
+import pickle
+import threading
+import time
+from collections import deque
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from ..event_engine import Event
+
+# 最多同时挂载的读进程数
+MAX_READERS = 64
+# 记录按 64 字节对齐
+_ALIGN = 64
+# 控制区: [容量, 最新序号, 读进程已处理序号 × MAX_READERS, 读进程是否在用 × MAX_READERS]
+_CTRL_WORDS = 2 + 2 * MAX_READERS
+_DATA_OFFSET = (_CTRL_WORDS * 8 + _ALIGN - 1) // _ALIGN * _ALIGN
+# 记录头: [序号, 元信息长度, 时间戳字节数, 数值字节数]
+_RECORD_HEADER = 4 * 8
+
+
+def _align(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class RingBufferFull(Exception):
+    """读进程未及时处理, 环形缓冲区没有足够空间"""
+
+
+def _unsupported_columns(df: DataFrame):
+    """环形缓冲区只保存数值列, date 列与时间索引相同, 不单独保存, 其余列无法写入"""
+    return [c for c in df.columns if c != 'date' and not pd.api.types.is_numeric_dtype(df[c])]
+
+
+def is_bar_data(data):
+    """
+    是否为可写入环形缓冲区的K线数据: {标的: 以时间为索引、除 date 外都是数值列的 DataFrame}
+    含字符串等其它列的数据不写入, 由调用方以队列传递完整事件
+    """
+    return isinstance(data, dict) and len(data) > 0 and \
+        all(isinstance(df, DataFrame) and isinstance(df.index, pd.DatetimeIndex) and not _unsupported_columns(df)
+            for df in data.values())
+
+
+class RingBuffer:
+    """
+    共享内存环形缓冲区
+
+    一个写进程、多个读进程. 写进程把一根K线全部标的的数据按列式布局写入一次,
+    只通过队列把 (序号, 偏移) 发给各读进程, 读进程在共享内存上直接构造 numpy 视图, 不做反序列化和拷贝.
+    只保存时间索引和数值列, 数值列读出为 float64; date 列不保存, 读出的 DataFrame 以索引(名为 date)表示时间.
+    读进程处理完后回写已处理序号, 写进程据此回收空间; 空间不足时等待, 超时抛出 RingBufferFull.
+    """
+
+    def __init__(self, name=None, size=64 * 1024 * 1024, create=True):
+        """
+        :param name: 共享内存名称, 创建时为 None 则自动生成
+        :param size: 数据区字节数
+        :param create: True 创建, False 挂载已有的缓冲区
+        """
+        if create:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=_DATA_OFFSET + size)
+        else:
+            # 读进程为写进程的子进程, 与写进程共用 resource_tracker, 由写进程负责回收
+            self.shm = shared_memory.SharedMemory(name=name, create=False)
+        self.owner = create
+        self.ctrl = np.ndarray((_CTRL_WORDS,), dtype=np.int64, buffer=self.shm.buf)
+        if create:
+            self.ctrl[:] = 0
+            self.ctrl[0] = size
+        self.capacity = int(self.ctrl[0])
+        self.lock = threading.RLock()
+        # 写进程记录的未回收记录: (序号, 起始, 结束)
+        self._live = deque()
+        self._write_pos = 0
+        self._last = None
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def seq(self):
+        return int(self.ctrl[1])
+
+    # ---------- 读进程登记 ----------
+
+    def register_reader(self):
+        """
+        登记一个读进程, 在写进程中调用
+        :return: 读进程编号, 传给读进程的 read / ack
+        """
+        with self.lock:
+            active = self.ctrl[2 + MAX_READERS:]
+            free = np.flatnonzero(active == 0)
+            if not len(free):
+                raise RuntimeError('读进程数超过 %d' % MAX_READERS)
+            reader = int(free[0])
+            self.ctrl[2 + reader] = self.seq
+            active[reader] = 1
+            return reader
+
+    def unregister_reader(self, reader):
+        self.ctrl[2 + MAX_READERS + reader] = 0
+
+    def ack(self, reader, seq):
+        """读进程处理完 seq 及之前的记录"""
+        self.ctrl[2 + reader] = seq
+
+    def _min_acked(self):
+        active = self.ctrl[2 + MAX_READERS:] != 0
+        if not active.any():
+            return self.seq
+        return int(self.ctrl[2:2 + MAX_READERS][active].min())
+
+    # ---------- 写 ----------
+
+    def _reclaim(self):
+        acked = self._min_acked()
+        while self._live and self._live[0][0] <= acked:
+            self._live.popleft()
+        if not self._live:
+            self._write_pos = 0
+
+    def _allocate(self, need):
+        if need > self.capacity:
+            raise RingBufferFull('单条记录 %d 字节超过缓冲区容量 %d' % (need, self.capacity))
+        self._reclaim()
+        if not self._live:
+            return 0
+        head, tail = self._live[0][1], self._write_pos
+        if tail >= head:
+            if tail + need <= self.capacity:
+                return tail
+            if need < head:
+                return 0
+        elif tail + need < head:
+            return tail
+        return None
+
+    def write_bars(self, event_type, bars, attrs=None, event_class=Event, timeout=5.0):
+        """
+        写入一根K线的全部标的
+        :param bars: {标的: 以时间为索引的 DataFrame}, 除 date 外含非数值列时抛出 ValueError
+        :param attrs: 随事件传递的其它属性, 如 BarEvent 的 bar_dt
+        :param event_class: 读出时构造的事件类型
+        :param timeout: 空间不足时最长等待秒数
+        :return: (序号, 偏移)
+        """
+        symbols = list(bars)
+        columns = []
+        for symbol, df in bars.items():
+            unsupported = _unsupported_columns(df)
+            if unsupported:
+                raise ValueError('标的 %s 的列 %s 不是数值类型, 无法写入环形缓冲区' % (symbol, unsupported))
+            for c in df.columns:
+                if c != 'date' and c not in columns:
+                    columns.append(c)
+        rows = [len(df) for df in bars.values()]
+        total = sum(rows)
+        meta = pickle.dumps({'event_type': event_type, 'event_class': event_class, 'symbols': symbols,
+                             'rows': rows, 'columns': columns, 'attrs': attrs or {}})
+        times_offset = _align(_RECORD_HEADER + len(meta))
+        values_offset = _align(times_offset + total * 8)
+        need = _align(values_offset + total * len(columns) * 8)
+
+        with self.lock:
+            deadline = time.monotonic() + timeout
+            offset = self._allocate(need)
+            while offset is None:
+                if time.monotonic() > deadline:
+                    raise RingBufferFull('读进程处理过慢, 缓冲区已满')
+                time.sleep(0.001)
+                offset = self._allocate(need)
+
+            base = _DATA_OFFSET + offset
+            buf = self.shm.buf
+            seq = self.seq + 1
+            header = np.ndarray((4,), dtype=np.int64, buffer=buf, offset=base)
+            header[:] = (seq, len(meta), total * 8, total * len(columns) * 8)
+            buf[base + _RECORD_HEADER:base + _RECORD_HEADER + len(meta)] = meta
+            times = np.ndarray((total,), dtype=np.int64, buffer=buf, offset=base + times_offset)
+            values = np.ndarray((total, len(columns)), dtype=np.float64, buffer=buf, offset=base + values_offset)
+            row = 0
+            for df, n in zip(bars.values(), rows):
+                times[row:row + n] = df.index.asi8
+                values[row:row + n] = df.reindex(columns=columns).to_numpy(dtype=np.float64)
+                row += n
+
+            self._live.append((seq, offset, offset + need))
+            self._write_pos = offset + need
+            # 数据写完后才发布序号
+            self.ctrl[1] = seq
+            return seq, offset
+
+    def publish(self, event: Event, timeout=5.0):
+        """
+        写入事件, 同一事件对象只写一次, 多个读进程共用同一份数据
+        :return: (序号, 偏移)
+        """
+        with self.lock:
+            last = self._last
+            if last is not None and last[0] is event:
+                return last[1]
+            attrs = {k: v for k, v in vars(event).items() if k not in ('event_type', 'data')}
+            descriptor = self.write_bars(event.event_type, event.data, attrs=attrs, event_class=type(event),
+                                         timeout=timeout)
+            self._last = (event, descriptor)
+            return descriptor
+
+    # ---------- 读 ----------
+
+    def read(self, seq, offset) -> Event:
+        """
+        按描述读取事件, event.data 中的 DataFrame 为共享内存上的只读视图
+        处理完后需调用 ack, 之后写进程可能覆盖该区域, 不应再持有这些 DataFrame
+        """
+        base = _DATA_OFFSET + offset
+        buf = self.shm.buf
+        header = np.ndarray((4,), dtype=np.int64, buffer=buf, offset=base)
+        if int(header[0]) != seq:
+            raise RingBufferFull('记录 %d 已被覆盖' % seq)
+        meta_len, times_bytes, values_bytes = (int(x) for x in header[1:])
+        meta = pickle.loads(bytes(buf[base + _RECORD_HEADER:base + _RECORD_HEADER + meta_len]))
+        total = times_bytes // 8
+        columns = meta['columns']
+        times_offset = _align(_RECORD_HEADER + meta_len)
+        values_offset = _align(times_offset + times_bytes)
+        times = np.ndarray((total,), dtype='datetime64[ns]', buffer=buf, offset=base + times_offset)
+        values = np.ndarray((total, len(columns)), dtype=np.float64, buffer=buf, offset=base + values_offset)
+        times.flags.writeable = False
+        values.flags.writeable = False
+
+        data = {}
+        row = 0
+        for symbol, n in zip(meta['symbols'], meta['rows']):
+            index = pd.DatetimeIndex(times[row:row + n], name='date')
+            data[symbol] = DataFrame(values[row:row + n], index=index, columns=columns, copy=False)
+            row += n
+
+        event = meta['event_class'].__new__(meta['event_class'])
+        event.event_type = meta['event_type']
+        event.data = data
+        for k, v in meta['attrs'].items():
+            setattr(event, k, v)
+        return event
+
+    def close(self):
+        self.ctrl = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
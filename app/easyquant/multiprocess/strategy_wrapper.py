@@ -1,78 +1,279 @@
 import multiprocessing as mp
-from threading import Thread
+import signal
+import sys
+import time
+import traceback
+from threading import Thread, Lock
+
+from .ring_buffer import RingBuffer, RingBufferFull, is_bar_data
+from ..market_bus import MarketBus, SnapshotStore
 
 __author__ = 'keping.chu'
 
+# 策略进程回写的统计项, 存放在共享数组中
+_PROCESSED, _CLOCKS, _ERRORS, _LAST_LAG, _MAX_LAG, _LAST_ACTIVE = range(6)
+_STATS_SIZE = 6
+
 
 class ProcessWrapper(object):
-    def __init__(self, strategy):
+    # 队列容量
+    QUEUE_SIZE = 10000
+
+    def __init__(self, strategy, ring_buffer: RingBuffer = None, max_restarts=5,
+                 snapshot_store: SnapshotStore = None):
         """
         @:param
             strategy 策略
+            ring_buffer 共享内存环形缓冲区, 多个策略进程共用; 传入时K线事件只写入一次,
+                        队列中只传 (序号, 偏移), 策略进程直接读取共享内存
+            max_restarts 策略进程意外退出后最多重启的次数
+            snapshot_store 主进程行情总线的共享内存快照区; 传入时策略进程中的 strategy.market_bus
+                           直接读取主进程拉取的行情快照
         """
         self.__strategy = strategy
+        self.name = strategy.name
+        self.log = strategy.log
+        self.__ring_buffer = ring_buffer
+        self.__reader = ring_buffer.register_reader() if ring_buffer is not None else None
+        self.__ring_name = ring_buffer.name if ring_buffer is not None else None
+        self.__store_name = snapshot_store.name if snapshot_store is not None else None
+        self.max_restarts = max_restarts
+        # 策略进程回写的统计
+        self.__stats = mp.Array('d', _STATS_SIZE)
+        # 主进程侧的统计
+        self.events_sent = 0
+        self.clocks_sent = 0
+        self.dropped = 0
+        self.restarts = 0
+        self.last_exitcode = None
+        self.__stopping = False
+        # 达到最大重启次数后不再重启
+        self.__given_up = False
+        self.__lock = Lock()
+        self.__start()
+
+    def __start(self):
         # 事件队列
-        self.__event_queue = mp.Queue(10000)
+        self.__event_queue = mp.Queue(self.QUEUE_SIZE)
         # 时钟队列
-        self.__clock_queue = mp.Queue(10000)
-        # 包装进程
-        self.__proc = mp.Process(target=self._process)
+        self.__clock_queue = mp.Queue(self.QUEUE_SIZE)
+        # 包装进程, fork 时复制主进程中的策略对象, 重启后策略恢复为初始状态
+        self.__proc = mp.Process(target=self._process, name='strategy-%s' % self.name)
+        self.__proc.daemon = True
         self.__proc.start()
 
-    def stop(self):
+    @property
+    def pid(self):
+        return self.__proc.pid
+
+    def is_alive(self):
+        return self.__proc.is_alive()
+
+    def check(self):
         """
-        停止
+        检查策略进程, 意外退出时重启, 由主引擎的监控线程定期调用
+        :return: 是否进行了重启
         """
-        self.__event_queue.put(0)
-        self.__clock_queue.put(0)
-        self.__proc.join()
+        with self.__lock:
+            if self.__stopping or self.__given_up or self.__proc.is_alive():
+                return False
+            exitcode = self.__proc.exitcode
+            self.last_exitcode = exitcode
+            if self.restarts >= self.max_restarts:
+                self.__given_up = True
+                self.log.error('策略进程 %s 退出(exitcode=%s), 已达最大重启次数 %d, 不再重启'
+                               % (self.name, exitcode, self.max_restarts))
+                return False
+            # 进程可能在持有队列锁时退出, 丢弃旧队列中未处理的事件
+            with self.__stats.get_lock():
+                processed = self.__stats[_PROCESSED] + self.__stats[_CLOCKS]
+            self.dropped = self.events_sent + self.clocks_sent - processed
+            for q in (self.__event_queue, self.__clock_queue):
+                q.cancel_join_thread()
+                q.close()
+            if self.__ring_buffer is not None:
+                # 跳过旧进程未确认的记录, 避免阻塞写进程
+                self.__ring_buffer.ack(self.__reader, self.__ring_buffer.seq)
+            self.restarts += 1
+            self.log.warn('策略进程 %s 退出(exitcode=%s), 第 %d 次重启' % (self.name, exitcode, self.restarts))
+            self.__start()
+            return True
+
+    def stop(self, timeout=30):
+        """
+        停止: 策略进程处理完已推送的事件和时钟后调用策略的 shutdown 并退出
+        :param timeout: 等待排空的最长秒数, 超时则强制终止
+        :return: 是否在超时前正常退出
+        """
+        with self.__lock:
+            self.__stopping = True
+            proc = self.__proc
+            if proc.is_alive():
+                self.__event_queue.put(0)
+                self.__clock_queue.put(0)
+        proc.join(timeout)
+        drained = not proc.is_alive()
+        if not drained:
+            self.log.warn('策略进程 %s 在 %s 秒内未处理完事件, 强制终止' % (self.name, timeout))
+            proc.terminate()
+            proc.join()
+        if self.__ring_buffer is not None:
+            self.__ring_buffer.unregister_reader(self.__reader)
+        return drained
+
+    def metrics(self):
+        """
+        健康与延迟统计
+        :return: dict
+            alive 进程是否存活
+            events_sent / clocks_sent 已推送的事件 / 时钟数
+            events_processed / clocks_processed 策略进程已处理的事件 / 时钟数
+            pending 尚未处理的数量
+            errors 处理异常次数
+            last_lag / max_lag 从推送到处理完成的耗时(秒), 最近一次 / 最大
+            idle 距最近一次处理完成的秒数
+            restarts 重启次数
+        """
+        with self.__stats.get_lock():
+            stats = list(self.__stats)
+        last_active = stats[_LAST_ACTIVE]
+        return {
+            'alive': self.is_alive(),
+            'pid': self.pid,
+            'events_sent': self.events_sent,
+            'clocks_sent': self.clocks_sent,
+            'events_processed': int(stats[_PROCESSED]),
+            'clocks_processed': int(stats[_CLOCKS]),
+            'pending': int(self.events_sent + self.clocks_sent - self.dropped - stats[_PROCESSED] - stats[_CLOCKS]),
+            'dropped': int(self.dropped),
+            'errors': int(stats[_ERRORS]),
+            'last_lag': stats[_LAST_LAG],
+            'max_lag': stats[_MAX_LAG],
+            'idle': time.time() - last_active if last_active else None,
+            'restarts': self.restarts,
+        }
 
     def on_event(self, event):
         """
         推送消息
         """
         # print(event)
-        self.__event_queue.put(event)
+        current_dt = self._current_dt()
+        if self.__ring_buffer is not None and is_bar_data(event.data):
+            try:
+                seq, offset = self.__ring_buffer.publish(event)
+                self._put(self.__event_queue, ('ring', time.time(), current_dt, seq, offset))
+                self.events_sent += 1
+                return
+            except RingBufferFull:
+                # 缓冲区满时退回到队列传递完整事件
+                pass
+        self._put(self.__event_queue, ('event', time.time(), current_dt, event))
+        self.events_sent += 1
 
     def on_clock(self, event):
         """
         推送时钟
         """
-        self.__clock_queue.put(event)
+        self._put(self.__clock_queue, ('clock', time.time(), self._current_dt(), event))
+        self.clocks_sent += 1
+
+    def _current_dt(self):
+        # 主进程的时钟引擎推进的当前时间, 随消息传给策略进程
+        context = getattr(self.__strategy, '_context', None)
+        return getattr(context, 'current_dt', None)
+
+    def _change_dt(self, current_dt):
+        # 策略进程中的 context 是 fork 时的副本, 不会随主进程的时钟推进, 处理消息前同步
+        if current_dt is not None:
+            self.__strategy._context.change_dt(current_dt)
+
+    def _put(self, queue, message):
+        try:
+            queue.put(message)
+        except (ValueError, AssertionError):
+            # 重启策略进程时旧队列已关闭, 事件丢弃
+            pass
+
+    def _record(self, field, sent, error):
+        done = time.time()
+        lag = done - sent
+        with self.__stats.get_lock():
+            self.__stats[field] += 1
+            if error:
+                self.__stats[_ERRORS] += 1
+            self.__stats[_LAST_LAG] = lag
+            if lag > self.__stats[_MAX_LAG]:
+                self.__stats[_MAX_LAG] = lag
+            self.__stats[_LAST_ACTIVE] = done
+
+    def _log_error(self):
+        exc_type, exc_value, exc_traceback = sys.exc_info()
+        self.log.error('策略进程 %s 处理异常: %s' % (
+            self.name, repr(traceback.format_exception(exc_type, exc_value, exc_traceback))))
 
     def _process_event(self):
         """
         处理事件
         """
+        ring_buffer = RingBuffer(self.__ring_name, create=False) if self.__ring_name is not None else None
         while True:
+            message = self.__event_queue.get(block=True)
+            # 退出
+            if message == 0:
+                break
+            error = False
             try:
-                event = self.__event_queue.get(block=True)
-                # 退出
-                if event == 0:
-                    break
-                self.__strategy.run(event)
-            except:
-                pass
+                self._change_dt(message[2])
+                if message[0] == 'ring':
+                    _, _, _, seq, offset = message
+                    try:
+                        self.__strategy.run(ring_buffer.read(seq, offset))
+                    finally:
+                        ring_buffer.ack(self.__reader, seq)
+                else:
+                    self.__strategy.run(message[3])
+            except Exception:
+                error = True
+                self._log_error()
+            self._record(_PROCESSED, message[1], error)
 
     def _process_clock(self):
         """
         处理时间
         """
         while True:
-
+            message = self.__clock_queue.get(block=True)
+            # 退出
+            if message == 0:
+                break
+            error = False
             try:
-                event = self.__clock_queue.get(block=True)
-                # 退出
-                if event == 0:
-                    break
-                self.__strategy.clock(event)
-            except:
-                pass
+                self._change_dt(message[2])
+                self.__strategy.clock(message[3])
+            except Exception:
+                error = True
+                self._log_error()
+            self._record(_CLOCKS, message[1], error)
 
     def _process(self):
         """
         启动进程
         """
+        # 退出信号由主进程统一处理, 再通过队列通知策略进程排空后退出
+        for name in ('SIGINT', 'SIGHUP', 'SIGQUIT'):
+            if hasattr(signal, name):
+                signal.signal(getattr(signal, name), signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        # 策略异常抛出到本进程, 由 _process_event 记录日志并计入 errors 统计
+        self.__strategy.raise_errors = True
+
+        if self.__store_name is not None:
+            # fork 复制的是主进程的总线, 策略进程改为只读挂载快照区
+            self.__strategy.market_bus = MarketBus(log=self.log,
+                                                   store=SnapshotStore(self.__store_name, create=False))
+
         event_thread = Thread(target=self._process_event, name="ProcessWrapper._process_event")
         event_thread.start()
         clock_thread = Thread(target=self._process_clock, name="ProcessWrapper._process_clock")
@@ -80,3 +281,9 @@ class ProcessWrapper(object):
 
         event_thread.join()
         clock_thread.join()
+
+        # 队列已排空, 在策略进程内调用策略的 shutdown
+        try:
+            self.__strategy.shutdown()
+        except Exception:
+            self._log_error()
@@ -0,0 +1,311 @@
+# coding: utf-8
+import argparse
+import datetime
+import json
+import os
+import signal
+import struct
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from easyquant.easydealutils import time as etime
+from easyquant.quotation import Quotation
+
+# 单次 get_bars 最多取的K线数
+MAX_BARS_PER_QUERY = 10000
+
+
+class BarPanel:
+    """
+    对齐后的K线面板
+
+    values 为 (时间 × 标的 × 字段) 的 float64 数组, 所有标的共用同一时间轴, 缺失(停牌)处为 NaN.
+    field() 返回的 (时间 × 标的) 矩阵是 values 的视图.
+    """
+
+    def __init__(self, times, symbols, fields, values):
+        """
+        :param times: datetime64[ns] 时间轴, 升序
+        :param symbols: 标的列表
+        :param fields: 字段列表
+        :param values: (时间 × 标的 × 字段) 数组
+        """
+        self.times = np.asarray(times, dtype='datetime64[ns]')
+        self.symbols = list(symbols)
+        self.fields = list(fields)
+        self.values = values
+        self._symbol_index = {s: i for i, s in enumerate(self.symbols)}
+        self._field_index = {f: i for i, f in enumerate(self.fields)}
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def field(self, name):
+        """
+        :return: (时间 × 标的) 矩阵视图
+        """
+        return self.values[:, :, self._field_index[name]]
+
+    def has_field(self, name):
+        return name in self._field_index
+
+    def symbol_index(self, symbol):
+        return self._symbol_index[symbol]
+
+    def symbol_frame(self, symbol):
+        """以 DataFrame 形式返回单个标的的全部字段, 行为时间"""
+        return pd.DataFrame(self.values[:, self._symbol_index[symbol], :], columns=self.fields,
+                            index=pd.DatetimeIndex(self.times, name='date'))
+
+    def to_frame(self, name):
+        """以 DataFrame 形式返回某个字段, 行为时间, 列为标的"""
+        return pd.DataFrame(self.field(name), index=pd.DatetimeIndex(self.times), columns=self.symbols)
+
+    def save(self, path):
+        """
+        保存为可内存映射的目录, 供其它进程以 open 只读打开
+        :param path: 目录
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'times.npy'), self.times.view(np.int64))
+        np.save(os.path.join(path, 'values.npy'), np.ascontiguousarray(self.values))
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'symbols': self.symbols, 'fields': self.fields}, f)
+        return path
+
+    @classmethod
+    def open(cls, path):
+        """
+        以只读内存映射方式打开 save 保存的面板, 多个进程打开同一文件时共用页缓存
+        :param path: 目录
+        """
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        times = np.load(os.path.join(path, 'times.npy'), mmap_mode='r')
+        values = np.load(os.path.join(path, 'values.npy'), mmap_mode='r')
+        return cls(times.view('datetime64[ns]'), meta['symbols'], meta['fields'], values)
+
+    @classmethod
+    def from_frames(cls, frames, fields):
+        """
+        由各标的的K线拼成面板
+        :param frames: {标的: 以时间为索引的 DataFrame}
+        :param fields: 字段列表
+        """
+        symbols = list(frames)
+        stamps = [pd.DatetimeIndex(df.index).asi8 for df in frames.values() if df is not None and len(df)]
+        times = np.unique(np.concatenate(stamps)) if stamps else np.array([], dtype=np.int64)
+        values = np.full((len(times), len(symbols), len(fields)), np.nan)
+        for j, symbol in enumerate(symbols):
+            df = frames[symbol]
+            if df is None or not len(df):
+                continue
+            rows = np.searchsorted(times, pd.DatetimeIndex(df.index).asi8)
+            values[rows, j, :] = df.reindex(columns=fields).to_numpy(dtype=np.float64)
+        return cls(times.view('datetime64[ns]'), symbols, fields, values)
+
+
+def build_panel_from_store(store, symbols, start=None, end=None, unit='1d',
+                           fields=('open', 'high', 'low', 'close', 'volume')):
+    """
+    直接由本地 BarStore 构建面板, 不访问行情接口
+    :param store: BarStore
+    :param symbols: 标的列表, 需与 store 中的标的代码一致
+    :param start: 起始时间, None 表示不限
+    :param end: 截止时间, None 表示不限
+    :return: BarPanel
+    """
+    frames = {symbol: store.load(symbol, unit, start=start, end=end) for symbol in symbols}
+    return BarPanel.from_frames(frames, list(fields))
+
+
+# 共享内存布局: 8 字节头长度 + json 头 + 对齐填充 + times(int64) + values(float64)
+_HEADER_SIZE = struct.calcsize('<Q')
+_ALIGN = 64
+# 本进程发布的共享内存名称
+_published = set()
+
+
+def _align(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def publish_panel(panel: BarPanel, name=None):
+    """
+    把面板发布到共享内存, 其它进程以 attach_panel(name) 只读挂载, 不拷贝数据
+    发布方需持有返回的 SharedMemory, 用完后调用 close() 和 unlink()
+    :param name: 共享内存名称, None 时自动生成
+    :return: SharedMemory
+    """
+    times = np.ascontiguousarray(panel.times.view(np.int64))
+    values = np.ascontiguousarray(panel.values, dtype=np.float64)
+    header = {'symbols': panel.symbols, 'fields': panel.fields, 'shape': list(values.shape)}
+    header_bytes = json.dumps(header).encode('utf-8')
+    times_offset = _align(_HEADER_SIZE + len(header_bytes))
+    values_offset = _align(times_offset + times.nbytes)
+    header['times_offset'] = times_offset
+    header['values_offset'] = values_offset
+    header_bytes = json.dumps(header).encode('utf-8')
+    # 加入偏移量后头部变长, 重新对齐
+    while _align(_HEADER_SIZE + len(header_bytes)) > times_offset:
+        times_offset += _ALIGN
+        values_offset += _ALIGN
+        header['times_offset'] = times_offset
+        header['values_offset'] = values_offset
+        header_bytes = json.dumps(header).encode('utf-8')
+
+    size = max(values_offset + values.nbytes, 1)
+    shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+    shm.buf[:_HEADER_SIZE] = struct.pack('<Q', len(header_bytes))
+    shm.buf[_HEADER_SIZE:_HEADER_SIZE + len(header_bytes)] = header_bytes
+    np.ndarray(times.shape, dtype=np.int64, buffer=shm.buf, offset=times_offset)[:] = times
+    np.ndarray(values.shape, dtype=np.float64, buffer=shm.buf, offset=values_offset)[:] = values
+    _published.add(shm.name)
+    return shm
+
+
+def attach_panel(name) -> BarPanel:
+    """
+    只读挂载 publish_panel 发布的面板, 返回的数组直接指向共享内存
+    :param name: 共享内存名称
+    :return: BarPanel, 其 shm 属性持有共享内存引用
+    """
+    shm = shared_memory.SharedMemory(name=name, create=False)
+    if shm.name not in _published:
+        try:
+            # 挂载方不负责回收, 避免进程退出时 resource_tracker 删除发布方的共享内存
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+    header_len = struct.unpack('<Q', bytes(shm.buf[:_HEADER_SIZE]))[0]
+    header = json.loads(bytes(shm.buf[_HEADER_SIZE:_HEADER_SIZE + header_len]).decode('utf-8'))
+    shape = tuple(header['shape'])
+    times = np.ndarray((shape[0],), dtype=np.int64, buffer=shm.buf, offset=header['times_offset'])
+    values = np.ndarray(shape, dtype=np.float64, buffer=shm.buf, offset=header['values_offset'])
+    times.flags.writeable = False
+    values.flags.writeable = False
+    panel = BarPanel(times.view('datetime64[ns]'), header['symbols'], header['fields'], values)
+    panel.shm = shm
+    return panel
+
+
+def open_panel(source) -> BarPanel:
+    """
+    按名称挂载共享内存面板, 不存在时按目录以内存映射方式打开
+    :param source: 共享内存名称或 BarPanel.save 保存的目录
+    """
+    if os.path.isdir(source):
+        return BarPanel.open(source)
+    return attach_panel(source)
+
+
+def _bars_per_day(unit):
+    minutes = etime.get_bar_minutes(unit)
+    return 240 // minutes if minutes else 1
+
+
+def load_panel(quotation, symbols, start_date, end_date, unit='1d',
+               fields=('open', 'high', 'low', 'close', 'volume')):
+    """
+    一次性读取回测区间内全部标的的K线并对齐
+    :param quotation: Quotation 行情源
+    :param symbols: 标的列表
+    :param start_date: 开始日期 'YYYY-MM-DD'
+    :param end_date: 结束日期 'YYYY-MM-DD'
+    :param unit: K线周期
+    :param fields: 字段
+    :return: BarPanel
+    """
+    start_dt = datetime.datetime.strptime(start_date, '%Y-%m-%d')
+    end_dt = datetime.datetime.strptime(end_date, '%Y-%m-%d') + datetime.timedelta(hours=15)
+    trade_dates = etime.get_trade_calendar().trade_dates_between(start_dt, end_dt)
+    count = min(max(len(trade_dates), 1) * _bars_per_day(unit), MAX_BARS_PER_QUERY)
+
+    frames = {}
+    for symbol in symbols:
+        parts = []
+        cursor = end_dt
+        # 单次查询取不完时, 从区间末尾向前分段读取
+        while cursor >= start_dt:
+            df = quotation.get_bars(symbol, count, unit=unit, fields=['date'] + list(fields), end_dt=cursor)
+            if df is None or not len(df):
+                break
+            df = df[df.index >= start_dt]
+            if not len(df):
+                break
+            parts.append(df)
+            first = df.index[0].to_pydatetime()
+            if first <= start_dt or len(df) < count:
+                break
+            cursor = first - datetime.timedelta(seconds=1)
+        if parts:
+            df = pd.concat(parts[::-1])
+            frames[symbol] = df[~df.index.duplicated(keep='last')]
+        else:
+            frames[symbol] = None
+    return BarPanel.from_frames(frames, list(fields))
+
+
+class PanelQuotation(Quotation):
+    """
+    以 BarPanel 为数据源的离线行情, 用于参数寻优等不联网的场景
+    """
+
+    def __init__(self, panel: BarPanel):
+        self.panel = panel
+
+    def get_bars(self, security, count, unit='1d',
+                 fields=['date', 'open', 'high', 'low', 'close', 'volume'],
+                 include_now=False, end_dt=None) -> DataFrame:
+        j = self.panel.symbol_index(security)
+        hi = len(self.panel.times) if end_dt is None else \
+            np.searchsorted(self.panel.times, np.datetime64(pd.Timestamp(end_dt)), side='right')
+        lo = max(hi - count, 0)
+        return DataFrame(self.panel.values[lo:hi, j, :], columns=self.panel.fields,
+                         index=pd.DatetimeIndex(self.panel.times[lo:hi], name='date'))
+
+
+def main():
+    """
+    由本地 BarStore 构建面板并发布到共享内存, 进程保持运行直到收到退出信号
+    python -m easyquant.panel --store data/bars/jqdata --symbols 000001.XSHE 600000.XSHG --name easyquant_1d
+    """
+    from easyquant.bar_store import BarStore
+
+    parser = argparse.ArgumentParser(description='发布共享内存K线面板')
+    parser.add_argument('--store', default=os.path.join('data', 'bars', 'jqdata'), help='BarStore 目录')
+    parser.add_argument('--unit', default='1d', help='K线周期')
+    parser.add_argument('--symbols', nargs='*', help='标的列表, 默认为 store 中该周期的全部标的')
+    parser.add_argument('--start', default=None, help='起始日期')
+    parser.add_argument('--end', default=None, help='截止日期')
+    parser.add_argument('--name', default='easyquant_panel', help='共享内存名称')
+    parser.add_argument('--save', default=None, help='同时保存为内存映射目录')
+    args = parser.parse_args()
+
+    store = BarStore(args.store)
+    symbols = args.symbols or store.symbols(args.unit)
+    panel = build_panel_from_store(store, symbols, start=args.start, end=args.end, unit=args.unit)
+    if args.save:
+        panel.save(args.save)
+    shm = publish_panel(panel, name=args.name)
+    print('已发布面板 %s: %s 根K线 × %s 个标的 × %s 个字段' % ((args.name,) + panel.shape))
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    try:
+        while True:
+            time.sleep(1)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+# coding: utf-8
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class _NullProfiler:
+    """未启用剖析时使用, 所有操作均为空操作"""
+
+    enabled = False
+
+    @contextmanager
+    def phase(self, name):
+        yield
+
+    def bar(self, dt):
+        pass
+
+
+NULL_PROFILER = _NullProfiler()
+_active = NULL_PROFILER
+
+
+def get_profiler():
+    """当前线程生效的剖析器, 未启用时返回空操作的 NULL_PROFILER"""
+    profiler = _active
+    if profiler.enabled and profiler.thread_id != threading.get_ident():
+        return NULL_PROFILER
+    return profiler
+
+
+class PhaseStat:
+    __slots__ = ('count', 'total', 'self_time', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.self_time = 0
+        self.max = 0
+
+
+class Profiler:
+    """
+    回测耗时剖析
+
+    以 phase 嵌套计时, 按调用栈累计自身耗时(folded stacks, 可直接用 flamegraph.pl / speedscope 打开),
+    并按阶段汇总调用次数、总耗时、自身耗时和最大耗时; bar 标记每根模拟K线, 用于统计每根K线各阶段耗时.
+    activate 之后, 同一线程中 get_profiler() 返回该剖析器, 行情源、Context 等模块据此打点.
+    """
+
+    enabled = True
+
+    def __init__(self, clock=time.perf_counter_ns):
+        """
+        :param clock: 返回纳秒整数的时钟
+        """
+        self.clock = clock
+        self.thread_id = threading.get_ident()
+        self._stack = []
+        # 调用栈 'a;b;c' -> 自身耗时(ns)
+        self.folded = defaultdict(int)
+        self.stats = defaultdict(PhaseStat)
+        # 每根K线各阶段总耗时: [(时间, {阶段: ns})]
+        self.bars = []
+        self._bar_totals = None
+        self.started = None
+        self.elapsed = 0
+
+    def activate(self):
+        global _active
+        self.thread_id = threading.get_ident()
+        self.started = self.clock()
+        _active = self
+        return self
+
+    def deactivate(self):
+        global _active
+        if _active is self:
+            _active = NULL_PROFILER
+        if self.started is not None:
+            self.elapsed += self.clock() - self.started
+            self.started = None
+
+    def __enter__(self):
+        return self.activate()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.deactivate()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        计时一个阶段, 可嵌套
+        :param name: 阶段名称, 如 'fetch', 'strategy.on_bar', 'talib.RSI'
+        """
+        frame = [name, 0]  # [名称, 子阶段耗时]
+        self._stack.append(frame)
+        begin = self.clock()
+        try:
+            yield
+        finally:
+            spent = self.clock() - begin
+            self._stack.pop()
+            stack = ';'.join(f[0] for f in self._stack)
+            self.folded[stack + ';' + name if stack else name] += spent - frame[1]
+            stat = self.stats[name]
+            stat.count += 1
+            stat.total += spent
+            stat.self_time += spent - frame[1]
+            stat.max = max(stat.max, spent)
+            if self._stack:
+                self._stack[-1][1] += spent
+            elif self._bar_totals is not None:
+                self._bar_totals[name] += spent
+
+    def bar(self, dt):
+        """标记一根新的模拟K线"""
+        self._bar_totals = defaultdict(int)
+        self.bars.append((dt, self._bar_totals))
+
+    def summary(self):
+        """
+        各阶段汇总, 按自身耗时降序
+        :return: [(阶段, 次数, 总耗时秒, 自身耗时秒, 平均毫秒, 最大毫秒, 自身耗时占比)]
+        """
+        total = sum(s.self_time for s in self.stats.values()) or 1
+        rows = []
+        for name, s in sorted(self.stats.items(), key=lambda item: -item[1].self_time):
+            rows.append((name, s.count, s.total / 1e9, s.self_time / 1e9,
+                         s.total / s.count / 1e6, s.max / 1e6, s.self_time / total))
+        return rows
+
+    def format_summary(self):
+        lines = ['%-40s %10s %10s %10s %10s %10s %7s' % ('phase', 'calls', 'total(s)', 'self(s)', 'avg(ms)',
+                                                         'max(ms)', 'self%')]
+        for name, count, total, self_time, avg, max_ms, ratio in self.summary():
+            lines.append('%-40s %10d %10.3f %10.3f %10.3f %10.3f %6.1f%%' % (name, count, total, self_time, avg,
+                                                                              max_ms, ratio * 100))
+        if self.bars:
+            per_bar = sum(sum(totals.values()) for _, totals in self.bars) / len(self.bars)
+            lines.append('bars: %d, avg %.3f ms/bar' % (len(self.bars), per_bar / 1e6))
+        if self.elapsed:
+            lines.append('wall: %.3f s' % (self.elapsed / 1e9))
+        return '\n'.join(lines)
+
+    def write_folded(self, path):
+        """
+        写出 folded stacks, 每行 '阶段;子阶段 微秒数'
+        flamegraph.pl profile.folded > profile.svg
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, ns in sorted(self.folded.items()):
+                f.write('%s %d\n' % (stack.replace(' ', '_'), ns // 1000))
+        return path
+
+    def write_bars(self, path):
+        """写出每根K线各阶段耗时(毫秒), csv 格式"""
+        names = sorted({name for _, totals in self.bars for name in totals})
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(','.join(['dt'] + names) + '\n')
+            for dt, totals in self.bars:
+                f.write(','.join([str(dt)] + ['%.3f' % (totals.get(n, 0) / 1e6) for n in names]) + '\n')
+        return path
+
+    def report(self, prefix):
+        """
+        写出 <prefix>.folded / <prefix>.bars.csv / <prefix>.txt
+        :return: 汇总表文本
+        """
+        text = self.format_summary()
+        self.write_folded(prefix + '.folded')
+        self.write_bars(prefix + '.bars.csv')
+        with open(prefix + '.txt', 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        return text
@@ -12,6 +12,9 @@ import time
 from ..context import Context
 from ..easydealutils import time as etime
 from ..event_engine import Event, EventEngine
+from ..metrics import REGISTRY
+
+CLOCK_TICK_SECONDS = REGISTRY.histogram('easyquant_clock_tick_seconds', '时钟引擎每次 tick 处理全部时钟的耗时(秒)')
 
 
 class Clock:
@@ -86,10 +89,7 @@ class ClockMomentHandler:
         self.is_trading_date = is_trading_date
         self.makeup = makeup
         self.call = call or (lambda: None)
-        self.next_time = datetime.datetime.combine(
-            self.clock_engine.now_dt.date(),
-            self.moment,
-        )
+        self.next_time = self._combine(self.clock_engine.now_dt.date())
 
         if not self.makeup and self.is_active():
             self.update_next_time()
@@ -105,10 +105,16 @@ class ClockMomentHandler:
             else:
                 next_date = self.next_time.date() + datetime.timedelta(days=1)
 
-            self.next_time = datetime.datetime.combine(
-                next_date,
-                self.moment
-            )
+            self.next_time = self._combine(next_date)
+
+    def _combine(self, date):
+        """
+        date 当天的触发时间, moment 带时区时换算为本地时间并去掉时区, 与不带时区的 now_dt 及其它时刻时钟比较
+        """
+        moment_dt = datetime.datetime.combine(date, self.moment)
+        if moment_dt.tzinfo is not None:
+            moment_dt = moment_dt.astimezone().replace(tzinfo=None)
+        return moment_dt
 
     def is_active(self):
         if self.is_trading_date and not etime.is_trade_date(self.clock_engine.now_dt):
@@ -198,7 +204,8 @@ class ClockEngine:
     def tock(self):
         # if not etime.is_trade_date(self.now_dt):
         #     return  # 假日暂停时钟引擎
-        self._tock()
+        with CLOCK_TICK_SECONDS.time():
+            self._tock()
 
     def _tock(self):
 
@@ -1,24 +1,44 @@
 # coding: utf-8
 import datetime
 import time
+import traceback
 from threading import Thread
 
-from ..event_engine import EventEngine, Event
+from ..easydealutils import time as etime
+from ..event_engine import EventEngine, BarEvent
+from ..market_bus import MarketBus, TOPIC_BARS
+from ..metrics import REGISTRY
+from ..profiler import get_profiler
 from ..quotation import Quotation
 
+BAR_DROPPED = REGISTRY.counter('easyquant_quotation_bar_dropped_total', '获取行情失败而未推送的K线数')
+
 
 class QuotationEngine:
     EventType = 'bar'
     PushInterval = 3600
-
-    def __init__(self, quotation: Quotation, event_engine: EventEngine, bar_type='5m'):
+    # K线收盘后延迟多少秒再获取行情, 给数据源生成K线留出时间
+    PushDelay = 1
+    # 收盘到推送完成的延迟目标(秒), 超过则记为延迟推送
+    LatencyTarget = 10
+    # 无法计算下一根K线时间(如交易日历为空)时, 间隔多少秒重试
+    ErrorBackoff = 60
+
+    def __init__(self, quotation: Quotation, event_engine: EventEngine, bar_type='5m',
+                 push_delay=None, latency_target=None, bus: MarketBus = None, log=None):
         """
 
         :param quotation:
         :param event_engine:
         :param bar_type: K线类型
+        :param push_delay: K线收盘后延迟推送的秒数
+        :param latency_target: 推送延迟目标(秒)
+        :param bus: 行情总线, 传入时每根K线同时以 bars 主题发布, 策略之外的订阅者共用同一份行情
+        :param log: 日志句柄, 获取行情失败时调用 log.error, 默认输出到标准错误
         """
         self.event_engine = event_engine
+        self.bus = bus
+        self.log = log
         self.quotation_source = quotation
         self.is_active = True
 
@@ -26,9 +46,18 @@ class QuotationEngine:
         self.quotation_thread.setDaemon(False)
 
         self.bar_type = bar_type
-        if "m" in bar_type:
-            minute = int(bar_type.replace("m", ""))
+        minute = etime.get_bar_minutes(bar_type)
+        if minute:
             self.PushInterval = minute * 60
+        if push_delay is not None:
+            self.PushDelay = push_delay
+        if latency_target is not None:
+            self.LatencyTarget = latency_target
+
+        # 最近一次推送的延迟, 超过延迟目标的次数, 以及获取行情失败而未推送的次数
+        self.last_latency = None
+        self.late_count = 0
+        self.dropped_count = 0
 
         self.init()
 
@@ -41,22 +70,64 @@ class QuotationEngine:
     def push_quotation(self):
         while self.is_active:
             try:
-                response_data = self.fetch_quotation()
-            except:
-                self.wait()
+                bar_dt = self.next_bar_dt()
+            except Exception:
+                self._error('计算下一根K线时间失败, %s 秒后重试, 请检查交易日历' % self.ErrorBackoff)
+                if not self.wait_until(datetime.datetime.now() + datetime.timedelta(seconds=self.ErrorBackoff)):
+                    break
                 continue
-            event = Event(event_type=self.EventType, data=response_data)
+            if not self.wait_until(bar_dt + datetime.timedelta(seconds=self.PushDelay)):
+                break
+            fetch_start = datetime.datetime.now()
+            try:
+                response_data = self.fetch_quotation(end_date=bar_dt)
+            except Exception:
+                self.dropped_count += 1
+                BAR_DROPPED.inc()
+                self._error('获取 %s K线行情失败, 跳过该K线' % bar_dt)
+                continue
+            fetch_end = datetime.datetime.now()
+            event = BarEvent(event_type=self.EventType, data=response_data,
+                             bar_dt=bar_dt, fetch_start=fetch_start, fetch_end=fetch_end)
+            self.last_latency = event.latency
+            if self.last_latency > self.LatencyTarget:
+                self.late_count += 1
             self.event_engine.put(event)
-            self.wait()
+            if self.bus is not None:
+                self.bus.publish(TOPIC_BARS, response_data, bar_dt=bar_dt, fetch_start=fetch_start,
+                                 fetch_end=fetch_end)
+
+    def _error(self, message):
+        if self.log is not None:
+            self.log.error('%s\n%s' % (message, traceback.format_exc()))
+        else:
+            traceback.print_exc()
 
     def init(self):
         # do something init
         pass
 
-    def wait(self):
+    def next_bar_dt(self, now=None):
+        """
+        下一根K线的收盘时间, 跳过午间休市和非交易日
+        :param now: datetime.datetime, 默认为当前时间
+        :return: datetime.datetime
+        """
+        return etime.get_next_bar_close(now or datetime.datetime.now(), self.bar_type)
+
+    def wait_until(self, wake_dt):
+        """
+        休眠到指定时间
+        :param wake_dt: datetime.datetime
+        :return: 引擎停止时返回 False
+        """
         # for receive quit signal
-        for _ in range(int(self.PushInterval) + 1):
-            time.sleep(1)
+        while self.is_active:
+            remain = (wake_dt - datetime.datetime.now()).total_seconds()
+            if remain <= 0:
+                return True
+            time.sleep(min(remain, 1))
+        return False
 
     stocks = []
 
@@ -68,8 +139,12 @@ class QuotationEngine:
 
     def fetch_quotation(self, end_date=None):
         bars = {}
+        # 按行情源汇总耗时
+        phase = get_profiler().phase
+        source = 'quotation.' + type(self.quotation_source).__name__
         for code in self.stocks:
-            bars[code] = self.quotation_source.get_bars(code, 200, unit=self.bar_type,
-                                                        end_dt=end_date if end_date else datetime.datetime.now())
+            with phase(source):
+                bars[code] = self.quotation_source.get_bars(code, 200, unit=self.bar_type,
+                                                            end_dt=end_date if end_date else datetime.datetime.now())
 
         return bars
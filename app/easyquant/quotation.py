@@ -4,25 +4,42 @@ import multiprocessing.pool
 import os
 import warnings
 import datetime
-import jqdatasdk
 import pandas as pd
 
 import pandas
-import tushare as ts
-
-import requests
-from jqdatasdk import finance, query
 
+from easyquant.bar_cache import BarCache
+from easyquant.bar_store import BarStore
 from easyquant.easydealutils.time import get_all_trade_days
+from easyquant.metrics import REGISTRY
 from easyquant.models import SecurityInfo
-from easytrader.utils.misc import file2dict
+from easyquant.profiler import get_profiler
 from pandas import DataFrame
 
-from easyquotation.bar import get_price
+# 各行情源的 SDK 只在使用时导入, use_quotation 只加载所选的行情源
+
+
+def file2dict(path):
+    """读取 json 配置文件"""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
 
 
 class Quotation(metaclass=abc.ABCMeta):
     """行情获取基类"""
+    # 所有行情源共用的K线内存缓存
+    cache = BarCache()
+
+    @classmethod
+    def configure_cache(cls, max_bytes=512 * 1024 * 1024, policy='lru', spill_dir=None):
+        """
+        替换共用的K线内存缓存
+        :param max_bytes: 内存预算(字节)
+        :param policy: 淘汰策略, 'lru' 或 'lfu'
+        :param spill_dir: 淘汰项落盘目录
+        """
+        Quotation.cache = BarCache(max_bytes=max_bytes, policy=policy, spill_dir=spill_dir)
+        return Quotation.cache
 
     def get_bars(self, security, count, unit='1d',
                  fields=['date', 'open', 'high', 'low', 'close', 'volume'],
@@ -43,6 +60,47 @@ class Quotation(metaclass=abc.ABCMeta):
         """
         pass
 
+    def _load_bars(self, code, unit, count, end_dt, query_tag, fetch, end=None, replace_on_change=False):
+        """
+        依次从内存缓存、列式存储、行情接口获取截止时间(含)前最后 count 根K线, 各行情源共用
+        :param code: 行情源的标的代码
+        :param end_dt: 截止时间, None 表示最新
+        :param query_tag: 查询标识, 即本次查询的截止日期, 行情接口已拉取过该日期时不再拉取
+        :param fetch: 无参函数, 从行情接口拉取截止 query_tag 的K线, 返回以时间为索引的 DataFrame
+        :param end: 拉取的K线覆盖的截止时间(含), 默认为 query_tag
+        :param replace_on_change: 见 BarStore.append
+        :return: DataFrame, 没有数据时为空 DataFrame
+        """
+        phase = get_profiler().phase
+        end = query_tag if end is None else end
+
+        # 缓存中截止时间前的K线足够 count 根才算命中
+        with phase('cache'):
+            df = self.cache.get_last(code, unit, end_dt, count)
+        if df is not None:
+            return df
+
+        if not self.store.has_query(code, unit, query_tag):
+            df = fetch()
+            with phase('store.append'):
+                self.store.append(code, unit, df, tag=query_tag, replace_on_change=replace_on_change)
+
+        with phase('store.load'):
+            df = self.store.load(code, unit, end=end)
+        if df is None or df.empty:
+            return DataFrame()
+        # 列式存储只保存数值列, 补回行情接口返回的日期等列
+        self._restore_columns(code, df)
+        # 缓存覆盖的范围为实际数据的起始时间到查询截止日期
+        self.cache.put(code, unit, df, start=df.index[0], end=end)
+        return slice_bars(df, end_dt, count)
+
+    def _restore_columns(self, code, df: DataFrame):
+        """
+        在从列式存储读出的K线上原地补回非数值列
+        """
+        pass
+
     def get_all_trade_days(self):
         """
         所有交易日期
@@ -68,6 +126,14 @@ class Quotation(metaclass=abc.ABCMeta):
         return SecurityInfo
 
 
+# 缓存可被 configure_cache 替换, 采集时读取当前缓存的统计
+_BAR_CACHE_LOOKUPS = REGISTRY.counter('easyquant_bar_cache_lookups_total', 'K线内存缓存的查询次数', ['result'])
+_BAR_CACHE_LOOKUPS.labels('hit').set_function(lambda: Quotation.cache.hits)
+_BAR_CACHE_LOOKUPS.labels('miss').set_function(lambda: Quotation.cache.misses)
+REGISTRY.gauge('easyquant_bar_cache_hit_ratio', 'K线内存缓存的命中率').set_function(
+    lambda: Quotation.cache.stats['hit_rate'])
+REGISTRY.gauge('easyquant_bar_cache_bytes', 'K线内存缓存占用的字节数').set_function(lambda: Quotation.cache.nbytes)
+
 def is_shanghai(stock_code):
     """判断股票ID对应的证券市场
     匹配规则
@@ -89,14 +155,40 @@ def to_date_str(dt):
         return dt.strftime("%Y-%m-%d")
 
 
+def to_query_tag(end_dt, days=0):
+    """
+    行情查询的截止日期
+    :param end_dt: 截止时间, datetime / date / 字符串, None 表示今天
+    :param days: 在截止时间后追加的天数
+    :return: 'YYYY-MM-DD'
+    """
+    dt = pd.Timestamp(end_dt if end_dt is not None else datetime.datetime.now())
+    return to_date_str(dt + datetime.timedelta(days=days))
+
+
+def slice_bars(df: DataFrame, end_dt, count) -> DataFrame:
+    """
+    在已排序的时间索引上二分定位截止时间, 返回截止时间(含)前最后 count 根K线
+    :param df: 以时间为索引并按时间升序排列的K线
+    :param end_dt: 截止时间, None 表示不限
+    :param count: K线根数
+    :return: df 的切片视图, 不拷贝数据
+    """
+    hi = len(df) if end_dt is None else df.index.searchsorted(pd.Timestamp(end_dt), side='right')
+    return df.iloc[max(hi - count, 0):hi]
+
+
 class TushareQuotation(Quotation):
     """
     tushare 行情
     """""
 
     def __init__(self):
+        import tushare as ts
+
         tushare_config = file2dict('tushare.json')
         ts.set_token(tushare_config['token'])
+        self.store = BarStore(os.path.join('data', 'bars', 'tushare'))
 
     def get_stock_type(self, stock_code: str):
         return "SH" if is_shanghai(stock_code) else "SZ"
@@ -104,45 +196,47 @@ class TushareQuotation(Quotation):
     def _format_code(self, code: str) -> str:
         return "%s.%s" % (code, self.get_stock_type(code))
 
-    def _get_cache_key(self, security, end_dt, unit):
-        return "data/tushare_%s_%s_%s.csv" % (self._format_code(security), to_date_str(end_dt), unit)
-
     def get_bars(self, security, count, unit='1d',
                  fields=['trade_date', 'open', 'high', 'low', 'close'],
                  include_now=False, end_dt=None) -> DataFrame:
+        import tushare as ts
 
         if unit == "1d":
             unit = "D"
 
-        cache_file = self._get_cache_key(security, end_dt, unit)
+        code = self._format_code(security)
+        query_tag = to_query_tag(end_dt)
 
-        if os.path.exists(cache_file):
-            df = pd.read_csv(cache_file)
+        def fetch():
+            with get_profiler().phase('api.tushare'):
+                df = ts.pro_bar(ts_code=code,
+                                end_date=query_tag,
+                                freq=unit,  # 只免费
+                                asset='E',
+                                limit=count)
             df.index = pandas.to_datetime(df["trade_date"])
             return df
 
-        df = ts.pro_bar(ts_code=self._format_code(security),
-                        end_date=to_date_str(end_dt),
-                        freq=unit,  # 只免费
-                        asset='E',
-                        limit=count)
-        df.index = pandas.to_datetime(df["trade_date"])
-        df.sort_index(inplace=True)
+        # 拉取的K线包含截止日当天
+        end = pd.Timestamp(query_tag) + pd.Timedelta(days=1) - pd.Timedelta(1)
+        return self._load_bars(code, unit, count, end_dt, query_tag, fetch, end=end)
 
-        df.to_csv(cache_file)
-
-        return df
+    def _restore_columns(self, code, df: DataFrame):
+        df.insert(0, 'trade_date', df.index.strftime('%Y%m%d'))
+        df.insert(0, 'ts_code', code)
 
 
 class JQDataQuotation(Quotation):
     """
     JQData行情
     """""
-    cache = {}
 
     def __init__(self):
+        import jqdatasdk
+
         config = file2dict('jqdata.json')
         jqdatasdk.auth(config["user"], config["password"])
+        self.store = BarStore(os.path.join('data', 'bars', 'jqdata'))
 
     def _get_cache_key(self, security, end_dt, unit):
         return "%s_%s_%s" % (self._format_code(security), to_date_str(end_dt), unit)
@@ -154,6 +248,8 @@ class JQDataQuotation(Quotation):
         return "%s%s" % (code, self.get_stock_type(code))
 
     def get_north_money(self, date):
+        from jqdatasdk import finance, query
+
         n_sh = finance.run_query(query(finance.STK_ML_QUOTA).filter(finance.STK_ML_QUOTA.day <= date,
                                                                     finance.STK_ML_QUOTA.link_id == 310001).order_by(
             finance.STK_ML_QUOTA.day.desc()).limit(10))
@@ -171,47 +267,42 @@ class JQDataQuotation(Quotation):
     def get_bars(self, security, count, unit='1d',
                  fields=['date', 'open', 'high', 'low', 'close', 'volume'],
                  include_now=True, end_dt=None) -> DataFrame:
-
-        query_dt = end_dt
-        if not isinstance(query_dt, datetime.datetime):
-            query_dt = datetime.datetime.strptime(query_dt, "%Y-%m-%d")
-
-        query_dt += datetime.timedelta(days=1)
+        import jqdatasdk
 
         if 'date' not in fields:
             fields.append('date')
 
-        cache_key = self._get_cache_key(security, query_dt, unit)
-
-        if cache_key in self.cache:
-            df = self.cache[cache_key]
-            return df[df.index <= end_dt] if "m" in unit else df
-
-        cache_file = "data/jqdata-%s.csv" % cache_key
-
-        if os.path.exists(cache_file):
-            df = pd.read_csv(cache_file)
-            df.index = df.date
-            self.cache[cache_key] = df
-            return df[df.index <= end_dt] if "m" in unit else df
-
-        df = jqdatasdk.get_bars(self._format_code(security), 10000,
-                                unit=unit,
-                                fields=fields,
-                                include_now=include_now,
-                                # 取整天的数据
-                                end_dt=to_date_str(query_dt), fq_ref_date=datetime.datetime.now())
-        df.index = df.date
-        df.sort_index(inplace=True)
-        # 放入缓存
-        self.cache[cache_key] = df
+        code = self._format_code(security)
+        # 取到截止日期的第二天, 包含截止日当天的全部K线
+        query_tag = to_query_tag(end_dt, days=1)
+
+        def fetch():
+            cache_file = "data/jqdata-%s_%s_%s.csv" % (code, query_tag, unit)
+            if os.path.exists(cache_file):
+                # 旧版 csv 缓存, 导入列式存储
+                with get_profiler().phase('csv'):
+                    df = pd.read_csv(cache_file, index_col=0)
+                    df.index = pd.to_datetime(df.index)
+            else:
+                with get_profiler().phase('api.jqdata'):
+                    df = jqdatasdk.get_bars(code, 10000,
+                                            unit=unit,
+                                            fields=fields,
+                                            include_now=include_now,
+                                            # 取整天的数据
+                                            end_dt=query_tag, fq_ref_date=datetime.datetime.now())
+                df.index = pd.to_datetime(df.date)
+            return df
 
-        df.to_csv(cache_file)
+        # 以当前日期为复权基准, 除权后已存的K线与新数据不一致, 整体替换
+        return self._load_bars(code, unit, count, end_dt, query_tag, fetch, replace_on_change=True)
 
-        # 过滤数据
-        return df[df.index <= end_dt] if "m" in unit else df
+    def _restore_columns(self, code, df: DataFrame):
+        df.insert(0, 'date', df.index)
 
     def get_stock_info(self, security: str):
+        import jqdatasdk
+
         return jqdatasdk.get_security_info(self._format_code(security))
 
 
@@ -229,6 +320,8 @@ class FreeOnlineQuotation(Quotation):
     def get_bars(self, security, count, unit='1d',
                  fields=['date', 'open', 'high', 'low', 'close', 'volume'],
                  include_now=False, end_dt=None) -> DataFrame:
+        from easyquotation.bar import get_price
+
         df = get_price(self._format_code(security), end_date=end_dt, count=security, frequency=unit)
         return df
 
@@ -236,9 +329,13 @@ class FreeOnlineQuotation(Quotation):
 def use_quotation(source: str) -> Quotation:
     """
     对外API，行情工厂
-    :param source:
+    :param source: 'jqdata' / 'tushare' / 'panel:<共享内存名称或面板目录>' / 其它为免费实时行情
     :return:
     """
+    if source.startswith("panel:"):
+        # 挂载预先发布的K线面板, 不访问行情接口
+        from easyquant.panel import PanelQuotation, open_panel
+        return PanelQuotation(open_panel(source[len("panel:"):]))
     if source in ["jqdata"]:
         return JQDataQuotation()
     if source in ["tushare"]:
@@ -0,0 +1,183 @@
+# coding: utf-8
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from easyquant import batch_indicators as bi
+
+
+class BreakoutScanner:
+    """
+    全市场放量突破扫描, 规则与 volume_breakout_rc_strategy.BullStockStrategy 的买入条件一致:
+    收盘价 >= 最近 breakout_period 根K线的最高价(含当根), 且成交量 > 最近 volume_period 根均量(含当根) × volume_ratio.
+
+    scan 对整块面板一次性计算全部标的全部日期的信号; 之后每日收盘调用 update 增量追加一根K线,
+    只保留最近的窗口数据, 每日计算量与历史长度无关. 状态可 save / load, 供每晚的选股任务接续.
+    """
+
+    def __init__(self, breakout_period=20, volume_period=30, volume_ratio=1.5):
+        self.breakout_period = breakout_period
+        self.volume_period = volume_period
+        self.volume_ratio = volume_ratio
+        self.window = max(breakout_period, volume_period)
+        self.symbols = []
+        self._symbol_index = {}
+        self.last_date = None
+        # 最近 window 根K线的最高价和成交量, 按行循环写入
+        self._high = np.full((self.window, 0), np.nan)
+        self._volume = np.full((self.window, 0), np.nan)
+        self._pos = 0
+
+    def signals(self, high, close, volume):
+        """
+        :param high: (时间 × 标的) 最高价
+        :param close: (时间 × 标的) 收盘价
+        :param volume: (时间 × 标的) 成交量
+        :return: (时间 × 标的) bool 信号矩阵
+        """
+        highest = bi.HIGHEST(high, self.breakout_period)
+        vol_ma = bi.MA(volume, self.volume_period)
+        with np.errstate(invalid='ignore'):
+            return (close >= highest) & (volume > vol_ma * self.volume_ratio)
+
+    def scan(self, panel) -> pd.DataFrame:
+        """
+        扫描整块面板, 并以面板最后 window 根K线初始化增量状态
+        :param panel: BarPanel, 需包含 high / close / volume
+        :return: 以时间为索引、标的为列的 bool DataFrame
+        """
+        high, close, volume = panel.field('high'), panel.field('close'), panel.field('volume')
+        result = self.signals(high, close, volume)
+
+        self.symbols = list(panel.symbols)
+        self._symbol_index = {s: i for i, s in enumerate(self.symbols)}
+        self._high = np.full((self.window, len(self.symbols)), np.nan)
+        self._volume = np.full((self.window, len(self.symbols)), np.nan)
+        tail = min(self.window, len(panel.times))
+        self._high[:tail] = high[len(high) - tail:]
+        self._volume[:tail] = volume[len(volume) - tail:]
+        self._pos = tail % self.window
+        self.last_date = pd.Timestamp(panel.times[-1]) if len(panel.times) else None
+        return pd.DataFrame(result, index=pd.DatetimeIndex(panel.times, name='date'), columns=self.symbols)
+
+    @staticmethod
+    def signal_set(result: pd.DataFrame):
+        """
+        :param result: scan 的结果
+        :return: {日期: [标的]}, 只含有信号的日期
+        """
+        rows, cols = np.nonzero(result.values)
+        signals = {}
+        for r, c in zip(rows, cols):
+            signals.setdefault(result.index[r], []).append(result.columns[c])
+        return signals
+
+    def _grow(self, symbols):
+        new = [s for s in symbols if s not in self._symbol_index]
+        if new:
+            for s in new:
+                self._symbol_index[s] = len(self.symbols)
+                self.symbols.append(s)
+            pad = np.full((self.window, len(new)), np.nan)
+            self._high = np.hstack([self._high, pad])
+            self._volume = np.hstack([self._volume, pad])
+        return np.array([self._symbol_index[s] for s in symbols], dtype=np.int64)
+
+    def update(self, date, symbols, high, close, volume):
+        """
+        追加一个交易日的K线, 未出现的标的视为停牌
+        :param date: 交易日
+        :param symbols: 标的列表
+        :param high: 与 symbols 对齐的最高价数组
+        :param close: 收盘价数组
+        :param volume: 成交量数组
+        :return: 当日出现信号的标的列表
+        """
+        date = pd.Timestamp(date)
+        if self.last_date is not None and date <= self.last_date:
+            raise ValueError('%s 不晚于已处理的 %s' % (date, self.last_date))
+        idx = self._grow(symbols)
+        n = len(self.symbols)
+        row_high = np.full(n, np.nan)
+        row_close = np.full(n, np.nan)
+        row_volume = np.full(n, np.nan)
+        row_high[idx] = high
+        row_close[idx] = close
+        row_volume[idx] = volume
+
+        self._high[self._pos] = row_high
+        self._volume[self._pos] = row_volume
+        self._pos = (self._pos + 1) % self.window
+        self.last_date = date
+
+        # 按时间顺序取最近的窗口, 只算最后一行
+        order = np.roll(np.arange(self.window), -self._pos)
+        high_window = self._high[order[self.window - self.breakout_period:]]
+        volume_window = self._volume[order[self.window - self.volume_period:]]
+        with np.errstate(invalid='ignore'):
+            highest = high_window.max(axis=0)
+            vol_ma = volume_window.mean(axis=0)
+            hit = (row_close >= highest) & (row_volume > vol_ma * self.volume_ratio)
+        return [self.symbols[i] for i in np.flatnonzero(hit)]
+
+    def save(self, path):
+        """保存增量状态"""
+        np.savez(path, symbols=np.array(self.symbols, dtype=object), high=self._high, volume=self._volume,
+                 pos=self._pos, last_date=str(self.last_date) if self.last_date is not None else '',
+                 params=[self.breakout_period, self.volume_period, self.volume_ratio])
+        return path
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path, allow_pickle=True)
+        breakout_period, volume_period, volume_ratio = data['params']
+        scanner = cls(int(breakout_period), int(volume_period), float(volume_ratio))
+        scanner.symbols = list(data['symbols'])
+        scanner._symbol_index = {s: i for i, s in enumerate(scanner.symbols)}
+        scanner._high = data['high']
+        scanner._volume = data['volume']
+        scanner._pos = int(data['pos'])
+        last_date = str(data['last_date'])
+        scanner.last_date = pd.Timestamp(last_date) if last_date else None
+        return scanner
+
+
+def main():
+    """
+    每晚选股: 首次运行由本地 BarStore 全量扫描并保存状态, 之后只追加 store 中比状态更新的交易日
+    python -m easyquant.scanner --store data/bars/jqdata --state data/scanner.npz
+    """
+    from easyquant.bar_store import BarStore
+    from easyquant.panel import build_panel_from_store
+
+    parser = argparse.ArgumentParser(description='全市场放量突破扫描')
+    parser.add_argument('--store', default=os.path.join('data', 'bars', 'jqdata'), help='BarStore 目录')
+    parser.add_argument('--state', default=os.path.join('data', 'scanner.npz'), help='增量状态文件')
+    parser.add_argument('--start', default=None, help='全量扫描的起始日期')
+    args = parser.parse_args()
+
+    store = BarStore(args.store)
+    symbols = store.symbols('1d')
+    if os.path.exists(args.state):
+        scanner = BreakoutScanner.load(args.state)
+        start = scanner.last_date + pd.Timedelta(days=1)
+        panel = build_panel_from_store(store, symbols, start=start, fields=('high', 'close', 'volume'))
+        for t, date in enumerate(panel.times):
+            hits = scanner.update(date, panel.symbols, panel.field('high')[t], panel.field('close')[t],
+                                  panel.field('volume')[t])
+            print('%s 突破信号 %d 只: %s' % (pd.Timestamp(date).date(), len(hits), ' '.join(hits)))
+    else:
+        scanner = BreakoutScanner()
+        panel = build_panel_from_store(store, symbols, start=args.start, fields=('high', 'close', 'volume'))
+        result = scanner.scan(panel)
+        if len(result):
+            hits = list(result.columns[result.values[-1]])
+            print('%s 突破信号 %d 只: %s' % (result.index[-1].date(), len(hits), ' '.join(hits)))
+    os.makedirs(os.path.dirname(os.path.abspath(args.state)), exist_ok=True)
+    scanner.save(args.state)
+
+
+if __name__ == '__main__':
+    main()
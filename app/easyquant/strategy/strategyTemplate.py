@@ -1,34 +1,69 @@
 # coding:utf-8
 import sys
 import traceback
-from typing import Dict
+from typing import Dict, TYPE_CHECKING
 
 from pandas import DataFrame
 
 from ..context import Context
 from ..event_engine import Event
-from easytrader.webtrader import WebTrader
+
+if TYPE_CHECKING:
+    from easytrader.webtrader import WebTrader
 
 
 class StrategyTemplate:
     name = 'DefaultStrategyTemplate'
+    # 策略参数默认值, 实例化时可被 params 覆盖, 参数寻优时按网格替换
+    params = {}
+    # 为 True 时 run 不在内部记录异常而是抛出, 运行在独立进程中时由 ProcessWrapper 记录并计数
+    raise_errors = False
 
-    def __init__(self, user: WebTrader, log_handler, main_engine):
+    def __init__(self, user: 'WebTrader', log_handler, main_engine, params=None):
         self.user = user
         self.main_engine = main_engine
+        self.params = dict(self.params)
+        self.params.update(params or {})
         # 优先使用自定义 log 句柄, 否则使用主引擎日志句柄
         self.log = self.log_handler() or log_handler
         self._context: Context = main_engine.context
         self.quotation_engine = main_engine.quotation_engine
+        # 行情总线, 订阅或按需获取与其它策略共用的行情快照
+        self.market_bus = getattr(main_engine, 'market_bus', None)
         self.init()
 
     def on_bar(self, context: Context, data: Dict[str, DataFrame]):
         pass
 
+    def on_panel(self, context: Context, panel):
+        """
+        向量化回测入口, 以数组运算一次性给出整段行情的目标仓位
+        :param context:
+        :param panel: BarPanel, panel.field('close') 为 (时间 × 标的) 收盘价矩阵
+        :return: (时间 × 标的) 目标权重矩阵, 第 t 根K线的权重在第 t+1 根K线成交, NaN 表示保持原仓位;
+            未实现时返回 None, 回测入口据此回退到事件驱动回测
+        """
+        return None
+
     def init(self):
         # 进行相关的初始化操作
         pass
 
+    def market_sources(self):
+        """
+        策略用到的定时行情, 在主进程的行情总线上注册, 由总线按间隔拉取;
+        独立进程中的策略经 market_bus.get 读取主进程拉取的快照, 增加策略不会增加上游请求
+        :return: [(主题, 无参拉取函数, 间隔秒数)]
+        """
+        return []
+
+    def warm_up(self):
+        """
+        加载策略后、开始接收事件前调用, 可在此预先拉取历史K线或计算指标
+        重新加载时旧实例在此期间继续处理事件
+        """
+        pass
+
     def strategy(self, context: Context, event: Event):
         """        :param context:
 :param event event.data 为所有股票的信息，结构如下
@@ -72,6 +107,8 @@ class StrategyTemplate:
             else:
                 self.strategy(self._context, event)
         except:
+            if self.raise_errors:
+                raise
             exc_type, exc_value, exc_traceback = sys.exc_info()
             self.log.error(repr(traceback.format_exception(exc_type,
                                                            exc_value,
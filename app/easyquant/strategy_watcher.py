@@ -0,0 +1,135 @@
+# coding: utf-8
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+# inotify 事件掩码, 见 <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+# 写完关闭、编辑器先写临时文件再改名、删除
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+
+# struct inotify_event 头: wd, mask, cookie, len
+_EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """
+    基于 inotify 的目录监视(仅 Linux), 文件变动时内核通知, 无需轮询
+    """
+
+    # 收到变动后再等待的秒数, 合并编辑器保存时的多次写入
+    DEBOUNCE = 0.2
+
+    def __init__(self, path, suffix='.py'):
+        """
+        :param path: 监视的目录
+        :param suffix: 只关注该后缀的文件
+        """
+        self.path = path
+        self.suffix = suffix
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        if libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, os.strerror(errno), path)
+
+    def _read(self):
+        try:
+            buf = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        names = set()
+        offset = 0
+        while offset < len(buf):
+            _, _, _, length = _EVENT.unpack_from(buf, offset)
+            offset += _EVENT.size
+            names.add(os.fsdecode(buf[offset:offset + length].rstrip(b'\0')))
+            offset += length
+        return names
+
+    def changes(self, timeout=None):
+        """
+        等待文件变动
+        :param timeout: 最长等待秒数, None 为一直等待
+        :return: 变动的文件名集合, 超时为空集合
+        """
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return set()
+        names = self._read()
+        deadline = time.monotonic() + self.DEBOUNCE
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self._fd], [], [], remaining)[0]:
+                break
+            names |= self._read()
+        return {name for name in names if name.endswith(self.suffix)}
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """
+    轮询目录中文件的修改时间, 用于不支持 inotify 的平台
+    """
+
+    def __init__(self, path, suffix='.py', interval=2):
+        """
+        :param interval: 轮询间隔(秒)
+        """
+        self.path = path
+        self.suffix = suffix
+        self.interval = interval
+        self._mtimes = self._scan()
+
+    def _scan(self):
+        mtimes = {}
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if entry.name.endswith(self.suffix):
+                    mtimes[entry.name] = entry.stat().st_mtime
+        return mtimes
+
+    def changes(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            mtimes = self._scan()
+            changed = {name for name in set(mtimes) | set(self._mtimes)
+                       if mtimes.get(name) != self._mtimes.get(name)}
+            self._mtimes = mtimes
+            if changed:
+                return changed
+            wait = self.interval
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    return set()
+            time.sleep(wait)
+
+    def close(self):
+        pass
+
+
+def create_watcher(path, suffix='.py', interval=2):
+    """
+    优先使用 inotify, 不可用时退回到轮询
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(path, suffix)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(path, suffix, interval)
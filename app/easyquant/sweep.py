@@ -0,0 +1,139 @@
+# coding: utf-8
+import itertools
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+from .panel import BarPanel, PanelQuotation, load_panel, open_panel, publish_panel
+from .quotation import use_quotation
+from .vector_backtest import VectorBackTestEngine
+
+# 工作进程内只读打开的面板, 由 _init_worker 设置
+_worker_panel = None
+
+
+def param_grid(grid):
+    """
+    展开参数网格
+    :param grid: {参数名: 候选值列表}
+    :return: 参数字典列表
+    >>> param_grid({'a': [1, 2], 'b': [3]})
+    [{'a': 1, 'b': 3}, {'a': 2, 'b': 3}]
+    """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+
+def _init_worker(panel_source):
+    global _worker_panel
+    _worker_panel = open_panel(panel_source)
+
+
+def _run_one(task):
+    run_id, strategy_class, params, start_date, end_date, bar_type, engine_kwargs = task
+    began = time.perf_counter()
+    row = {'run_id': run_id}
+    row.update(params)
+    try:
+        # 策略的 __init__ / init 出错也只记录在本行, 不中断整个进程池
+        engine = VectorBackTestEngine(strategy_class, start_date, end_date,
+                                      bar_type=bar_type,
+                                      quotation=PanelQuotation(_worker_panel),
+                                      panel=_worker_panel,
+                                      params=params,
+                                      **engine_kwargs)
+        row.update(engine.start().metrics())
+        row['error'] = None
+    except Exception as e:
+        row['error'] = repr(e)
+    row['elapsed'] = time.perf_counter() - began
+    return row
+
+
+class SweepRunner:
+    """
+    参数寻优
+
+    K线面板只加载一次, 发布到共享内存或保存为内存映射文件, 各工作进程只读挂载, 不重复拉取行情;
+    参数组合按进程池分片并行执行, 结果汇总为一张指标表, 每行一组参数.
+    """
+
+    def __init__(self, strategy_class, start_date, end_date, symbols=None, bar_type='1d',
+                 quotation='jqdata', panel: BarPanel = None, processes=None, workdir=None, share='shm',
+                 **engine_kwargs):
+        """
+        :param strategy_class: StrategyTemplate 子类, 需实现 on_panel, 且可被 pickle(定义在模块顶层)
+        :param symbols: 标的列表
+        :param panel: 已加载好的面板, 为 None 时按 symbols 从 quotation 读取
+        :param processes: 进程数, 默认为 CPU 核数
+        :param workdir: 面板文件目录, 默认使用临时目录并在结束后删除
+        :param share: 面板共享方式, 'shm' 共享内存, 'mmap' 内存映射文件
+        :param engine_kwargs: 传给 VectorBackTestEngine 的其它参数, 如 initial_cash, commission
+        """
+        if not VectorBackTestEngine.supports(strategy_class):
+            raise ValueError('%s 未实现 on_panel, 不支持并行参数寻优' % strategy_class.__name__)
+        self.strategy_class = strategy_class
+        self.start_date = start_date
+        self.end_date = end_date
+        self.symbols = symbols
+        self.bar_type = bar_type
+        self.quotation = quotation
+        self.panel = panel
+        self.processes = processes or os.cpu_count()
+        self.workdir = workdir
+        self.share = share
+        self.engine_kwargs = engine_kwargs
+
+    def _load_panel(self):
+        if self.panel is None:
+            if self.symbols is None:
+                raise ValueError('未指定 panel 时必须指定 symbols')
+            quotation = use_quotation(self.quotation) if isinstance(self.quotation, str) else self.quotation
+            self.panel = load_panel(quotation, self.symbols, self.start_date, self.end_date, unit=self.bar_type)
+        return self.panel
+
+    def run(self, grid) -> pd.DataFrame:
+        """
+        :param grid: {参数名: 候选值列表} 或参数字典列表
+        :return: DataFrame, 每行为一组参数及其回测指标
+        """
+        params_list = param_grid(grid) if isinstance(grid, dict) else list(grid)
+        panel = self._load_panel()
+
+        tasks = [(i, self.strategy_class, params, self.start_date, self.end_date, self.bar_type,
+                  self.engine_kwargs) for i, params in enumerate(params_list)]
+
+        if self.share == 'shm':
+            shm = publish_panel(panel)
+            try:
+                rows = self._run_tasks(tasks, shm.name)
+            finally:
+                shm.close()
+                shm.unlink()
+        else:
+            own_dir = self.workdir is None
+            workdir = tempfile.mkdtemp(prefix='easyquant_sweep_') if own_dir else self.workdir
+            try:
+                rows = self._run_tasks(tasks, panel.save(os.path.join(workdir, 'panel')))
+            finally:
+                if own_dir:
+                    shutil.rmtree(workdir, ignore_errors=True)
+
+        return pd.DataFrame(rows).sort_values('run_id').reset_index(drop=True)
+
+    def _run_tasks(self, tasks, panel_source):
+        with mp.Pool(self.processes, initializer=_init_worker, initargs=(panel_source,)) as pool:
+            return list(pool.imap_unordered(_run_one, tasks, chunksize=1))
+
+
+def run_sweep(strategy_class, grid, start_date, end_date, **kwargs) -> pd.DataFrame:
+    """
+    参数寻优便捷入口
+    :param grid: {参数名: 候选值列表}
+    :return: 指标表
+    """
+    return SweepRunner(strategy_class, start_date, end_date, **kwargs).run(grid)
@@ -0,0 +1,232 @@
+# coding: utf-8
+import numpy as np
+
+from .context import Context
+from .easydealutils import time as etime
+from .event_engine import EventEngine
+from .log_handler.default_handler import MockLogHandler
+from .matching import FeeSchedule, MatchingLedger
+from .panel import BarPanel, load_panel
+from .push_engine.quotation_engine import QuotationEngine
+from .quotation import use_quotation
+from .strategy.strategyTemplate import StrategyTemplate
+
+# 每年交易日数, 用于年化
+TRADE_DAYS_PER_YEAR = 244
+
+
+def forward_fill(matrix):
+    """
+    按时间轴(第 0 维)前向填充 NaN
+    :param matrix: (时间 × 标的) 数组
+    """
+    mask = np.isnan(matrix)
+    index = np.where(~mask, np.arange(len(matrix))[:, None], 0)
+    np.maximum.accumulate(index, axis=0, out=index)
+    filled = matrix[index, np.arange(matrix.shape[1])]
+    return filled
+
+
+class VectorResult:
+    """向量化回测结果, 各字段均为按时间对齐的数组"""
+
+    def __init__(self, times, symbols, positions, trades, cash, equity, fees, bars_per_day=1,
+                 status=None, realized_pnl=None):
+        """
+        :param positions: (时间 × 标的) 每根K线收盘时的持仓股数
+        :param trades: (时间 × 标的) 每根K线的成交股数, 正数买入负数卖出
+        :param cash: 每根K线收盘时的现金
+        :param equity: 每根K线收盘时的总资产
+        :param fees: 每根K线的交易费用
+        :param status: (时间 × 标的) 撮合状态, 仅 MatchingLedger 提供, 见 matching.STATUS_*
+        :param realized_pnl: 每根K线收盘时的累计已实现盈亏, 仅 MatchingLedger 提供
+        """
+        self.times = times
+        self.symbols = symbols
+        self.positions = positions
+        self.trades = trades
+        self.cash = cash
+        self.equity = equity
+        self.fees = fees
+        self.bars_per_day = bars_per_day
+        self.status = status
+        self.realized_pnl = realized_pnl
+
+    def metrics(self):
+        """
+        汇总指标
+        :return: dict
+        """
+        equity = self.equity
+        if len(equity) == 0:
+            return {}
+        returns = np.diff(equity) / equity[:-1] if len(equity) > 1 else np.array([0.0])
+        periods = TRADE_DAYS_PER_YEAR * self.bars_per_day
+        total_return = equity[-1] / equity[0] - 1
+        years = len(equity) / periods
+        peak = np.maximum.accumulate(equity)
+        std = returns.std()
+        return {
+            'total_return': float(total_return),
+            'annual_return': float((1 + total_return) ** (1 / years) - 1) if years > 0 and total_return > -1 else -1.0,
+            'max_drawdown': float(((peak - equity) / peak).max()),
+            'sharpe': float(returns.mean() / std * np.sqrt(periods)) if std > 0 else 0.0,
+            'trade_count': int(np.count_nonzero(self.trades)),
+            'fees': float(self.fees.sum()),
+            'final_equity': float(equity[-1]),
+        }
+
+
+class VectorLedger:
+    """
+    向量化账本
+
+    按K线顺序推进, 每根K线内对全部标的一次性做数组运算:
+    第 t 根K线给出的目标权重, 在第 t+1 根K线以成交价调仓, 以收盘价计算持仓市值.
+    """
+
+    def __init__(self, initial_cash=1000000.0, commission=0.0003):
+        """
+        :param initial_cash: 初始资金
+        :param commission: 双边手续费率
+        """
+        self.initial_cash = initial_cash
+        self.commission = commission
+
+    def run(self, weights, exec_price, mark_price):
+        """
+        :param weights: (时间 × 标的) 目标权重, NaN 表示保持原仓位
+        :param exec_price: (时间 × 标的) 成交价
+        :param mark_price: (时间 × 标的) 估值价
+        :return: (positions, trades, cash, equity, fees)
+        """
+        n_times, n_symbols = weights.shape
+        positions = np.zeros((n_times, n_symbols))
+        trades = np.zeros((n_times, n_symbols))
+        cash = np.zeros(n_times)
+        equity = np.zeros(n_times)
+        fees = np.zeros(n_times)
+        mark = forward_fill(mark_price)
+
+        pos = np.zeros(n_symbols)
+        cur_cash = float(self.initial_cash)
+        for t in range(n_times):
+            if t > 0:
+                target_w = weights[t - 1]
+                price = exec_price[t]
+                # 有目标且当根有成交价的标的才调仓
+                tradable = ~np.isnan(target_w) & ~np.isnan(price) & (price > 0)
+                if tradable.any():
+                    fill_price = np.where(tradable, price, 0.0)
+                    # 以成交价估算调仓前总资产, 无成交价的标的按上一根K线估值
+                    value = cur_cash + np.nansum(pos * np.where(tradable, price, mark[t - 1]))
+                    target = np.where(tradable, target_w * value / np.where(tradable, price, 1.0), pos)
+                    delta = np.where(tradable, target - pos, 0.0)
+                    fee = np.abs(delta * fill_price).sum() * self.commission
+                    cur_cash -= np.sum(delta * fill_price) + fee
+                    pos = pos + delta
+                    trades[t] = delta
+                    fees[t] = fee
+            positions[t] = pos
+            cash[t] = cur_cash
+            equity[t] = cur_cash + np.nansum(pos * mark[t])
+        return positions, trades, cash, equity, fees
+
+    def run_panel(self, weights, panel: BarPanel):
+        """
+        以开盘价(无开盘价时为收盘价)成交, 收盘价估值
+        :return: dict, positions / trades / cash / equity / fees 数组
+        """
+        close = panel.field('close')
+        exec_price = panel.field('open') if panel.has_field('open') else close
+        return dict(zip(('positions', 'trades', 'cash', 'equity', 'fees'), self.run(weights, exec_price, close)))
+
+
+class VectorBackTestEngine:
+    """
+    向量化回测引擎
+
+    回测开始前一次性把全部标的的K线读入对齐的面板, 策略在 on_panel 中以数组运算给出整段行情的目标权重,
+    成交、资金和持仓由 VectorLedger 计算. 未实现 on_panel 的策略仍使用事件驱动的 BackTestEngine.
+    """
+
+    def __init__(self,
+                 strategy_class,
+                 start_date: str,
+                 end_date: str,
+                 bar_type="1d",
+                 quotation='jqdata',
+                 symbols=None,
+                 initial_cash=1000000.0,
+                 commission=0.0003,
+                 panel: BarPanel = None,
+                 params=None,
+                 ledger=None):
+        """
+        :param quotation: 行情源名称或 Quotation 实例
+        :param symbols: 标的列表, 为 None 时使用策略 init 中 watch 的标的
+        :param panel: 已加载好的面板, 传入时不再读取行情
+        :param params: 策略参数, 覆盖策略类的 params
+        :param ledger: 账本, 'simple' 为 VectorLedger, 'matching' 为按A股规则撮合的 MatchingLedger,
+                       也可传入实现了 run_panel 的实例
+        """
+        self.broker = 'mock'
+        self.bar_type = bar_type
+        self.start_date = start_date
+        self.end_date = end_date
+        self.quotation = use_quotation(quotation) if isinstance(quotation, str) else quotation
+        self.user = None
+        self.context = Context(self.user, self.quotation)
+        self.log = MockLogHandler(context=self.context)
+        self.event_engine = EventEngine(name='vector_backtest')
+        self.quotation_engine = QuotationEngine(self.quotation, self.event_engine, bar_type=bar_type)
+        self.strategy: StrategyTemplate = strategy_class(self.user, self.log, self, params=params)
+        if symbols is None:
+            symbols = panel.symbols if panel is not None else self.quotation_engine.stocks
+        # QuotationEngine.stocks 为类属性, 各引擎共用, 复制后使用, 之后 watch 的标的不影响本次回测
+        self.symbols = list(symbols)
+        if ledger is None or ledger == 'simple':
+            ledger = VectorLedger(initial_cash=initial_cash, commission=commission)
+        elif ledger == 'matching':
+            ledger = MatchingLedger(initial_cash=initial_cash, fees=FeeSchedule(commission=commission))
+        self.ledger = ledger
+        self.panel = panel
+
+    @staticmethod
+    def supports(strategy_class):
+        """策略是否实现了向量化接口"""
+        return strategy_class.on_panel is not StrategyTemplate.on_panel
+
+    def load(self):
+        if self.panel is None:
+            self.panel = load_panel(self.quotation, self.symbols, self.start_date, self.end_date, unit=self.bar_type)
+        return self.panel
+
+    def start(self) -> VectorResult:
+        """ 启动回测 """
+        panel = self.load()
+        weights = self.strategy.on_panel(self.context, panel)
+        if weights is None:
+            raise ValueError('%s 未实现 on_panel, 不支持向量化回测' % type(self.strategy).__name__)
+        weights = np.asarray(weights, dtype=np.float64)
+        if weights.shape != panel.shape[:2]:
+            raise ValueError('on_panel 返回的权重形状 %s 与面板 %s 不一致' % (weights.shape, panel.shape[:2]))
+        arrays = self.ledger.run_panel(weights, panel)
+        minutes = etime.get_bar_minutes(self.bar_type)
+        return VectorResult(panel.times, panel.symbols, bars_per_day=240 // minutes if minutes else 1, **arrays)
+
+
+def backtest(strategy_class, start_date, end_date, bar_type="1d", quotation='jqdata', **kwargs):
+    """
+    回测入口, 策略实现了 on_panel 时使用向量化回测, 否则回退到事件驱动回测
+    :return: 向量化回测返回 VectorResult, 事件驱动回测返回引擎本身
+    """
+    if VectorBackTestEngine.supports(strategy_class):
+        engine = VectorBackTestEngine(strategy_class, start_date, end_date,
+                                      bar_type=bar_type, quotation=quotation, **kwargs)
+        return engine.start()
+
+    from .backtest_engine import BackTestEngine
+    engine = BackTestEngine(strategy_class, start_date, end_date, bar_type=bar_type, quotation=quotation)
+    engine.start()
+    return engine
@@ -1,11 +1,17 @@
+import asyncio
 import logging
-from datetime import datetime
+from datetime import datetime, time
 
 from app.core import trade_service
 from app.core.stock_service import StockService
 import pandas as pd
 from app.core.stock_cache import StockCache
 from app.core.log_config import setup_logger
+from app.core.tracing import tracer
+from easyquant.metrics import REGISTRY
+from easyquant.history_store import HistoryStore
+from easyquant.market_bus import (MarketBus, TOPIC_BOARDS, TOPIC_BOARD_CONS, TOPIC_RANKS, TOPIC_SPEED_RANKS,
+                                      TOPIC_QUOTES, topic_of)
 import akshare as ak
 
 logger = setup_logger(__name__)
@@ -13,51 +19,110 @@ logger = setup_logger(__name__)
 stock_api = StockService()
 trade_api = trade_service.TradeService()
 
-def handlebar(context):
+TICK_SECONDS = REGISTRY.histogram('first_board_tick_seconds', '每次 handlebar 的耗时(秒)', ['runner'])
+
+# 行情总线, 同一进程中的各个 handlebar 共用榜单和成分股快照, 不重复请求东方财富
+market_bus = MarketBus()
+# 按需拉取的榜单 / 成分股快照的有效秒数, 小于 tick 间隔, 每个 tick 仍取到新行情
+MARKET_MAX_AGE = 5
+# 报价用于计算下单价格, 只复用 1 秒内的快照
+QUOTE_MAX_AGE = 1
+
+
+# 策略只在 10:30 之前执行
+STRATEGY_END = time(10, 30)
+# 定时拉取的主题 -> 快照的有效秒数, 由 register_sources 设置, 这些主题在有效期内不再按需请求上游
+_source_max_age = {}
+
+
+def _in_strategy_window(context=None, now=None):
+    """是否在策略的执行时段内, 不输出日志, 供定时拉取判断"""
+    now = now or datetime.now()
+    if context is not None and not context.is_trade_date(now):
+        return False
+    return stock_api.is_trade_time(now.time()) and now.time() < STRATEGY_END
+
+
+def register_sources(context=None, tick_interval=10, bus=None):
+    """
+    在运行 handlebar 的进程中注册板块榜、涨幅榜和涨速榜的定时拉取, 由总线的拉取线程统一请求上游,
+    各 handlebar 直接使用快照; 成分股和报价取决于当次筛选结果, 仍按需拉取.
+    只在策略执行时段内拉取, 每个 tick 间隔拉取一次, 与不注册时单个 handlebar 的请求量相同
+    :param context: StockCache, 用于判断交易日
+    :param tick_interval: handlebar 的执行间隔(秒)
+    """
+    bus = bus or market_bus
+
+    def in_window(fetch):
+        # 时段外返回 None, 总线不发布
+        return lambda: fetch() if _in_strategy_window(context) else None
+
+    sources = {
+        TOPIC_BOARDS: stock_api.get_board_concept_stock_top_ten,
+        topic_of(TOPIC_RANKS, 'sh'): stock_api.get_stock_sh_zs_rank,
+        topic_of(TOPIC_RANKS, 'sz'): stock_api.get_stock_sz_zs_rank,
+        topic_of(TOPIC_SPEED_RANKS, 'sh'): stock_api.get_stock_sh_zs_speed_rank,
+        topic_of(TOPIC_SPEED_RANKS, 'sz'): stock_api.get_stock_sz_zs_speed_rank,
+    }
+    for topic, fetch in sources.items():
+        bus.add_source(topic, in_window(fetch), tick_interval)
+        # 快照最长为上一次拉取的结果, 留出 MARKET_MAX_AGE 的余量容纳拉取耗时和调度抖动
+        _source_max_age[topic] = tick_interval + MARKET_MAX_AGE
+    bus.start()
+    return bus
+
+
+def _market(topic, fetch, *args, max_age=MARKET_MAX_AGE):
+    """经行情总线取行情, 返回的快照由各订阅者共用, 不可修改"""
+    return market_bus.get(topic, lambda: fetch(*args), max(max_age, _source_max_age.get(topic, 0)))
+
+
+async def _market_async(topic, fetch, *args, max_age=MARKET_MAX_AGE):
+    return await market_bus.aget(topic, lambda: fetch(*args), max(max_age, _source_max_age.get(topic, 0)))
+
+def _can_run(context):
+    """是否在策略的执行时段内"""
     logger.info("开始交易-----")
-    trading_calendar = context.get_trading_calendar()
-    if trading_calendar.empty:
-        trading_calendar = stock_api.is_trade_date(date=datetime.now().strftime('%Y-%m-%d'))
-        context.update_trading_calendar()
-    if  trading_calendar.empty:
-        logger.info("非交易日，不执行策略")
-        return
-    if datetime.now().strftime('%Y-%m-%d') not in trading_calendar['jyrq'].values:
+    if not context.is_trade_date(datetime.now()):
         logger.info("非交易日，不执行策略")
-        return
-    
+        return False
+
     now_time = datetime.now().time()
     if not stock_api.is_trade_time(now_time):
         logger.info("非交易时间，不执行策略")
-        return
+        return False
     logger.info("交易日，执行策略")
     # 如果超过10点半，则不执行策略
-    now = datetime.now()
-    if now.hour > 10 or (now.hour == 10 and now.minute >= 30):
+    if datetime.now().time() >= STRATEGY_END:
         logger.info("超过10点半,不执行策略")
-        return
+        return False
 
     logger.info("在交易时间，执行策略")
-    # 从缓存中加载昨日涨停股票池、持仓和余额信息
-    yesterday_limit_up_stocks, position, balance = context.load_stocks_from_cache()
+    return True
 
-    dt_limit_up_stocks = context.get_yesterday_limit_down_stocks()
 
+# 每个板块今日最多买入的股票数
+BOARD_BUY_LIMIT = 2
 
-    board_concept_df = stock_api.get_board_concept_stock_top_ten()
-    if board_concept_df is None or not isinstance(board_concept_df, pd.DataFrame) or board_concept_df.empty:
-        logger.error("未能获取有效的板块概念股票前十数据，跳过后续处理")
-        return
-    # 每个板块获取前10只股票
-    board_concept_stocks_df = pd.DataFrame()
-    for _, row in board_concept_df.iterrows():
-        # 今日如果某个板块已经买过2只股票，则这个板块就不买了
-        if context.get_today_buy_board_id(row['f12']) >= 2:
-            continue
-        temp_df = stock_api.get_board_concept_stock_cons_top_twenty(row['f12'])
-        # 添加板块id列
-        temp_df['board_id'] = row['f12']
-        board_concept_stocks_df = pd.concat([board_concept_stocks_df, temp_df], ignore_index=True)
+
+def _board_ids(context, board_concept_df):
+    """
+    需要获取成分股的板块, 今日如果某个板块已经买过2只股票，则这个板块就不买了
+    读取的是近端缓存, 只用于减少请求, 下单前由 reserve_buy 在缓存后端中确认额度
+    """
+    return [board_id for board_id in board_concept_df['f12']
+            if context.get_today_buy_board_id(board_id) < BOARD_BUY_LIMIT]
+
+
+def screen_stocks(context, yesterday_limit_up_stocks, dt_limit_up_stocks, board_concept_stocks_df,
+                  stock_gain_df, stock_speed_df):
+    """
+    按首板规则筛选待买入的股票, 同步和异步两种运行方式共用
+    :param board_concept_stocks_df: 各板块成分股, 带 board_id 列
+    :param stock_gain_df: 涨幅榜 上证前50只+深圳前50只
+    :param stock_speed_df: 涨速榜 上证前10只+深圳前10只
+    :return: 符合条件的股票 DataFrame
+    """
     board_concept_stocks_df = board_concept_stocks_df.drop_duplicates(subset='f12')
     # 排除昨日涨停的股票池, 首板
     board_concept_stocks_df = board_concept_stocks_df[~board_concept_stocks_df['f12'].isin(yesterday_limit_up_stocks['c'])]
@@ -82,27 +147,103 @@ def handlebar(context):
     main_board_condition = (board_concept_stocks_df['f12'].str.startswith('60') | board_concept_stocks_df['f12'].str.startswith('00')) & (board_concept_stocks_df['f3'] >= 950)
     gem_condition = (board_concept_stocks_df['f12'].str.startswith('30')) & (board_concept_stocks_df['f3'] >= 1950)
     board_concept_stocks_df = board_concept_stocks_df[main_board_condition | gem_condition]
-    
-    # 获取涨幅榜 上证前50只+深圳前50只
-    stock_gain_df = pd.DataFrame(stock_api.get_stock_sh_zs_rank())
-    stock_gain_df = pd.concat([stock_gain_df, pd.DataFrame(stock_api.get_stock_sz_zs_rank())])
 
     # 排除地天板， 主板振幅小于19%， 创业板振幅小于38% 
     main_board_condition_stock_gain_df = (stock_gain_df['f12'].str.startswith('60') | stock_gain_df['f12'].str.startswith('00')) & (stock_gain_df['f7'] < 1900)
     gem_condition_stock_gain_df = (stock_gain_df['f12'].str.startswith('30')) & (stock_gain_df['f7'] < 3800)
     stock_gain_df = stock_gain_df[main_board_condition_stock_gain_df | gem_condition_stock_gain_df]
 
-    # 获取涨速榜 上证前10只+深圳前10只
-    stock_speed_df = pd.DataFrame(stock_api.get_stock_sh_zs_speed_rank())
-    stock_speed_df = pd.concat([stock_speed_df, pd.DataFrame(stock_api.get_stock_sz_zs_speed_rank())])
-
     # 三个数据集取交集，以股票代码为基准
     board_concept_stocks_df = pd.merge(board_concept_stocks_df, stock_gain_df, on='f12', how='inner')
     board_concept_stocks_df = pd.merge(board_concept_stocks_df, stock_speed_df, on='f12', how='inner')
 
     # 排除今日已经买进的股票
-    board_concept_stocks_df = board_concept_stocks_df[~board_concept_stocks_df['f12'].isin(context.get_today_buy_stocks())]
+    return board_concept_stocks_df[~board_concept_stocks_df['f12'].isin(context.get_today_buy_stocks())]
+
+
+def buy_stock(context, row, bid_df, balance):
+    """
+    以涨停价买入一只股票, 每只股票买一万
+    :param bid_df: 该股票的行情报价
+    :return: 买入后的余额
+    """
+    stock_code = row['f12']
+    # 确保 zt_price 是一个有效的数值
+    if 'f51' in bid_df.columns:
+        zt_price = bid_df['f51'].values[0] if len(bid_df['f51'].values) > 0 else 0
+    else:
+        logger.warning(f"未能获取股票 {stock_code} 的涨停价格，跳过买入")
+        return balance
+    # 1万元，以涨停价买入，买入数量为100及其整数倍
+    if zt_price > 0:
+        # 修改此处，确保 buy_num 是 100 的整数倍
+        buy_num = (int(10000 / zt_price) // 100) * 100
+        # 下单前预占股票和板块额度, 多个进程 / 线程同时筛选到同一只股票时只有一个下单
+        if not context.reserve_buy(stock_code, row['board_id'], BOARD_BUY_LIMIT):
+            return balance
+        # 下单抛出异常时委托可能已提交, 保留预占, 不再重复买入
+        buy_resp = trade_api.buy_stock(stock_code=stock_code,price=zt_price, amount=buy_num)
+        if buy_resp and buy_resp.get('code') == 0:
+            logger.info("买入成功，股票代码：%s,买入数量：%s,买入价格:%s", stock_code, buy_num, zt_price)
+            balance = balance - buy_num * zt_price
+            # 在缓存后端的余额上扣减, 不以本进程读到的余额覆盖其它进程的扣减
+            context.deduct_balance(buy_num * zt_price)
+            logger.info("今天买入的股票池：%s", context.get_today_buy_stocks())         
+        else:
+            context.release_buy(stock_code, row['board_id'])
+            logger.error("买入失败，股票代码：%s,买入数量：%s,买入价格:%s", stock_code, buy_num, zt_price)
+    else:
+        logger.warning(f"股票 {stock_code} 的涨停价格为 0，跳过买入")
+    return balance
+
+
+def handlebar(context):
+    with TICK_SECONDS.labels('sync').time(), tracer.trace('handlebar'):
+        _handlebar(context)
 
+
+def _handlebar(context):
+    with tracer.span('can_run'):
+        if not _can_run(context):
+            return
+    with tracer.span('load_cache'):
+        # 从缓存中加载昨日涨停股票池、持仓和余额信息
+        yesterday_limit_up_stocks, position, balance = context.load_stocks_from_cache()
+
+        dt_limit_up_stocks = context.get_yesterday_limit_down_stocks()
+
+
+    with tracer.span('board_top_ten'):
+        board_concept_df = _market(TOPIC_BOARDS, stock_api.get_board_concept_stock_top_ten)
+    if board_concept_df is None or not isinstance(board_concept_df, pd.DataFrame) or board_concept_df.empty:
+        logger.error("未能获取有效的板块概念股票前十数据，跳过后续处理")
+        return
+    # 每个板块获取前10只股票
+    board_concept_stocks_df = pd.DataFrame()
+    with tracer.span('board_cons_all'):
+        for board_id in _board_ids(context, board_concept_df):
+            with tracer.span('board_cons', board_id=board_id):
+                temp_df = _market(topic_of(TOPIC_BOARD_CONS, board_id),
+                                  stock_api.get_board_concept_stock_cons_top_twenty, board_id)
+            # 添加板块id列, 快照共用, 在副本上添加
+            temp_df = temp_df.assign(board_id=board_id)
+            board_concept_stocks_df = pd.concat([board_concept_stocks_df, temp_df], ignore_index=True)
+
+    with tracer.span('gain_rank'):
+        # 获取涨幅榜 上证前50只+深圳前50只
+        stock_gain_df = pd.DataFrame(_market(topic_of(TOPIC_RANKS, 'sh'), stock_api.get_stock_sh_zs_rank))
+        stock_gain_df = pd.concat([stock_gain_df,
+                                   pd.DataFrame(_market(topic_of(TOPIC_RANKS, 'sz'), stock_api.get_stock_sz_zs_rank))])
+
+    with tracer.span('speed_rank'):
+        # 获取涨速榜 上证前10只+深圳前10只
+        stock_speed_df = pd.DataFrame(_market(topic_of(TOPIC_SPEED_RANKS, 'sh'), stock_api.get_stock_sh_zs_speed_rank))
+        stock_speed_df = pd.concat([stock_speed_df, pd.DataFrame(
+            _market(topic_of(TOPIC_SPEED_RANKS, 'sz'), stock_api.get_stock_sz_zs_speed_rank))])
+
+    with tracer.span('screen'):
+        board_concept_stocks_df = screen_stocks(context, yesterday_limit_up_stocks, dt_limit_up_stocks,
+                                                board_concept_stocks_df, stock_gain_df, stock_speed_df)
     if board_concept_stocks_df.empty:
         logger.info("没有符合条件的股票")
         return
@@ -110,44 +251,119 @@ def handlebar(context):
         logger.info("符合条件的股票：%s", board_concept_stocks_df)
     # 买入board_concept_stocks_df中的股票,每个股票买一万。
     for _, row in board_concept_stocks_df.iterrows():
-        stock_code = row['f12']
-        bid_df = stock_api.stock_bid_ask_em(symbol=stock_code)
-        # 确保 zt_price 是一个有效的数值
-        if 'f51' in bid_df.columns:
-            zt_price = bid_df['f51'].values[0] if len(bid_df['f51'].values) > 0 else 0
-        else:
-            logger.warning(f"未能获取股票 {stock_code} 的涨停价格，跳过买入")
-            continue
-        # 1万元，以涨停价买入，买入数量为100及其整数倍
-        if zt_price > 0:
-            # 修改此处，确保 buy_num 是 100 的整数倍
-            buy_num = (int(10000 / zt_price) // 100) * 100
-            buy_resp = trade_api.buy_stock(stock_code=stock_code,price=zt_price, amount=buy_num)
-            if buy_resp and buy_resp.get('code') == 0:
-                logger.info("买入成功，股票代码：%s,买入数量：%s,买入价格:%s", stock_code, buy_num, zt_price)
-                balance = balance - buy_num * zt_price
-                context.set_balance(balance)
-                context.append_today_buy_stock(stock_code)
-                context.append_today_buy_board_id(row['board_id'])
-                logger.info("今天买入的股票池：%s", context.get_today_buy_stocks())         
-            else:
-                logger.error("买入失败，股票代码：%s,买入数量：%s,买入价格:%s", stock_code, buy_num, zt_price)
-        else:
-            logger.warning(f"股票 {stock_code} 的涨停价格为 0，跳过买入")
+        with tracer.span('bid_ask', stock_code=row['f12']):
+            bid_df = _market(topic_of(TOPIC_QUOTES, row['f12']), stock_api.stock_bid_ask_em, row['f12'],
+                             max_age=QUOTE_MAX_AGE)
+        with tracer.span('buy_stock', stock_code=row['f12']):
+            balance = buy_stock(context, row, bid_df, balance)
         # context.update_cache()
 
+
+async def handlebar_async(context, api):
+    """
+    handlebar 的异步版本, 各板块成分股、涨幅榜、涨速榜和报价并发请求, 筛选和下单与 handlebar 相同
+    :param api: AsyncStockService
+    """
+    with TICK_SECONDS.labels('async').time(), tracer.trace('handlebar_async'):
+        await _handlebar_async(context, api)
+
+
+async def _traced(name, awaitable, **tags):
+    # 并发请求各自记录一个 span
+    with tracer.span(name, **tags):
+        return await awaitable
+
+
+def _load_cache(context):
+    # 从缓存中加载昨日涨停股票池、持仓和余额信息, 以及昨日跌停股票池
+    yesterday_limit_up_stocks, position, balance = context.load_stocks_from_cache()
+    return yesterday_limit_up_stocks, balance, context.get_yesterday_limit_down_stocks()
+
+
+# 已提交的下单任务, tick 超时被取消时下单不随之取消, 由 settle_orders 等待其结束
+_order_tasks = set()
+
+
+async def _place_orders(context, rows, bids, balance):
+    loop = asyncio.get_event_loop()
+    for row, bid_df in zip(rows, bids):
+        with tracer.span('buy_stock', stock_code=row['f12']):
+            # 下单为同步请求, 放到线程池中执行, 不阻塞事件循环
+            balance = await loop.run_in_executor(None, buy_stock, context, row, bid_df, balance)
+    return balance
+
+
+async def settle_orders():
+    """
+    等待已提交的下单全部结束
+    tick 超时后下单线程仍在执行, 买入记录尚未写入缓存, 调度方须在开始下一个 tick 前调用, 避免重复买入
+    """
+    while _order_tasks:
+        results = await asyncio.gather(*list(_order_tasks), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error("下单异常: %s", result)
+
+
+async def _handlebar_async(context, api):
+    # 读取缓存可能访问 Redis, 与下单一样放到线程池中执行, 不阻塞事件循环
+    loop = asyncio.get_event_loop()
+    with tracer.span('can_run'):
+        if not await loop.run_in_executor(None, _can_run, context):
+            return
+    with tracer.span('load_cache'):
+        yesterday_limit_up_stocks, balance, dt_limit_up_stocks = await loop.run_in_executor(None, _load_cache, context)
+
+    with tracer.span('fetch_ranks'):
+        board_concept_df, sh_gain, sz_gain, sh_speed, sz_speed = await asyncio.gather(
+            _traced('board_top_ten', _market_async(TOPIC_BOARDS, api.get_board_concept_stock_top_ten)),
+            _traced('gain_rank', _market_async(topic_of(TOPIC_RANKS, 'sh'), api.get_stock_sh_zs_rank)),
+            _traced('gain_rank', _market_async(topic_of(TOPIC_RANKS, 'sz'), api.get_stock_sz_zs_rank)),
+            _traced('speed_rank', _market_async(topic_of(TOPIC_SPEED_RANKS, 'sh'), api.get_stock_sh_zs_speed_rank)),
+            _traced('speed_rank', _market_async(topic_of(TOPIC_SPEED_RANKS, 'sz'), api.get_stock_sz_zs_speed_rank)))
+    if board_concept_df is None or not isinstance(board_concept_df, pd.DataFrame) or board_concept_df.empty:
+        logger.error("未能获取有效的板块概念股票前十数据，跳过后续处理")
+        return
+
+    board_ids = await loop.run_in_executor(None, _board_ids, context, board_concept_df)
+    with tracer.span('board_cons_all'):
+        cons = await asyncio.gather(*[_traced('board_cons', _market_async(
+            topic_of(TOPIC_BOARD_CONS, board_id), api.get_board_concept_stock_cons_top_twenty, board_id),
+            board_id=board_id) for board_id in board_ids])
+    frames = []
+    for board_id, temp_df in zip(board_ids, cons):
+        if temp_df is None:
+            continue
+        # 添加板块id列, 快照共用, 在副本上添加
+        frames.append(temp_df.assign(board_id=board_id))
+    board_concept_stocks_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    with tracer.span('screen'):
+        stock_gain_df = pd.concat([pd.DataFrame(sh_gain), pd.DataFrame(sz_gain)])
+        stock_speed_df = pd.concat([pd.DataFrame(sh_speed), pd.DataFrame(sz_speed)])
+        # 排除今日已买入的股票时读取缓存
+        board_concept_stocks_df = await loop.run_in_executor(
+            None, screen_stocks, context, yesterday_limit_up_stocks, dt_limit_up_stocks,
+            board_concept_stocks_df, stock_gain_df, stock_speed_df)
+    if board_concept_stocks_df.empty:
+        logger.info("没有符合条件的股票")
+        return
+    logger.info("符合条件的股票：%s", board_concept_stocks_df)
+
+    rows = [row for _, row in board_concept_stocks_df.iterrows()]
+    with tracer.span('bid_ask_all'):
+        bids = await asyncio.gather(*[_traced('bid_ask', _market_async(
+            topic_of(TOPIC_QUOTES, row['f12']), api.stock_bid_ask_em, row['f12'], max_age=QUOTE_MAX_AGE),
+            stock_code=row['f12']) for row in rows])
+    # 开始下单后 tick 超时也不取消, 已在途的委托须等待其结果并写入买入记录
+    task = asyncio.ensure_future(_place_orders(context, rows, bids, balance))
+    _order_tasks.add(task)
+    task.add_done_callback(_order_tasks.discard)
+    await asyncio.shield(task)
+
 if __name__ == "__main__":
-    stock_a_df = ak.stock_zh_a_hist(symbol='002734', period='daily', start_date='20250401', end_date='20250430')
-    # 重命名列名以匹配分析需求
-    stock_a_df = stock_a_df.rename(columns={
-        "日期": "date",
-        "开盘": "open",
-        "收盘": "close",
-        "最高": "high",
-        "最低": "low",
-        "成交量": "volume"
-    })
-    stock_a_df['date'] = pd.to_datetime(stock_a_df['date'])
+    # 经本地历史库缓存, 只下载本地缺失的日期, 列名已统一为英文
+    stock_a_df = HistoryStore().frame('002734', '20250401', '20250430').reset_index()
     # 数据类型转换
     numeric_columns = ['open', 'close', 'high', 'low', 'volume']
     stock_a_df[numeric_columns] = stock_a_df[numeric_columns].apply(pd.to_numeric, errors='coerce')
@@ -2,17 +2,23 @@ import sys
 import os
 # 将项目根目录添加到 sys.path 中
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# easyquant 只以 easyquant. 导入, app 目录需在 sys.path 中, 否则同一模块会以 app.easyquant. 再加载一份,
+# 交易日历、指标注册表等进程内单例随之分裂
+if os.path.dirname(os.path.abspath(__file__)) not in sys.path:
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 import time
 import logging
 from logging.handlers import TimedRotatingFileHandler
 from datetime import datetime
 import app.first_board as first_board
 # 导入缓存类
-from app.core.stock_cache import StockCache
+from app.core.redis_stock_cache import create_stock_cache
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 import app.core.stock_service as stock_service
 from app.core.log_config import setup_logger
+from app.core.tracing import tracer, format_report
+from easyquant.metrics import start_http_server
 
 
 # 配置日志
@@ -33,12 +39,18 @@ log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 log_handler.setFormatter(log_formatter)
 logger.addHandler(log_handler)
 
-# 创建缓存类实例
-context = StockCache()
+# 本地指标接口, curl http://127.0.0.1:9108/metrics
+METRICS_PORT = int(os.environ.get('QUANT_METRICS_PORT', 9108))
+
+# 创建缓存类实例, 设置 QUANT_REDIS_CONF 为 RedisIo 配置文件时多个进程共用 Redis 中的缓存
+context = create_stock_cache(os.environ.get('QUANT_REDIS_CONF'))
 # context.update_cache()
 
 stock_api = stock_service.StockService()
 
+# 选股 tick 间隔秒数
+TICK_INTERVAL = 10
+
 scheduler = BackgroundScheduler()
 
 
@@ -49,7 +61,7 @@ scheduler.add_job(context.update_cache, CronTrigger(day_of_week='mon-fri', hour=
 # 定义添加间隔任务的函数
 def add_interval_job():
     # 修改 args 参数，确保传递的是一个元组
-    scheduler.add_job(first_board.handlebar, 'interval', seconds=10, args=(context,))
+    scheduler.add_job(first_board.handlebar, 'interval', seconds=TICK_INTERVAL, args=(context,))
 
 
 # 仅在工作日 9:30 和 13:00 添加间隔任务
@@ -68,14 +80,43 @@ def remove_interval_jobs():
 scheduler.add_job(remove_interval_jobs, CronTrigger(day_of_week='mon-fri', hour=11, minute=30))
 scheduler.add_job(remove_interval_jobs, CronTrigger(day_of_week='mon-fri', hour=15, minute=0))
 
-context.update_cache()
 
-scheduler.start()
+# 导出本时段的分段耗时追踪, 并输出各步骤的 p50/p95/p99
+def export_traces():
+    stats = tracer.report()
+    if not stats:
+        return
+    logger.info("handlebar 各步骤耗时:\n%s", format_report(stats))
+    trace_file = os.path.join(log_dir, f"trace_{datetime.now().strftime('%Y%m%d')}.jsonl")
+    tracer.export_jsonl(trace_file)
+
+
+scheduler.add_job(export_traces, CronTrigger(day_of_week='mon-fri', hour=11, minute=31))
+scheduler.add_job(export_traces, CronTrigger(day_of_week='mon-fri', hour=15, minute=1))
+
+
+def main():
+    # 指标接口只在作为程序运行时启动, 导入本模块不占用端口
+    try:
+        start_http_server(METRICS_PORT)
+    except OSError as e:
+        logger.warning("指标接口端口 %s 启动失败: %s", METRICS_PORT, e)
+
+    context.update_cache()
+
+    # 榜单由行情总线定时拉取, 各 handlebar 共用
+    first_board.register_sources(context, TICK_INTERVAL)
+    scheduler.start()
+
+    try:
+        while True:
+            time.sleep(1)
+    except (KeyboardInterrupt, SystemExit):
+        scheduler.shutdown()
+        first_board.market_bus.stop()
+
 
-try:
-    while True:
-        time.sleep(1)
-except (KeyboardInterrupt, SystemExit):
-    scheduler.shutdown()
+if __name__ == '__main__':
+    main()
 
 
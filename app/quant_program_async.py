@@ -0,0 +1,230 @@
+import sys
+import os
+# 将项目根目录添加到 sys.path 中
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# easyquant 只以 easyquant. 导入, app 目录需在 sys.path 中, 否则同一模块会以 app.easyquant. 再加载一份,
+# 交易日历、指标注册表等进程内单例随之分裂
+if os.path.dirname(os.path.abspath(__file__)) not in sys.path:
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import argparse
+import asyncio
+import logging
+from datetime import datetime, time, timedelta
+
+import app.first_board as first_board
+from app.core.async_stock_service import AsyncStockService
+from app.core.log_config import setup_logger
+from app.core.redis_stock_cache import create_stock_cache
+from app.core.tracing import tracer, format_report
+from easyquant.metrics import start_http_server
+
+# quant_program 的 asyncio 版本
+# 会话调度、缓存刷新和选股 tick 都是同一个事件循环上的协程, 不再依赖 APScheduler 的线程池和每日增删任务.
+# tick 按会话开始时间对齐的固定格点调度, 上一个 tick 未结束时跳过或合并迟到的 tick, 每个 tick 有截止时间.
+# python app/quant_program_async.py --interval 10 --deadline 8 --overlap skip
+
+logger = setup_logger(__name__)
+logger.setLevel(logging.INFO)
+
+# 工作日 9:15 刷新缓存
+CACHE_REFRESH_TIME = time(9, 15)
+# 执行选股 tick 的时段
+SESSIONS = (
+    (time(9, 30), time(11, 30)),
+    (time(13, 0), time(15, 0)),
+)
+
+
+def next_run(at, until=None, now=None):
+    """
+    下一次在工作日 at 时刻运行的时间
+    :param until: 传入时, 若当前处于工作日的 [at, until) 内则立即运行, 用于盘中重启后直接进入会话
+    """
+    now = now or datetime.now()
+    day = now.date()
+    while True:
+        start = datetime.combine(day, at)
+        if day.weekday() < 5:
+            if until is not None and start <= now < datetime.combine(day, until):
+                return now
+            if start > now:
+                return start
+        day += timedelta(days=1)
+
+
+async def sleep_until(when):
+    """按墙上时钟等待, 分段睡眠以免长时间等待期间系统时间调整带来偏差"""
+    while True:
+        remaining = (when - datetime.now()).total_seconds()
+        if remaining <= 0:
+            return
+        await asyncio.sleep(min(remaining, 60))
+
+
+class Ticker:
+    """
+    固定间隔执行协程
+    tick 时刻为会话开始时间加整数倍间隔, 由事件循环的单调时钟计时, 调度抖动为毫秒级.
+    overlap='skip' 时上一个 tick 未结束则跳过本次; 'coalesce' 时多个迟到的 tick 合并为一次, 在上一个结束后立即执行.
+    """
+
+    def __init__(self, func, interval=10, deadline=None, overlap='skip', settle=None):
+        """
+        :param func: 无参数的协程函数
+        :param interval: 间隔秒数
+        :param deadline: 单个 tick 的最长执行秒数, 超时取消, None 不限制
+        :param overlap: 'skip' 或 'coalesce'
+        :param settle: 无参数的协程函数, 每个 tick 结束(含超时取消)后等待其完成才视为 tick 结束,
+                       用于等待 func 中以 asyncio.shield 保护、不随超时取消的下单
+        """
+        if overlap not in ('skip', 'coalesce'):
+            raise ValueError('overlap 只支持 skip / coalesce')
+        self.func = func
+        self.interval = interval
+        self.deadline = deadline
+        self.overlap = overlap
+        self.settle = settle
+        self._late = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.ticks = 0
+        self.skipped = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.samples = 0
+        self.max_jitter = 0.0
+        self.total_jitter = 0.0
+
+    async def _run_once(self):
+        self.ticks += 1
+        try:
+            if self.deadline is None:
+                await self.func()
+            else:
+                await asyncio.wait_for(self.func(), self.deadline)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning("tick 超过截止时间 %s 秒, 已取消, 已提交的下单继续执行", self.deadline)
+        except Exception as e:
+            self.errors += 1
+            logger.exception("tick 执行异常: %s", e)
+        if self.settle is not None:
+            await self.settle()
+
+    async def _tick(self):
+        while True:
+            self._late = False
+            await self._run_once()
+            if not self._late:
+                return
+            # 执行期间有 tick 迟到, 合并为一次立即执行
+            self.coalesced += 1
+
+    async def run(self, until):
+        """
+        执行到 until(datetime) 为止, 返回前等待正在执行的 tick 结束
+        """
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        end = start + (until - datetime.now()).total_seconds()
+        running = None
+        n = 0
+        while True:
+            scheduled = start + n * self.interval
+            if scheduled >= end:
+                break
+            delay = scheduled - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            jitter = loop.time() - scheduled
+            self.max_jitter = max(self.max_jitter, jitter)
+            self.total_jitter += jitter
+            self.samples += 1
+            if running is not None and not running.done():
+                if self.overlap == 'coalesce':
+                    self._late = True
+                else:
+                    self.skipped += 1
+            else:
+                running = loop.create_task(self._tick())
+            # 事件循环被阻塞超过一个间隔时, 跳过已错过的格点
+            n = max(n + 1, int((loop.time() - start) // self.interval) + 1)
+        if running is not None:
+            await running
+
+    def summary(self):
+        return "tick %d 次, 跳过 %d, 合并 %d, 超时 %d, 异常 %d, 调度抖动 平均 %.1f ms / 最大 %.1f ms" % (
+            self.ticks, self.skipped, self.coalesced, self.timeouts, self.errors,
+            self.total_jitter / max(self.samples, 1) * 1000, self.max_jitter * 1000)
+
+
+def export_traces():
+    # 导出本时段的分段耗时追踪, 并输出各步骤的 p50/p95/p99
+    stats = tracer.report()
+    if not stats:
+        return
+    logger.info("handlebar 各步骤耗时:\n%s", format_report(stats))
+    log_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'log')
+    os.makedirs(log_dir, exist_ok=True)
+    tracer.export_jsonl(os.path.join(log_dir, 'trace_%s.jsonl' % datetime.now().strftime('%Y%m%d')))
+
+
+async def refresh_cache(context):
+    # StockCache.update_cache 为同步请求, 放到线程池中执行
+    await asyncio.get_event_loop().run_in_executor(None, context.update_cache)
+
+
+async def cache_loop(context):
+    while True:
+        await sleep_until(next_run(CACHE_REFRESH_TIME))
+        logger.info("刷新缓存")
+        await refresh_cache(context)
+
+
+async def session_loop(ticker, start, end):
+    while True:
+        await sleep_until(next_run(start, until=end))
+        logger.info("进入交易时段 %s-%s", start, end)
+        ticker.reset_stats()
+        await ticker.run(datetime.combine(datetime.now().date(), end))
+        logger.info("交易时段 %s-%s 结束, %s", start, end, ticker.summary())
+        export_traces()
+
+
+async def main(interval=10, deadline=8, overlap='skip', metrics_port=9108):
+    if metrics_port:
+        try:
+            start_http_server(metrics_port)
+        except OSError as e:
+            logger.warning("指标接口端口 %s 启动失败: %s", metrics_port, e)
+    # 设置 QUANT_REDIS_CONF 为 RedisIo 配置文件时多个进程共用 Redis 中的缓存
+    context = create_stock_cache(os.environ.get('QUANT_REDIS_CONF'))
+    api = AsyncStockService()
+    # 榜单由行情总线的拉取线程定时请求, 各 tick 直接使用快照
+    first_board.register_sources(context, interval)
+    try:
+        await refresh_cache(context)
+        tasks = [cache_loop(context)]
+        for start, end in SESSIONS:
+            ticker = Ticker(lambda: first_board.handlebar_async(context, api), interval=interval,
+                            deadline=deadline, overlap=overlap, settle=first_board.settle_orders)
+            tasks.append(session_loop(ticker, start, end))
+        await asyncio.gather(*tasks)
+    finally:
+        first_board.market_bus.stop()
+        await api.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='首板策略 asyncio 运行器')
+    parser.add_argument('--interval', type=float, default=10, help='tick 间隔秒数')
+    parser.add_argument('--deadline', type=float, default=8, help='单个 tick 的截止秒数, 0 为不限制')
+    parser.add_argument('--overlap', choices=('skip', 'coalesce'), default='skip', help='上一个 tick 未结束时的处理方式')
+    parser.add_argument('--metrics-port', type=int, default=9108, help='本地指标接口端口, 0 为不启动')
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args.interval, args.deadline or None, args.overlap, args.metrics_port))
+    except (KeyboardInterrupt, SystemExit):
+        pass
@@ -1,44 +1,36 @@
+import os
+
 import backtrader as bt
 import pandas as pd
-import akshare as ak  # 需安装：pip install akshare
+
+# 设置该环境变量(共享内存名称或面板目录)时, 直接挂载已发布的K线面板, 不再从 AKShare 下载
+PANEL_ENV = 'EASYQUANT_PANEL'
+
+
+def get_panel_data(stock_code, start_date, end_date):
+    """
+    从已发布的K线面板只读读取数据, 见 easyquant.panel
+    :return: 以日期为索引的 DataFrame, 数据与共享内存共用
+    """
+    from easyquant.panel import open_panel
+
+    frame = open_panel(os.environ[PANEL_ENV]).symbol_frame(stock_code)
+    # 只按行切片, PandasData 按列名取字段, 不重排列以免复制
+    return frame.loc[pd.Timestamp(start_date):pd.Timestamp(end_date)]
 
 
 # ==================== 数据获取与预处理（AKShare版本） ====================
 def get_akshare_data(stock_code, start_date, end_date):
     """
-    使用AKShare获取美股日线数据并处理为backtrader兼容格式
+    使用AKShare获取美股日线数据(前复权), 经本地历史库缓存, 只下载本地缺失的日期
     :param stock_code: 美股代码（如'AAPL'）
     :param start_date: 开始日期（格式'YYYYMMDD'）
     :param end_date: 结束日期（格式'YYYYMMDD'）
+    :return: 以日期为索引的 DataFrame, 列为 open / high / low / close / volume
     """
-    # 获取美股日线数据（前复权）
-    stock_data = ak.stock_us_daily(
-        symbol=stock_code,
-        start_date=start_date,
-        end_date=end_date,
-        adjust="qfq"  # 前复权处理（消除除权除息影响）
-    )
-    
-    # 重命名列名（backtrader需要'datetime'/'open'/'high'/'low'/'close'/'volume'）
-    stock_data.rename(columns={
-        "日期": "datetime",
-        "开盘价": "open",
-        "最高价": "high",
-        "最低价": "low",
-        "收盘价": "close",
-        "成交量": "volume"
-    }, inplace=True)
-    
-    # 转换日期格式并设置为索引
-    stock_data['datetime'] = pd.to_datetime(stock_data['datetime'])
-    stock_data.set_index('datetime', inplace=True)
-    
-    # 保留backtrader需要的列（按顺序）
-    stock_data = stock_data[['open', 'high', 'low', 'close', 'volume']]
-    
-    # 保存为CSV（backtrader支持从CSV加载数据）
-    stock_data.to_csv(f'{stock_code}.csv')
-    return stock_data
+    from easyquant.history_store import HistoryStore
+
+    return HistoryStore().frame(stock_code, start_date, end_date, adjust='qfq')
 
 
 # ==================== 策略定义（与原逻辑一致） ====================
@@ -90,24 +82,16 @@ if __name__ == "__main__":
     start_date = '20200101'      # 开始日期（格式YYYYMMDD）
     end_date = '20240101'        # 结束日期（格式YYYYMMDD）
     
-    # 步骤1：使用AKShare获取并处理数据
-    data_df = get_akshare_data(stock_code, start_date, end_date)
-    
     # 步骤2：初始化backtrader
     cerebro = bt.Cerebro()
     
-    # 步骤3：加载数据（从AKShare生成的CSV文件）
-    data = bt.feeds.GenericCSVData(
-        dataname=f'{stock_code}.csv',
-        dtformat=('%Y-%m-%d'),     # 日期格式
-        datetime=0,                # 'datetime'列的位置（第0列）
-        open=1,                    # 'open'列的位置（第1列）
-        high=2,                    # 'high'列的位置（第2列）
-        low=3,                     # 'low'列的位置（第3列）
-        close=4,                   # 'close'列的位置（第4列）
-        volume=5,                  # 'volume'列的位置（第5列）
-        openinterest=-1            # 无持仓兴趣数据（-1表示忽略）
-    )
+    # 步骤1/3：已发布K线面板时直接挂载, 否则使用AKShare获取并处理数据
+    if os.environ.get(PANEL_ENV):
+        data_df = get_panel_data(stock_code, start_date, end_date)
+        data = bt.feeds.PandasData(dataname=data_df)
+    else:
+        data_df = get_akshare_data(stock_code, start_date, end_date)
+        data = bt.feeds.PandasData(dataname=data_df)
     cerebro.adddata(data)
     
     # 步骤4：添加策略